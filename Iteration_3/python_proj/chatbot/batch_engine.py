@@ -0,0 +1,670 @@
+import codecs
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import llama_cpp
+from llama_cpp import llama_chat_format
+
+from metrics import (
+    LOCAL_POOL_INSTANCES,
+    LOCAL_POOL_BUSY,
+    LOCAL_POOL_QUEUED,
+    LOCAL_POOL_QUEUE_WAIT,
+    LOCAL_POOL_REJECTED,
+    LOCAL_BATCH_SEQUENCES
+)
+from model_pool import PoolSaturatedError, PoolUnavailableError
+
+# Create a module-specific logger for diagnostic messages.
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Continuous Batching Engine (TinyLLaMA)
+# -----------------------------------------------------------------------------
+# Decoding one token costs about as much CPU time for one conversation as for
+# several: the time goes into reading the weights, which a batch shares. The
+# engine therefore keeps many conversations in one llama.cpp context, each in
+# its own sequence (KV cache slot), and decodes the next token of all of them
+# in a single forward pass. Between passes it admits waiting requests into
+# free slots (their prompts are evaluated in chunks alongside the running
+# sequences) and retires finished ones, so no request waits for a whole batch
+# to complete. Each sequence's text goes to its own client as it is sampled.
+# A free slot keeps its KV cache: a new request is placed in the slot sharing
+# the longest token prefix with its prompt (often the session's previous
+# turn), or is given a copy of a longer prefix held by any other slot (at
+# least the system prompt), and only the remainder is evaluated.
+
+
+class LlamaBatchDecoder:
+    """
+    A multi-sequence llama.cpp context over a loaded model, with the model's
+    chat template and tokenizer.
+
+    Args:
+        llm: Loaded model; provides the weights, tokenizer and chat template.
+        n_seq: Number of sequences the context holds.
+        seq_ctx: Context size of each sequence, in tokens.
+        n_batch: Maximum tokens evaluated per decode call.
+        n_threads: CPU threads used for decoding.
+    """
+
+    def __init__(self, llm, n_seq: int, seq_ctx: int, n_batch: int, n_threads: int):
+        self.llm = llm
+        self.n_seq = n_seq
+        self.seq_ctx = seq_ctx
+        self.n_vocab = llm.n_vocab()
+        self.eos = llm.token_eos()
+
+        template = llm.metadata.get("tokenizer.chat_template")
+        if not template:
+            raise RuntimeError("The local model has no chat template; the batch engine needs one")
+        self._formatter = llama_chat_format.Jinja2ChatFormatter(
+            template=template,
+            eos_token=llm._model.token_get_text(self.eos),
+            bos_token=llm._model.token_get_text(llm.token_bos())
+        )
+
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = n_seq * seq_ctx
+        params.n_batch = n_batch
+        params.n_ubatch = n_batch
+        params.n_seq_max = n_seq
+        params.n_threads = n_threads
+        params.n_threads_batch = n_threads
+        if hasattr(params, "kv_unified"):
+            # One cache for all sequences, so a copied prefix is shared, not duplicated
+            params.kv_unified = True
+        # Renamed in newer llama.cpp releases
+        new_context = getattr(llama_cpp, "llama_init_from_model", None) or llama_cpp.llama_new_context_with_model
+        self._ctx = new_context(llm.model, params)
+        if not self._ctx:
+            raise RuntimeError("Failed to create the batch context")
+        self._batch = llama_cpp.llama_batch_init(n_batch, 0, 1)
+
+    def prompt_tokens(self, messages: List[Dict[str, str]]) -> List[int]:
+        """Apply the chat template to messages and tokenize the prompt."""
+        result = self._formatter(messages=messages)
+        return self.llm.tokenize(
+            result.prompt.encode("utf-8"), add_bos=not result.added_special, special=True
+        )
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        return self.llm.tokenize(text, add_bos=add_bos, special=special)
+
+    def detokenize(self, token: int) -> bytes:
+        return self.llm.detokenize([token])
+
+    def decode(self, entries: List[Tuple[int, int, int, bool]]) -> List[np.ndarray]:
+        """
+        Evaluate (token, position, sequence, wants logits) entries in one
+        forward pass.
+
+        Returns:
+            The logits of each entry that wants them, in entry order (valid
+            until the next call).
+        """
+        batch = self._batch
+        for i, (token, pos, seq_id, wants_logits) in enumerate(entries):
+            batch.token[i] = token
+            batch.pos[i] = pos
+            batch.n_seq_id[i] = 1
+            batch.seq_id[i][0] = seq_id
+            batch.logits[i] = wants_logits
+        batch.n_tokens = len(entries)
+        result = llama_cpp.llama_decode(self._ctx, batch)
+        if result != 0:
+            raise RuntimeError(f"llama_decode failed ({result})")
+        return [
+            np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(self._ctx, i), shape=(self.n_vocab,))
+            for i, entry in enumerate(entries) if entry[3]
+        ]
+
+    def _kv_call(self, op: str, *args) -> None:
+        """Call a KV cache function, named differently across llama.cpp releases."""
+        if hasattr(llama_cpp, f"llama_memory_{op}"):
+            getattr(llama_cpp, f"llama_memory_{op}")(llama_cpp.llama_get_memory(self._ctx), *args)
+        elif hasattr(llama_cpp, f"llama_kv_self_{op}"):
+            getattr(llama_cpp, f"llama_kv_self_{op}")(self._ctx, *args)
+        else:
+            getattr(llama_cpp, f"llama_kv_cache_{op}")(self._ctx, *args)
+
+    def remove(self, seq_id: int, start: int) -> None:
+        """Drop a sequence's KV cache from position `start` on."""
+        self._kv_call("seq_rm", seq_id, start, -1)
+
+    def copy(self, source: int, target: int, end: int) -> None:
+        """Give sequence `target` the KV cache of `source` up to position `end`."""
+        self._kv_call("seq_cp", source, target, 0, end)
+
+    def close(self) -> None:
+        llama_cpp.llama_batch_free(self._batch)
+        llama_cpp.llama_free(self._ctx)
+
+
+def _sample(logits: np.ndarray, params: Dict[str, float], rng: np.random.Generator) -> int:
+    """
+    Pick the next token: top-k, top-p and min-p filtering, then temperature
+    (the order llama.cpp's default sampler chain applies them in).
+    """
+    temperature = params.get("temperature", 0.7)
+    if temperature <= 0:
+        return int(np.argmax(logits))
+    top_k = min(int(params.get("top_k", 40)) or len(logits), len(logits))
+    ids = np.argpartition(logits, -top_k)[-top_k:]
+    ids = ids[np.argsort(-logits[ids])]
+    top = logits[ids].astype(np.float64)
+
+    probs = np.exp(top - top[0])
+    probs /= probs.sum()
+    keep = int(np.searchsorted(np.cumsum(probs), params.get("top_p", 0.95))) + 1
+    keep = min(keep, int(np.count_nonzero(probs >= params.get("min_p", 0.05) * probs[0])))
+    keep = max(keep, 1)
+
+    weights = np.exp((top[:keep] - top[0]) / temperature)
+    return int(ids[rng.choice(keep, p=weights / weights.sum())])
+
+
+def _apply_stops(text: str, stops: List[str]) -> Tuple[str, str, bool]:
+    """
+    Split generated text at the first stop sequence, as llama.cpp's
+    create_chat_completion does.
+
+    Returns:
+        The text to emit, the tail to hold back because it could still grow
+        into a stop sequence, and whether a stop sequence was found.
+    """
+    found = [i for i in (text.find(stop) for stop in stops if stop) if i >= 0]
+    if found:
+        return text[:min(found)], "", True
+    held = max((k for stop in stops for k in range(1, len(stop)) if text.endswith(stop[:k])), default=0)
+    return text[:len(text) - held], text[len(text) - held:], False
+
+
+class GenerationRequest:
+    """
+    One prompt submitted to the engine: its generation state and results.
+
+    The engine passes each text fragment to `on_text` (from its own thread;
+    the callback must not block) and resolves `future` with the full reply.
+    A streaming consumer calls `consumed()` per fragment it has handled: a
+    sequence more than `max_backlog` fragments ahead of its consumer is left
+    out of the batch until the consumer catches up.
+    """
+
+    def __init__(self, engine: "BatchEngine", prompt: List[int], max_tokens: int,
+                 sampling: Dict[str, float], on_text: Optional[Callable[[str], None]],
+                 stop: Optional[List[str]] = None):
+        self._engine = engine
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.sampling = sampling
+        self.stop = stop or []
+        self.on_text = on_text
+        self.future: Future = Future()
+        self.cancelled = False
+        self.enqueued = time.perf_counter()
+        # Engine-side state
+        self.queued = True
+        self.slot: Optional["_Slot"] = None
+        self.n_past = 0
+        self.next_token: Optional[int] = None
+        self.generated = 0
+        self.parts: List[str] = []
+        self.held = ""
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        # Each counter is written by one thread only
+        self.sent = 0
+        self.received = 0
+
+    def consumed(self) -> None:
+        """Record that the consumer has handled one more fragment."""
+        self.received += 1
+
+    def cancel(self) -> None:
+        """Withdraw the request if still queued, or stop it at its next token."""
+        self.cancelled = True
+        self.future.cancel()
+        self._engine._withdraw(self)
+
+
+class _Slot:
+    """A sequence of the batch context and the tokens its KV cache holds."""
+
+    def __init__(self, seq_id: int):
+        self.seq_id = seq_id
+        self.tokens: List[int] = []
+        self.request: Optional[GenerationRequest] = None
+        self.last_used = 0.0
+
+
+class BatchEngine:
+    """
+    Continuous-batching generation over one multi-sequence context, run by
+    a dedicated thread.
+
+    Args:
+        factory: Creates the decoder (see LlamaBatchDecoder); called once, on
+            first use (replaceable until then, e.g. by a benchmark).
+        slots: Sequences decoded together.
+        queue_size: Requests allowed to wait for a free slot; beyond that,
+            new requests are rejected.
+        policy: "fifo" admits requests in arrival order; "priority" admits
+            the lowest priority value first (arrival order among equals).
+        batch_tokens: Maximum tokens per decode step; prompts are evaluated
+            in chunks filling what the running sequences leave free.
+        max_backlog: Fragments a sequence may run ahead of its consumer.
+    """
+
+    def __init__(self, factory: Callable[[], Any], slots: int, queue_size: int, policy: str = "fifo",
+                 batch_tokens: int = 512, max_backlog: int = 64):
+        self.factory = factory
+        self.slots = slots
+        self.queue_size = queue_size
+        self.policy = policy
+        self.batch_tokens = max(batch_tokens, slots)
+        self.max_backlog = max_backlog
+        self._decoder = None
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Entries are (priority, arrival number, request)
+        self._waiting: List[tuple] = []
+        self._arrivals = itertools.count()
+        self._queued = 0
+        self._slots = [_Slot(i) for i in range(slots)]
+        self._running: List[GenerationRequest] = []
+        self._closed = False
+        # Set when the engine thread stops on an unexpected error
+        self._error: Optional[BaseException] = None
+        self._rng = np.random.default_rng()
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0}
+        self._steps = 0
+        self._step_sequences = 0
+        self._tokens_decoded = 0
+        LOCAL_POOL_INSTANCES.set(slots)
+
+        self._thread = threading.Thread(target=self._run, name="tinyllama-batch", daemon=True)
+        self._thread.start()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def decoder(self):
+        """
+        Return the decoder, loading the model on first use (its tokenizer
+        and chat template are used to prepare prompts).
+        """
+        if self._decoder is None:
+            with self._load_lock:
+                if self._decoder is None:
+                    logger.info(f"Loading TinyLLaMA batch engine ({self.slots} sequences)")
+                    self._decoder = self.factory()
+        return self._decoder
+
+    def submit(self, prompt: List[int], max_tokens: int, sampling: Dict[str, float],
+               on_text: Optional[Callable[[str], None]] = None, priority: int = 0,
+               stop: Optional[List[str]] = None) -> GenerationRequest:
+        """
+        Queue a tokenized prompt for generation.
+
+        Args:
+            prompt: Prompt tokens (see LlamaBatchDecoder.prompt_tokens).
+            max_tokens: Maximum tokens to generate.
+            sampling: temperature, top_k, top_p and min_p.
+            on_text: Receives each text fragment as it is generated.
+            priority: Lower values are admitted first under the "priority"
+                policy; ignored under "fifo".
+            stop: Strings that end the reply (not included in it).
+
+        Returns:
+            The request; its `future` resolves to the complete reply.
+
+        Raises:
+            ValueError: If the prompt does not fit a sequence's context.
+            PoolSaturatedError: If every slot is busy and the queue is full.
+            PoolUnavailableError: If the engine has been shut down.
+        """
+        seq_ctx = self.decoder().seq_ctx
+        if len(prompt) >= seq_ctx:
+            raise ValueError(f"Prompt of {len(prompt)} tokens exceeds the context of {seq_ctx}")
+        request = GenerationRequest(self, prompt, max_tokens, sampling, on_text, stop)
+        with self._lock:
+            if self._closed:
+                LOCAL_POOL_REJECTED.labels("unavailable").inc()
+                if self._error is not None:
+                    raise PoolUnavailableError(f"TinyLLaMA batch engine failed: {self._error}")
+                raise PoolUnavailableError("TinyLLaMA batch engine is shut down")
+            if len(self._running) + self._queued >= self.slots + self.queue_size:
+                self._counters["rejected"] += 1
+                LOCAL_POOL_REJECTED.labels("saturated").inc()
+                raise PoolSaturatedError(
+                    f"TinyLLaMA batch engine is saturated ({self.slots} running, {self.queue_size} queued)"
+                )
+            self._queued += 1
+            self._counters["submitted"] += 1
+            order = priority if self.policy == "priority" else 0
+            heapq.heappush(self._waiting, (order, next(self._arrivals), request))
+            LOCAL_POOL_QUEUED.set(self._queued)
+            self._wakeup.notify()
+        # A future cancelled by its awaiting caller withdraws the request
+        request.future.add_done_callback(lambda f: f.cancelled() and self._withdraw(request))
+        return request
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the engine's occupancy, request counters and batch sizes.
+        """
+        with self._lock:
+            return {
+                "engine": "batch",
+                "slots": self.slots,
+                "busy": len(self._running),
+                "queued": self._queued,
+                "queue_size": self.queue_size,
+                "policy": self.policy,
+                **self._counters,
+                "decode_steps": self._steps,
+                "tokens_decoded": self._tokens_decoded,
+                "mean_sequences_per_step": round(self._step_sequences / self._steps, 2) if self._steps else 0.0,
+            }
+
+    def shutdown(self, wait: bool = False, timeout: Optional[float] = None) -> None:
+        """
+        Stop accepting requests; queued and running ones still complete.
+
+        Args:
+            wait: Block until the engine thread has finished them.
+            timeout: Maximum seconds to wait (no limit if None).
+        """
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if wait:
+            self._thread.join(timeout)
+
+    # ------------------------------------------------------------------
+    # Engine thread
+    # ------------------------------------------------------------------
+    def _withdraw(self, request: GenerationRequest) -> None:
+        """Release the queue place of a request cancelled before admission."""
+        with self._lock:
+            if request.queued:
+                request.queued = False
+                self._queued -= 1
+                self._counters["cancelled"] += 1
+                LOCAL_POOL_QUEUED.set(self._queued)
+
+    def _run(self) -> None:
+        """
+        Engine loop: admit waiting requests into free slots, then decode one
+        step of every running sequence, until shut down and drained.
+
+        An error concerning one request fails that request only; any other
+        error stops the engine and fails every request it holds.
+        """
+        try:
+            while True:
+                with self._lock:
+                    while not self._running and not self._waiting and not self._closed:
+                        self._wakeup.wait()
+                    if self._closed and not self._running and not self._queued:
+                        break
+                    admitted = self._admit()
+                for request in admitted:
+                    self._guarded(request, self._place, request)
+                if self._running:
+                    self._step()
+        except BaseException as e:
+            logger.exception(f"TinyLLaMA batch engine stopped: {e}")
+            self._abort(e)
+        finally:
+            if self._decoder is not None:
+                try:
+                    self._decoder.close()
+                except Exception as e:
+                    logger.error(f"Failed to release the batch context: {e}")
+
+    def _guarded(self, request: GenerationRequest, fn: Callable[..., Any], *args) -> bool:
+        """
+        Run `fn(*args)` on behalf of one request, failing that request if it
+        raises.
+
+        Returns:
+            True if the call succeeded.
+        """
+        try:
+            fn(*args)
+            return True
+        except Exception as e:
+            logger.error(f"TinyLLaMA request failed: {e}")
+            self._finish(request, error=e)
+            return False
+
+    def _abort(self, error: BaseException) -> None:
+        """
+        Close the engine after a fatal error and fail every waiting and
+        running request with it.
+        """
+        with self._lock:
+            self._closed = True
+            self._error = error
+            requests = [request for _, _, request in self._waiting if request.queued]
+            for request in requests:
+                request.queued = False
+            self._waiting.clear()
+            self._queued = 0
+            requests += self._running
+            self._running = []
+            for slot in self._slots:
+                slot.request = None
+                slot.tokens = []
+            LOCAL_POOL_QUEUED.set(0)
+            LOCAL_POOL_BUSY.set(0)
+        for request in requests:
+            if self._resolve(request, error=error):
+                with self._lock:
+                    self._counters["failed"] += 1
+
+    def _admit(self) -> List[GenerationRequest]:
+        """
+        Take waiting requests off the queue while slots are free (lock held).
+        """
+        admitted = []
+        free = self.slots - len(self._running)
+        while self._waiting and len(admitted) < free:
+            _, _, request = heapq.heappop(self._waiting)
+            if not request.queued:
+                continue
+            request.queued = False
+            self._queued -= 1
+            if not request.future.set_running_or_notify_cancel():
+                self._counters["cancelled"] += 1
+                continue
+            LOCAL_POOL_QUEUE_WAIT.observe(time.perf_counter() - request.enqueued)
+            self._running.append(request)
+            admitted.append(request)
+        LOCAL_POOL_QUEUED.set(self._queued)
+        LOCAL_POOL_BUSY.set(len(self._running))
+        return admitted
+
+    @staticmethod
+    def _shared(slot: _Slot, request: GenerationRequest) -> int:
+        """Length of the common prefix of a slot's cached tokens and a prompt."""
+        n = 0
+        for a, b in zip(slot.tokens, request.prompt):
+            if a != b:
+                break
+            n += 1
+        return n
+
+    def _place(self, request: GenerationRequest) -> None:
+        """
+        Put an admitted request in the free slot whose cached tokens share
+        the longest prefix with its prompt, keeping that part of the cache.
+        """
+        free = [slot for slot in self._slots if slot.request is None]
+        slot = max(free, key=lambda s: (self._shared(s, request), -s.last_used))
+        slot.request = request
+        request.slot = slot
+        # Keep at least the last prompt token to evaluate: its logits give
+        # the first reply token
+        keep = min(self._shared(slot, request), len(request.prompt) - 1)
+        self.decoder().remove(slot.seq_id, keep)
+        del slot.tokens[keep:]
+        request.n_past = keep
+
+    def _adopt_prefix(self, request: GenerationRequest) -> None:
+        """
+        Copy into a prefilling request's slot a longer prefix of its prompt
+        cached by another slot, e.g. the system prompt just evaluated for
+        a request admitted at the same time.
+        """
+        source = max(self._slots, key=lambda s: self._shared(s, request))
+        shared = min(self._shared(source, request), len(request.prompt) - 1)
+        if shared <= request.n_past:
+            return
+        slot = request.slot
+        decoder = self.decoder()
+        decoder.remove(slot.seq_id, 0)
+        decoder.copy(source.seq_id, slot.seq_id, shared)
+        slot.tokens = source.tokens[:shared]
+        request.n_past = shared
+
+    def _step(self) -> None:
+        """
+        Run one decode step: the next token of each generating sequence plus
+        prompt chunks of newly admitted ones, in a single forward pass.
+        """
+        decoder = self.decoder()
+        for request in [r for r in self._running if r.cancelled]:
+            self._finish(request)
+
+        entries: List[Tuple[int, int, int, bool]] = []
+        sampled: List[GenerationRequest] = []
+        budget = self.batch_tokens
+        for request in self._running:
+            if request.next_token is None or request.sent - request.received >= self.max_backlog:
+                continue
+            entries.append((request.next_token, request.n_past, request.slot.seq_id, True))
+            sampled.append(request)
+            budget -= 1
+        for request in list(self._running):
+            if request.next_token is not None or budget <= 0:
+                continue
+            if not self._guarded(request, self._adopt_prefix, request):
+                continue
+            chunk = request.prompt[request.n_past:request.n_past + budget]
+            last = request.n_past + len(chunk) == len(request.prompt)
+            for i, token in enumerate(chunk):
+                entries.append((token, request.n_past + i, request.slot.seq_id, last and i == len(chunk) - 1))
+            if last:
+                sampled.append(request)
+            budget -= len(chunk)
+        if not entries:
+            # Every sequence is waiting for its consumer
+            time.sleep(0.005)
+            return
+
+        try:
+            logits = decoder.decode(entries)
+        except Exception as e:
+            logger.error(f"Batch decode failed: {e}")
+            for request in list(self._running):
+                self._finish(request, error=e)
+            return
+        sequences = len({seq_id for _, _, seq_id, _ in entries})
+        self._steps += 1
+        self._step_sequences += sequences
+        self._tokens_decoded += len(entries)
+        LOCAL_BATCH_SEQUENCES.observe(sequences)
+
+        # Record what the KV cache now holds
+        for token, pos, seq_id, _ in entries:
+            slot = self._slots[seq_id]
+            slot.tokens.append(token)
+            slot.request.n_past = pos + 1
+
+        for request, row in zip(sampled, logits):
+            self._guarded(request, self._advance, request, row)
+
+    def _advance(self, request: GenerationRequest, row: np.ndarray) -> None:
+        """Sample a sequence's next token from its logits and emit its text."""
+        decoder = self.decoder()
+        token = _sample(row, request.sampling, self._rng)
+        if (token == decoder.eos or request.generated >= request.max_tokens
+                or request.n_past >= decoder.seq_ctx):
+            self._finish(request)
+            return
+        if not self._emit(request, request.decoder.decode(decoder.detokenize(token))):
+            self._finish(request)
+            return
+        request.next_token = token
+        request.generated += 1
+
+    def _emit(self, request: GenerationRequest, text: str, final: bool = False) -> bool:
+        """Pass on generated text; returns False once a stop sequence is reached."""
+        stopped = False
+        if request.stop:
+            text, request.held, stopped = _apply_stops(request.held + text, request.stop)
+            if final:
+                text, request.held = text + request.held, ""
+        if not text:
+            return not stopped
+        request.parts.append(text)
+        if request.on_text is not None:
+            request.sent += 1
+            request.on_text(text)
+        return not stopped
+
+    def _finish(self, request: GenerationRequest, error: Optional[Exception] = None) -> None:
+        """
+        Retire a sequence and resolve its request; the slot keeps its cache
+        unless the request failed.
+        """
+        if request not in self._running:
+            return
+        slot = request.slot
+        if slot is not None:
+            slot.request = None
+            slot.last_used = time.perf_counter()
+        if error is None:
+            try:
+                self._emit(request, request.decoder.decode(b"", final=True), final=True)
+            except Exception as e:
+                error = e
+        if error is not None and slot is not None:
+            # The cache state is unknown after a failure
+            slot.tokens.clear()
+            try:
+                self.decoder().remove(slot.seq_id, 0)
+            except Exception as e:
+                logger.error(f"Failed to clear batch sequence {slot.seq_id}: {e}")
+        with self._lock:
+            self._running.remove(request)
+            outcome = "failed" if error is not None else "cancelled" if request.cancelled else "completed"
+            self._counters[outcome] += 1
+            LOCAL_POOL_BUSY.set(len(self._running))
+        self._resolve(request, error=error)
+
+    @staticmethod
+    def _resolve(request: GenerationRequest, error: Optional[BaseException] = None) -> bool:
+        """
+        Resolve a request's future with its reply or an error.
+
+        Returns:
+            False if the future was already done (e.g. cancelled while queued).
+        """
+        try:
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result("".join(request.parts))
+            return True
+        except InvalidStateError:
+            return False
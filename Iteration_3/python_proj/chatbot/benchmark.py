@@ -0,0 +1,487 @@
+"""
+Chatbot load test with a local Gemini stand-in.
+
+Starts a mock of the Gemini generateContent / streamGenerateContent
+endpoints (configurable token rate, latency and error rate) and points the
+chatbot at it through BASE_URL. Then drives /chat_stream and/or /chat_once
+with many concurrent sessions, each sending several turns, and prints one
+JSON report: time to first byte, latency percentiles, tokens/s delivered
+to clients, fallback rate and session-store time.
+
+By default the chatbot runs in this process and its TinyLLaMA fallback is a
+stub, so the benchmark needs neither network access nor the local model.
+Pass --local-model to fall back to the real model instead.
+
+Usage:
+    python benchmark.py --sessions 20 --turns 5
+    python benchmark.py --endpoint chat_once --mock-error-rate 0.2
+    python benchmark.py --mock-tps 200 --mock-latency 0.1 -o run.json
+    python benchmark.py --mock-error-rate 1 --local-instances 4 --local-engine pool
+    python benchmark.py --mock-error-rate 1 --local-slots 8 --local-engine batch
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Dict, List, Optional
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+_API_KEY_PATH = os.path.join(_DIR, "google_api_key.txt")
+
+_WORDS = (
+    "Sure I can help you update your CV and prepare for interviews in your new field "
+    "Let us start with the skills you already have and how they transfer"
+).split()
+
+
+# -----------------------------------------------------------------------------
+# Mock Gemini API
+# -----------------------------------------------------------------------------
+def create_mock_gemini(tokens_per_second: float, latency: float, error_rate: float,
+                       answer_tokens: int, seed: int):
+    """
+    Build a FastAPI app mimicking the Gemini endpoints used by gemini_runner.
+
+    Every request waits `latency` seconds, fails with HTTP 500 with
+    probability `error_rate`, and otherwise answers `answer_tokens` words,
+    streamed at `tokens_per_second` one word per SSE event.
+    """
+    from fastapi import FastAPI, HTTPException
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI(title="Mock Gemini API")
+    rng = random.Random(seed)
+
+    def words() -> List[str]:
+        return [" " + rng.choice(_WORDS) for _ in range(answer_tokens)]
+
+    def packet(text: str) -> str:
+        return json.dumps({"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]})
+
+    @app.post("/v1beta/models/{target}")
+    async def generate(target: str):
+        await asyncio.sleep(latency)
+        if rng.random() < error_rate:
+            raise HTTPException(status_code=500, detail="injected error")
+        if target.endswith(":streamGenerateContent"):
+            async def events():
+                for word in words():
+                    yield f"data: {packet(word)}\r\n\r\n"
+                    await asyncio.sleep(1 / tokens_per_second)
+            return StreamingResponse(events(), media_type="text/event-stream")
+        await asyncio.sleep(answer_tokens / tokens_per_second)
+        return json.loads(packet("".join(words())))
+
+    return app
+
+
+class StubChatLlama:
+    """
+    Stand-in for the TinyLLaMA fallback model (tokenize, state save/load and
+    create_chat_completion).
+
+    Like the real model it occupies the thread it runs on (sleeping) for the
+    time it takes to decode.
+    """
+
+    def __init__(self, tokens_per_second: float, answer_tokens: int):
+        self._tokens_per_second = tokens_per_second
+        self._answer_tokens = answer_tokens
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        # About four characters per token, like the real tokenizer on English
+        return [0] * ((len(text) + 3) // 4 + int(add_bos))
+
+    def save_state(self):
+        # Sized like a TinyLLaMA state of a few hundred tokens
+        return type("StubState", (), {"llama_state_size": 8 * 1024 * 1024})()
+
+    def load_state(self, state) -> None:
+        pass
+
+    def create_chat_completion(self, messages, stream: bool = False, **kwargs):
+        words = [" " + _WORDS[i % len(_WORDS)] for i in range(self._answer_tokens)]
+
+        def chunks():
+            for word in words:
+                time.sleep(1 / self._tokens_per_second)
+                yield {"choices": [{"delta": {"content": word}}]}
+
+        if stream:
+            return chunks()
+        text = "".join(chunk["choices"][0]["delta"]["content"] for chunk in chunks())
+        return {"choices": [{"message": {"role": "assistant", "content": text}}]}
+
+
+class StubBatchDecoder:
+    """
+    Stand-in for the batch engine's decoder (see batch_engine.LlamaBatchDecoder).
+
+    A decode step sleeps for one token's time plus `batch_cost` of it for
+    every further token in the step, modelling a CPU whose decode time is
+    dominated by reading the weights once per step. Each sequence answers
+    `answer_tokens` words, then the end-of-sequence token.
+    """
+
+    seq_ctx = 2048
+    eos = 2
+
+    def __init__(self, tokens_per_second: float, answer_tokens: int, batch_cost: float):
+        self._tokens_per_second = tokens_per_second
+        self._answer_tokens = answer_tokens
+        self._batch_cost = batch_cost
+        self.n_vocab = len(_WORDS) + 3
+        # Replies sampled per sequence since its cache was last cut
+        self._replied: Dict[int, int] = {}
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        # About four characters per token; equal text gives equal tokens
+        return [1] * int(add_bos) + [zlib.crc32(text[i:i + 4]) for i in range(0, len(text), 4)]
+
+    def prompt_tokens(self, messages) -> List[int]:
+        text = "".join(f"<|{m['role']}|>\n{m['content']}</s>\n" for m in messages) + "<|assistant|>\n"
+        return self.tokenize(text.encode("utf-8"))
+
+    def detokenize(self, token: int) -> bytes:
+        return (" " + _WORDS[token - 3]).encode("utf-8")
+
+    def decode(self, entries):
+        import numpy as np
+
+        time.sleep((1 + self._batch_cost * (len(entries) - 1)) / self._tokens_per_second)
+        rows = []
+        for _, _, seq_id, wants_logits in entries:
+            if not wants_logits:
+                continue
+            replied = self._replied.get(seq_id, 0)
+            self._replied[seq_id] = replied + 1
+            row = np.full(self.n_vocab, -1e9, dtype=np.float32)
+            row[self.eos if replied >= self._answer_tokens else 3 + replied % len(_WORDS)] = 0.0
+            rows.append(row)
+        return rows
+
+    def remove(self, seq_id: int, start: int) -> None:
+        self._replied.pop(seq_id, None)
+
+    def copy(self, source: int, target: int, end: int) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+# -----------------------------------------------------------------------------
+# In-Process Servers
+# -----------------------------------------------------------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(app, name: str) -> str:
+    """Run an ASGI app on a free local port in a daemon thread; return its URL."""
+    import uvicorn
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name=name, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+@contextlib.contextmanager
+def _placeholder_api_key():
+    """
+    The chatbot refuses to start without google_api_key.txt; the mock
+    ignores the key, so provide a placeholder for the run if none exists.
+    """
+    created = not os.path.isfile(_API_KEY_PATH)
+    if created:
+        with open(_API_KEY_PATH, "w", encoding="utf-8") as f:
+            f.write("benchmark-placeholder-key\n")
+    try:
+        yield
+    finally:
+        if created:
+            os.remove(_API_KEY_PATH)
+
+
+# -----------------------------------------------------------------------------
+# Measurement Helpers
+# -----------------------------------------------------------------------------
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    return {
+        "mean": round(sum(samples) / len(samples), 4),
+        "p50": round(_percentile(samples, 50), 4),
+        "p95": round(_percentile(samples, 95), 4),
+        "p99": round(_percentile(samples, 99), 4),
+        "max": round(max(samples), 4),
+    }
+
+
+async def _scrape(client, url: str) -> Dict[tuple, float]:
+    """
+    Read the chatbot's /metrics into {(sample name, labels): value}.
+    """
+    from prometheus_client.parser import text_string_to_metric_families
+
+    resp = await client.get(f"{url}/metrics")
+    resp.raise_for_status()
+    values = {}
+    for family in text_string_to_metric_families(resp.text):
+        for sample in family.samples:
+            values[(sample.name, tuple(sorted(sample.labels.items())))] = sample.value
+    return values
+
+
+def _metric_delta(before: Dict[tuple, float], after: Dict[tuple, float], name: str, **labels) -> float:
+    """Sum of the increase of every sample `name` matching `labels`."""
+    total = 0.0
+    for (sample, sample_labels), value in after.items():
+        if sample == name and all(dict(sample_labels).get(k) == v for k, v in labels.items()):
+            total += value - before.get((sample, sample_labels), 0.0)
+    return total
+
+
+def _server_report(before: Dict[tuple, float], after: Dict[tuple, float]) -> Dict[str, Any]:
+    """
+    Backend usage, fallbacks, session-store time and local pool queueing
+    from the /metrics delta.
+    """
+    requests = {
+        backend: int(_metric_delta(before, after, "chatbot_requests_total", backend=backend))
+        for backend in ("gemini", "tinyllama")
+    }
+    answered = sum(requests.values())
+    fallbacks = int(_metric_delta(before, after, "chatbot_fallbacks_total"))
+    session_io = {}
+    for op in ("load", "save", "reset"):
+        count = _metric_delta(before, after, "chatbot_session_io_seconds_count", operation=op)
+        total = _metric_delta(before, after, "chatbot_session_io_seconds_sum", operation=op)
+        if count:
+            session_io[op] = {"calls": int(count), "total_s": round(total, 4), "mean_ms": round(total / count * 1000, 3)}
+    waits = _metric_delta(before, after, "chatbot_local_pool_queue_wait_seconds_count")
+    wait_s = _metric_delta(before, after, "chatbot_local_pool_queue_wait_seconds_sum")
+    steps = _metric_delta(before, after, "chatbot_local_batch_sequences_count")
+    sequences = _metric_delta(before, after, "chatbot_local_batch_sequences_sum")
+    local_pool = {
+        "capacity": int(after.get(("chatbot_local_pool_instances", ()), 0)),
+        "rejected": int(_metric_delta(before, after, "chatbot_local_pool_rejected_total")),
+        "queue_wait_mean_s": round(wait_s / waits, 4) if waits else 0.0,
+        "batch_steps": int(steps),
+        "batch_sequences_mean": round(sequences / steps, 2) if steps else 0.0,
+    }
+    return {
+        "backend_requests": requests,
+        "fallbacks": fallbacks,
+        "fallback_rate": round(fallbacks / answered, 4) if answered else 0.0,
+        "session_io": session_io,
+        "local_pool": local_pool,
+    }
+
+
+# -----------------------------------------------------------------------------
+# Load Generation
+# -----------------------------------------------------------------------------
+async def _turn(client, url: str, endpoint: str, session_id: str, prompt: str) -> Dict[str, Any]:
+    """
+    Send one chat turn and measure it from the client's side.
+    """
+    body = {"session_id": session_id, "prompt": prompt}
+    start = time.perf_counter()
+    try:
+        if endpoint == "chat_once":
+            resp = await client.post(f"{url}/chat_once", json=body)
+            resp.raise_for_status()
+            latency = time.perf_counter() - start
+            return {"endpoint": endpoint, "latency": latency, "ttfb": latency, "tokens": 0, "stream_s": 0.0}
+
+        ttfb, first_token, tokens = None, None, 0
+        async with client.stream("POST", f"{url}/chat_stream", json=body) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                now = time.perf_counter()
+                if ttfb is None:
+                    ttfb = now - start
+                if line.startswith("data:"):
+                    tokens += 1
+                    first_token = first_token or now
+        end = time.perf_counter()
+        return {
+            "endpoint": endpoint,
+            "latency": end - start,
+            "ttfb": ttfb if ttfb is not None else end - start,
+            "tokens": tokens,
+            "stream_s": end - first_token if first_token else 0.0,
+        }
+    except Exception as e:
+        return {"endpoint": endpoint, "latency": time.perf_counter() - start, "error": repr(e)}
+
+
+async def _session(client, url: str, endpoints: List[str], session_id: str, turns: int,
+                   results: List[Dict[str, Any]]) -> None:
+    """
+    Play one user: `turns` sequential messages, alternating endpoints if
+    more than one is benchmarked.
+    """
+    for turn in range(turns):
+        endpoint = endpoints[turn % len(endpoints)]
+        prompt = f"Turn {turn}: how do I describe {random.choice(_WORDS)} experience on my CV?"
+        results.append(await _turn(client, url, endpoint, session_id, prompt))
+
+
+async def run_load(args, url: str) -> Dict[str, Any]:
+    import httpx
+
+    endpoints = ["chat_stream", "chat_once"] if args.endpoint == "both" else [args.endpoint]
+    run_id = uuid.uuid4().hex[:8]
+    sessions = [f"bench-{run_id}-{i}" for i in range(args.sessions)]
+    results: List[Dict[str, Any]] = []
+
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        before = await _scrape(client, url)
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _session(client, url, endpoints, session_id, args.turns, results) for session_id in sessions
+        ))
+        elapsed = time.perf_counter() - start
+        after = await _scrape(client, url)
+        # Leave no benchmark sessions behind
+        for session_id in sessions:
+            await client.post(f"{url}/chat_reset", json={"session_id": session_id})
+
+    ok = [r for r in results if "error" not in r]
+    report: Dict[str, Any] = {
+        "commit": _git_commit(),
+        "url": url,
+        "endpoints": endpoints,
+        "sessions": args.sessions,
+        "turns": args.turns,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+    }
+    for endpoint in endpoints:
+        done = [r for r in ok if r["endpoint"] == endpoint]
+        entry = {
+            "requests": len(done),
+            "latency_s": _summary([r["latency"] for r in done]),
+            "time_to_first_byte_s": _summary([r["ttfb"] for r in done]),
+        }
+        if endpoint == "chat_stream":
+            streamed = [r for r in done if r["stream_s"] > 0]
+            entry["tokens_per_second_per_client"] = _summary([r["tokens"] / r["stream_s"] for r in streamed])
+            entry["tokens_delivered"] = sum(r["tokens"] for r in done)
+        report[endpoint] = entry
+    report["aggregate_tokens_per_second"] = round(sum(r.get("tokens", 0) for r in ok) / elapsed, 2) if elapsed else 0.0
+    report.update(_server_report(before, after))
+    errors = sorted({r["error"] for r in results if "error" in r})
+    if errors:
+        report["error_samples"] = errors[:5]
+    return report
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load-test the chatbot against a mock Gemini API.")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent chat sessions")
+    parser.add_argument("--turns", type=int, default=3, help="sequential messages per session")
+    parser.add_argument("--endpoint", choices=("chat_stream", "chat_once", "both"), default="both")
+    parser.add_argument("--mock-tps", type=float, default=50.0, help="mock Gemini tokens per second")
+    parser.add_argument("--mock-latency", type=float, default=0.3, help="mock Gemini seconds before answering")
+    parser.add_argument("--mock-error-rate", type=float, default=0.0,
+                        help="fraction of mock Gemini calls failing with HTTP 500")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="tokens per answer (mock and stub)")
+    parser.add_argument("--local-tps", type=float, default=20.0, help="stub TinyLLaMA fallback tokens per second")
+    parser.add_argument("--local-engine", choices=("batch", "pool"),
+                        help="local TinyLLaMA engine (default: LOCAL_ENGINE)")
+    parser.add_argument("--local-instances", type=int,
+                        help="TinyLLaMA pool instances (default: LOCAL_POOL_SIZE)")
+    parser.add_argument("--local-slots", type=int,
+                        help="batch engine sequences (default: LOCAL_BATCH_SLOTS)")
+    parser.add_argument("--local-batch-cost", type=float, default=0.05,
+                        help="stub batch step cost of each further token, as a fraction of one token's")
+    parser.add_argument("--local-model", action="store_true",
+                        help="fall back to the real TinyLLaMA model instead of the stub")
+    parser.add_argument("--url", help="benchmark a running chatbot (already pointed at a Gemini mock or API) "
+                                      "instead of starting one in this process")
+    parser.add_argument("--seed", type=int, default=5210, help="seed of the mock's word and error choices")
+    parser.add_argument("--timeout", type=float, default=300.0, help="HTTP request timeout in seconds")
+    parser.add_argument("-o", "--output", default="-", help="JSON report file (default: stdout)")
+    args = parser.parse_args()
+
+    with _placeholder_api_key():
+        if args.url:
+            url = args.url.rstrip("/")
+        else:
+            mock_url = _serve(create_mock_gemini(
+                args.mock_tps, args.mock_latency, args.mock_error_rate, args.answer_tokens, args.seed
+            ), "mock-gemini")
+            # gemini_runner reads BASE_URL on every request
+            os.environ["BASE_URL"] = f"{mock_url}/v1beta/models"
+            # Read when the local engine is created, at import
+            if args.local_engine:
+                os.environ["LOCAL_ENGINE"] = args.local_engine
+            if args.local_instances:
+                os.environ["LOCAL_POOL_SIZE"] = str(args.local_instances)
+            if args.local_slots:
+                os.environ["LOCAL_BATCH_SLOTS"] = str(args.local_slots)
+            import main as chatbot
+            import tinyllama_runner
+            if not args.local_model:
+                # The engine creates its model(s) on the first local request
+                if tinyllama_runner._engine is not None:
+                    tinyllama_runner._engine.factory = lambda: StubBatchDecoder(
+                        args.local_tps, args.answer_tokens, args.local_batch_cost
+                    )
+                else:
+                    tinyllama_runner._pool.factory = lambda: StubChatLlama(args.local_tps, args.answer_tokens)
+            url = _serve(chatbot.app, "chatbot")
+        report = asyncio.run(run_load(args, url))
+
+    report["mock"] = None if args.url else {
+        "tokens_per_second": args.mock_tps,
+        "latency_s": args.mock_latency,
+        "error_rate": args.mock_error_rate,
+        "answer_tokens": args.answer_tokens,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
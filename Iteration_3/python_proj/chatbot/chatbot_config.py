@@ -55,6 +55,12 @@ GOOGLE_GEN_CONFIG = {
     "stopSequences": json.loads(os.getenv("GOOGLE_STOP_SEQUENCES", "[]")),
 }
 
+# -------- Context Window --------
+# Token budget of the history sent to Gemini per turn (system prompt,
+# summary and the most recent messages; estimated at ~4 characters per
+# token). Bounds input cost and latency however long a session runs.
+GOOGLE_CONTEXT_TOKENS = int(os.getenv("GOOGLE_CONTEXT_TOKENS", 8000))
+
 
 # -----------------------------------------------------------------------------
 # Module: Local TinyLLaMA Model Configuration
@@ -94,3 +100,148 @@ LOCAL_GEN_CONFIG = {
     # Default stop tokens signify speaker changes in a chat transcript.
     "stop": json.loads(os.getenv("LOCAL_STOP_TOKENS", '["User:","Assistant:"]')),
 }
+
+# -------- Local Context Window --------
+# Token budget of the prompt sent to TinyLLaMA per turn (the system prompt
+# alone is roughly 900 tokens). It must leave room in the model's 2048-token
+# context for the reply.
+LOCAL_CONTEXT_TOKENS = int(os.getenv("LOCAL_CONTEXT_TOKENS", 1536))
+
+# Tokens of the rolling summary that replaces messages dropped from either
+# backend's window (appended to the system prompt); 0 drops them silently.
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", 200))
+
+# Fraction of the message budget freed beyond what is needed whenever the
+# window has to drop messages. The window then keeps the same start (and the
+# prompt the same prefix, reusable from the previous turn's state) for
+# several turns, instead of sliding by a message every turn.
+CONTEXT_SLACK = float(os.getenv("CONTEXT_SLACK", 0.5))
+
+# -------- Local Streaming --------
+# Text fragments a local generation may queue ahead of a slow client before
+# generation pauses.
+LOCAL_STREAM_QUEUE_SIZE = int(os.getenv("LOCAL_STREAM_QUEUE_SIZE", 64))
+
+# -------- Local Session State Cache --------
+# Megabytes of llama.cpp states (KV cache) kept per session after each local
+# reply, shared by the pool's instances. The session's next turn restores its
+# state and only evaluates the new messages. Least recently used sessions are
+# evicted; a TinyLLaMA state at full context is ~110 MB (~45 MB of KV cache
+# plus up to ~65 MB of logits llama-cpp-python copies). 0 disables it. The
+# batch engine keeps finished conversations in its slots instead.
+LOCAL_SESSION_STATE_MB = float(os.getenv("LOCAL_SESSION_STATE_MB", 512))
+
+# -------- Local Prompt State Cache --------
+# Capacity in megabytes of the llama.cpp RAM state caches, split evenly
+# between the instances of the pool (see below). After each local
+# completion the model state is saved; a later prompt sharing a prefix with a
+# saved state (at minimum the system prompt) restores it and only evaluates
+# the new tokens. Least recently used states are evicted. 0 disables it.
+LOCAL_PROMPT_CACHE_MB = float(os.getenv("LOCAL_PROMPT_CACHE_MB", 256))
+
+# -------- Local Instance Pool --------
+# Number of TinyLLaMA instances, each serving one generation at a time. The
+# weights are memory-mapped and shared; each instance adds its own KV cache
+# (~45 MB at full context) and its share of the prompt state cache above.
+LOCAL_POOL_SIZE = max(1, int(os.getenv("LOCAL_POOL_SIZE", 2)))
+
+# CPU threads per instance; the default splits the cores between the
+# instances so concurrent generations do not compete for them.
+LOCAL_THREADS_PER_INSTANCE = max(
+    1, int(os.getenv("LOCAL_THREADS_PER_INSTANCE", (os.cpu_count() or 1) // LOCAL_POOL_SIZE))
+)
+
+# Local requests allowed to wait for a free instance; beyond that, new
+# requests fail at once (HTTP 503 with Retry-After for /chat_once).
+LOCAL_POOL_QUEUE_SIZE = max(0, int(os.getenv("LOCAL_POOL_QUEUE_SIZE", 8)))
+
+# Order of waiting requests: "fifo" (arrival) or "priority" (lowest
+# "priority" value of the chat request first, arrival order among equals).
+LOCAL_POOL_POLICY = os.getenv("LOCAL_POOL_POLICY", "fifo").lower()
+
+# Seconds suggested to clients in the Retry-After header when rejected.
+LOCAL_POOL_RETRY_AFTER = int(os.getenv("LOCAL_POOL_RETRY_AFTER", 5))
+
+# -------- Local Inference Engine --------
+# "pool" (default): LOCAL_POOL_SIZE separate instances, one generation each
+# (see above). "batch" (opt-in, experimental): one continuous-batching engine
+# decodes the next token of up to LOCAL_BATCH_SLOTS conversations in a single
+# forward pass over one shared model, admitting waiting requests between
+# steps. Both queue requests per LOCAL_POOL_QUEUE_SIZE and LOCAL_POOL_POLICY
+# and apply the whole of LOCAL_GEN_CONFIG.
+LOCAL_ENGINE = os.getenv("LOCAL_ENGINE", "pool").lower()
+
+# Conversations decoded together. Each holds its own KV cache of the model's
+# full context (~45 MB for TinyLLaMA at 2048 tokens).
+LOCAL_BATCH_SLOTS = max(1, int(os.getenv("LOCAL_BATCH_SLOTS", 8)))
+
+# Tokens evaluated per decode step; new prompts are evaluated in chunks of
+# what the generating conversations leave free.
+LOCAL_BATCH_TOKENS = max(LOCAL_BATCH_SLOTS, int(os.getenv("LOCAL_BATCH_TOKENS", 512)))
+
+# CPU threads of the batch engine (all cores by default).
+LOCAL_BATCH_THREADS = max(1, int(os.getenv("LOCAL_BATCH_THREADS", os.cpu_count() or 1)))
+
+# -------- Shutdown --------
+# Seconds shutdown waits for queued and running local generations to finish
+# and their replies to be saved, before the sessions are closed.
+LOCAL_SHUTDOWN_TIMEOUT = float(os.getenv("LOCAL_SHUTDOWN_TIMEOUT", 30))
+
+
+# -----------------------------------------------------------------------------
+# Module: Session Storage Configuration
+# -----------------------------------------------------------------------------
+# Conversation histories are held in an in-memory LRU cache in front of the
+# session logs under User/. Reads are served from memory; new messages are
+# written behind in batches by a background thread and on shutdown.
+
+# -------- Session Cache --------
+# Maximum number of sessions kept in memory; the least recently used session
+# is written out and evicted beyond it.
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 1000))
+
+# Seconds without a request after which a session is evicted from memory.
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", 1800))
+
+# -------- Write-Behind --------
+# Seconds between batched writes of new messages to disk. Messages not yet
+# written are lost if the process is killed without a clean shutdown; 0
+# writes every message through immediately.
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", 1.0))
+
+# -------- Session I/O Threads --------
+# Threads running session reads and writes for the async endpoints, off the
+# event loop. One keeps every session operation in order; raise it for a
+# networked backend (Redis) to overlap round trips.
+SESSION_IO_THREADS = int(os.getenv("SESSION_IO_THREADS", 1))
+
+# -------- Storage Backend --------
+# Where histories are persisted: "file" (one append-only JSONL log per session
+# under User/) or "sqlite" (one WAL-mode database, indexed by session and last
+# update, so reset-all and expiry are single queries).
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "file").lower()
+
+# Database file of the "sqlite" backend; defaults to User/sessions.db.
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "")
+
+# -------- Durability --------
+# "always" flushes every session write to the disk before acknowledging it
+# (fsync for the file store, synchronous=FULL for SQLite), so a power loss
+# cannot drop saved messages; "never" (default) leaves write-back to the OS,
+# which is much faster and still safe against process crashes.
+SESSION_FSYNC = os.getenv("SESSION_FSYNC", "never").lower() == "always"
+
+# -------- Redis Backend --------
+# With SESSION_BACKEND=redis, every worker and VM shares sessions through one
+# Redis server, so `uvicorn --workers N` and load-balanced replicas keep
+# users' history. Histories are then never cached in process memory.
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+
+# Seconds a session lives after its last message (0 keeps sessions forever).
+SESSION_REDIS_TTL = int(os.getenv("SESSION_REDIS_TTL", 7 * 24 * 3600))
+
+# Maximum connections per worker to the Redis server.
+SESSION_REDIS_POOL_SIZE = int(os.getenv("SESSION_REDIS_POOL_SIZE", 20))
+
+# Prefix of every key, to share a Redis server with other applications.
+SESSION_REDIS_PREFIX = os.getenv("SESSION_REDIS_PREFIX", "chatbot:")
@@ -0,0 +1,196 @@
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+from metrics import PROMPT_TOKENS
+
+# -----------------------------------------------------------------------------
+# Context Window Management
+# -----------------------------------------------------------------------------
+# Sending the whole session history every turn eventually overflows
+# TinyLLaMA's context and makes Gemini requests ever larger and slower. Each
+# backend instead gets the system message plus the most recent messages that
+# fit its token budget; the older messages can be replaced by a rolling
+# summary appended to the system message. Walking back from the newest
+# message stops at the budget, so the work per turn is bounded too.
+# Sessions remember where their window starts (the summary state), so the
+# start only moves, in steps, when the newest messages no longer fit.
+
+# Per-message overhead of the chat template (role markers, separators)
+_MESSAGE_OVERHEAD = 4
+
+# Words kept from each dropped message in the rolling summary
+_SUMMARY_WORDS = 20
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate token count for backends without a local tokenizer
+    (about four characters per token for English text).
+    """
+    return math.ceil(len(text) / 4)
+
+
+class TokenCounter:
+    """
+    Token counts of chat messages for one tokenizer, cached per message:
+    history messages never change, so each is tokenized once.
+    """
+
+    def __init__(self, tokenize: Callable[[str], int], max_entries: int = 20000):
+        self._tokenize = tokenize
+        self._max_entries = max_entries
+        self._counts: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, message: Dict[str, str]) -> int:
+        """Return the tokens a message takes in the prompt, template included."""
+        key = (message.get("role"), message.get("content", ""))
+        with self._lock:
+            tokens = self._counts.get(key)
+            if tokens is not None:
+                self._counts.move_to_end(key)
+                return tokens
+        tokens = self._tokenize(key[1]) + _MESSAGE_OVERHEAD
+        with self._lock:
+            self._counts[key] = tokens
+            while len(self._counts) > self._max_entries:
+                self._counts.popitem(last=False)
+        return tokens
+
+
+def _gist(message: Dict[str, str]) -> str:
+    """One summary line for a dropped message: its first words."""
+    words = message.get("content", "").split()
+    text = " ".join(words[:_SUMMARY_WORDS]) + (" ..." if len(words) > _SUMMARY_WORDS else "")
+    text = re.sub(r"\s+", " ", text)
+    return f"- {'User' if message.get('role') == 'user' else 'You'}: {text}"
+
+
+class ContextWindow:
+    """
+    Fits a session history into a token budget for one backend.
+
+    Args:
+        backend: Label of the backend in the prompt size metric.
+        budget: Maximum prompt tokens (system message, summary and messages).
+        counter: Token counter of the backend's tokenizer.
+        summary_tokens: Tokens reserved for the rolling summary of dropped
+            messages; 0 drops them without a summary.
+        slack: Fraction of the message budget freed beyond what is needed
+            whenever the window start has to move.
+        max_sessions: Sessions whose summary state is kept (least recently
+            used first out; a forgotten summary is rebuilt when needed).
+    """
+
+    def __init__(self, backend: str, budget: int, counter: TokenCounter,
+                 summary_tokens: int = 0, slack: float = 0.0, max_sessions: int = 1000):
+        self.backend = backend
+        self.budget = budget
+        self.counter = counter
+        self.summary_tokens = summary_tokens
+        self.slack = slack
+        self._max_sessions = max_sessions
+        # session_id -> (number of leading history messages summarized,
+        #                the last of them, summary lines)
+        self._summaries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _window_start(self, history: List[Dict[str, str]], first: int, budget: int) -> int:
+        """
+        Index of the oldest message that still fits `budget` when walking
+        back from the newest one. The newest message is always kept.
+        """
+        used = 0
+        start = len(history)
+        while start > first:
+            tokens = self.counter.count(history[start - 1])
+            if used + tokens > budget and start < len(history):
+                break
+            used += tokens
+            start -= 1
+        # Do not open the window on an orphaned reply
+        while start < len(history) - 1 and history[start].get("role") == "assistant":
+            start += 1
+        return start
+
+    def _summary(self, session_id: str, history: List[Dict[str, str]], first: int, start: int) -> str:
+        """
+        Update the session's rolling summary to cover history[first:start]
+        and return its most recent lines that fit the summary budget (none
+        when summaries are disabled). Also records `start` for the next turn.
+        """
+        with self._lock:
+            covered, last, lines = self._summaries.pop(session_id, (first, None, []))
+            if covered > start or (covered > first and history[covered - 1] != last):
+                # History was reset or the window moved back: start over
+                covered, lines = first, []
+            if self.summary_tokens > 0:
+                lines = lines + [_gist(m) for m in history[covered:start] if m.get("role") in ("user", "assistant")]
+            # Keep only the lines that can still be shown
+            kept, used = [], 0
+            for line in reversed(lines):
+                used += estimate_tokens(line) + 1
+                if used > self.summary_tokens:
+                    break
+                kept.append(line)
+            lines = kept[::-1]
+            self._summaries[session_id] = (start, history[start - 1], lines)
+            while len(self._summaries) > self._max_sessions:
+                self._summaries.popitem(last=False)
+        return "\n".join(lines)
+
+    def _previous_start(self, session_id: str, history: List[Dict[str, str]]) -> int:
+        """
+        Start of the session's window on its previous turn, or -1 if unknown
+        or no longer valid (history reset or shortened).
+        """
+        with self._lock:
+            covered, last, _ = self._summaries.get(session_id, (-1, None, None))
+        if 0 < covered < len(history) and history[covered - 1] == last:
+            return covered
+        return -1
+
+    def fit(self, session_id: str, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Return the messages to send for a turn: the system message (with a
+        summary of dropped messages, if enabled) and the most recent
+        messages, within the token budget.
+
+        Once messages must be dropped, the window start only moves when the
+        messages after it no longer fit, and then further than needed (by
+        the `slack` fraction of the budget): the prompt keeps the same
+        prefix for several turns, so a backend reusing the previous turn's
+        evaluated prompt only evaluates the new messages.
+
+        Args:
+            session_id: Identifier of the conversation (keys the summary).
+            history: Full history, starting with the system message and
+                ending with the current user prompt.
+        """
+        system = history[0] if history and history[0].get("role") == "system" else None
+        first = 1 if system else 0
+        budget = self.budget - (self.counter.count(system) if system else 0)
+
+        start = self._window_start(history, first, budget)
+        if start > first:
+            # Some messages do not fit: make room for the summary
+            budget -= self.summary_tokens
+            start = self._previous_start(session_id, history)
+            if start < self._window_start(history, first, budget):
+                # The messages after the previous start no longer fit: move it,
+                # freeing `slack` of the budget for the next turns
+                start = self._window_start(history, first, int(budget * (1 - self.slack)))
+            summary = self._summary(session_id, history, first, start)
+            if summary:
+                system = {
+                    "role": "system",
+                    "content": f"{system['content'] if system else ''}\n\n"
+                               f"Summary of the earlier conversation:\n{summary}".lstrip()
+                }
+
+        messages = ([system] if system else []) + history[start:]
+        PROMPT_TOKENS.labels(self.backend).observe(sum(self.counter.count(m) for m in messages))
+        return messages
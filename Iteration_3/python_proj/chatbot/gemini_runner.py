@@ -4,7 +4,8 @@ import logging
 import httpx
 from typing import AsyncGenerator, List, Dict, Tuple
 
-from session_manager import load_history, save_history
+from chatbot_config import GOOGLE_CONTEXT_TOKENS, CONTEXT_SUMMARY_TOKENS, CONTEXT_SLACK
+from context_window import ContextWindow, TokenCounter, estimate_tokens
 
 # Create a module-specific logger for diagnostic and audit messages.
 logger = logging.getLogger(__name__)
@@ -25,6 +26,11 @@ google_key_file = os.path.join(dir_base, "google_api_key.txt")
 with open(google_key_file, "r", encoding="utf-8") as f:
     API_KEYS = [line.strip() for line in f if line.strip()]
 
+# History window fitted into GOOGLE_CONTEXT_TOKENS (estimated tokens)
+_context = ContextWindow(
+    "gemini", GOOGLE_CONTEXT_TOKENS, TokenCounter(estimate_tokens), CONTEXT_SUMMARY_TOKENS, CONTEXT_SLACK
+)
+
 # Helper to get model endpoint URL for a given key
 def _make_url(stream: bool, api_key: str) -> str:
     endpoint = "streamGenerateContent" if stream else "generateContent"
@@ -37,11 +43,13 @@ def _build_contents_and_instruction(
 ) -> Tuple[List[Dict[str, List[Dict[str, str]]]], Dict]:
     """
     Build request payload components:
-    - system_inst: the system-level instruction prompt
+    - system_inst: the system-level instruction prompt (the history's system
+      message, which may carry a summary of dropped turns)
     - contents: the list of user and assistant messages from history
     """
     # Prepare the system instruction payload if a system prompt is defined
-    system_inst: Dict = {"parts": [{"text": SYSTEM_PROMPT}]} if SYSTEM_PROMPT else {}
+    system_text = next((m.get("content", "") for m in history if m.get("role") == "system"), SYSTEM_PROMPT)
+    system_inst: Dict = {"parts": [{"text": system_text}]} if system_text else {}
 
     # Initialize the contents list for user and assistant message payloads
     contents: List[Dict] = []
@@ -81,8 +89,8 @@ async def gemini_stream(
         str: Individual text chunks as they arrive from the API stream.
     """
 
-    # Build the message contents and optional system instruction from history
-    contents, system_inst = _build_contents_and_instruction(history)
+    # Build the message contents and system instruction from the history window
+    contents, system_inst = _build_contents_and_instruction(_context.fit(session_id, history))
 
     # Initialize the request body with the user/assistant messages
     body = {"contents": contents}
@@ -149,8 +157,8 @@ async def gemini_once(
     Returns:
         str: The full text response from the model, or an empty string if no content is returned.
     """
-    # Assemble the conversation payload from history
-    contents, system_inst = _build_contents_and_instruction(history)
+    # Assemble the conversation payload from the history window
+    contents, system_inst = _build_contents_and_instruction(_context.fit(session_id, history))
     body = {"contents": contents}
     # Include system instruction if it exists
     if system_inst:
@@ -0,0 +1,105 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from metrics import LOCAL_STATE_CACHE
+
+# Create a module-specific logger for diagnostic messages.
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Per-Session KV State Cache (TinyLLaMA)
+# -----------------------------------------------------------------------------
+# A chat turn's prompt is the previous turn's prompt and reply plus the new
+# user message. Saving the llama.cpp state (KV cache and token ids) after
+# each reply and restoring it before the session's next turn means llama.cpp
+# finds the common token prefix already evaluated and only evaluates what is
+# new, instead of the whole conversation. States are large (tens of MB for
+# TinyLLaMA at full context), so the cache is an LRU bounded by bytes.
+
+
+def _state_bytes(state) -> int:
+    """
+    Memory held by a saved state: the llama.cpp state plus the copies of the
+    token ids and their logits (n_tokens x n_vocab floats) kept beside it.
+    """
+    return state.llama_state_size + state.scores.nbytes + state.input_ids.nbytes
+
+
+class SessionStateCache:
+    """
+    LRU of llama.cpp states, one per session, bounded by total state size.
+
+    Args:
+        capacity_bytes: Maximum total size of the saved states; 0 disables
+            the cache.
+    """
+
+    def __init__(self, capacity_bytes: int):
+        self.capacity_bytes = capacity_bytes
+        self._states: "OrderedDict[str, Any]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def restore(self, llm, session_id: str) -> bool:
+        """
+        Load the session's saved state into the model, if any.
+
+        Returns:
+            True if a state was restored.
+        """
+        if self.capacity_bytes <= 0:
+            return False
+        with self._lock:
+            state = self._states.get(session_id)
+            if state is not None:
+                self._states.move_to_end(session_id)
+        if state is None:
+            LOCAL_STATE_CACHE.labels("miss").inc()
+            return False
+        llm.load_state(state)
+        LOCAL_STATE_CACHE.labels("hit").inc()
+        return True
+
+    def save(self, llm, session_id: str) -> None:
+        """
+        Save the model's current state as the session's, evicting the least
+        recently used sessions beyond capacity.
+        """
+        if self.capacity_bytes <= 0:
+            return
+        state = llm.save_state()
+        size = _state_bytes(state)
+        if size > self.capacity_bytes:
+            logger.warning(f"Session {session_id}: state of {size} bytes exceeds the state cache")
+            return
+        with self._lock:
+            old = self._states.pop(session_id, None)
+            if old is not None:
+                self._bytes -= _state_bytes(old)
+            self._states[session_id] = state
+            self._bytes += size
+            while self._bytes > self.capacity_bytes:
+                _, evicted = self._states.popitem(last=False)
+                self._bytes -= _state_bytes(evicted)
+
+    def discard(self, session_id: str) -> None:
+        """Forget a session's state ("all" for every session)."""
+        with self._lock:
+            if session_id == "all":
+                self._states.clear()
+                self._bytes = 0
+            else:
+                old = self._states.pop(session_id, None)
+                if old is not None:
+                    self._bytes -= _state_bytes(old)
+
+    def stats(self) -> dict:
+        """Return the number of cached sessions and their total state size."""
+        with self._lock:
+            return {
+                "sessions": len(self._states),
+                "bytes": self._bytes,
+                "capacity_bytes": self.capacity_bytes,
+            }
@@ -1,13 +1,27 @@
 import os
 import json
+import asyncio
 import logging
+import time
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from sse_starlette.sse import EventSourceResponse
 
 from gemini_runner import gemini_stream, gemini_once
-from tinyllama_runner import tinyllama_stream, tinyllama_once
-from session_manager import load_history, save_history, reset_history
+from tinyllama_runner import tinyllama_stream, tinyllama_once, forget_session, pool_stats, shutdown_pool
+from model_pool import PoolSaturatedError, PoolUnavailableError
+from chatbot_config import LOCAL_POOL_RETRY_AFTER, LOCAL_SHUTDOWN_TIMEOUT
+from session_cache import sessions, session_locks
+from session_manager import store
+from metrics import (
+    REQUESTS,
+    FALLBACKS,
+    BACKEND_ERRORS,
+    REQUEST_LATENCY,
+    observe_stream,
+    metrics_payload
+)
 
 # -----------------------------------------------------------------------------
 # Logging Configuration
@@ -51,6 +65,17 @@ app.add_middleware(
 )
 
 
+def _priority(payload: dict) -> int:
+    """
+    Read the optional 'priority' of a chat request (lower is served first
+    by the local pool under the "priority" policy); defaults to 0.
+    """
+    try:
+        return int(payload.get("priority", 0))
+    except (TypeError, ValueError):
+        return 0
+
+
 @app.post("/chat_stream")
 async def chat_stream(request: Request):
     """
@@ -58,10 +83,12 @@ async def chat_stream(request: Request):
     Expects a JSON payload with 'session_id' and 'prompt' fields.
     Streams tokens from the configured language model and persists conversation history.
     """
+    received = time.perf_counter()
     # Parse JSON body from incoming POST request
     payload = await request.json()
     session_id = payload.get("session_id")
     prompt = payload.get("prompt", "")
+    priority = _priority(payload)
 
     # Validate required fields: both session_id and prompt must be provided
     if not session_id or not prompt:
@@ -72,15 +99,23 @@ async def chat_stream(request: Request):
     # Log the received prompt for this session
     logger.info(f"Session {session_id}: Received prompt: {prompt}")
 
-    # Load existing conversation history for context
-    history = load_history(session_id)
-    # Append user message to history immediately
-    save_history(session_id, "user", prompt)
-    # Reload history to include the newly saved user prompt
-    history = load_history(session_id)
-    logger.debug(f"Session {session_id}: History length: {len(history)} messages")
-
-    async def event_generator():
+    async def locked_turn():
+        """
+        Run the whole turn, from saving the prompt to saving the reply, under
+        the session's lock, so concurrent requests of one session take turns.
+        """
+        async with session_locks.hold(session_id):
+            # Append the user message to the cached history, which includes it
+            history = await sessions.aappend(session_id, "user", prompt)
+            logger.debug(f"Session {session_id}: History length: {len(history)} messages")
+            tokens = event_generator(history)
+            try:
+                async for token in tokens:
+                    yield token
+            finally:
+                await tokens.aclose()
+
+    async def event_generator(history):
         """
         Asynchronous generator yielding model tokens as they arrive.
         First attempts to stream from Gemini API; on failure, falls back to TinyLLaMA.
@@ -92,36 +127,60 @@ async def chat_stream(request: Request):
         # Attempt streaming response from the remote Gemini API
         try:
             logger.info(f"Session {session_id}: Attempting to use Gemini API")
-            async for token in gemini_stream(prompt, session_id, history):
-                logger.debug(f"Session {session_id}: Gemini token chunk: {token!r}")
-                assistant_buffer.append(token)
-                yield token  # Push each token to the client in real time
+            tokens = observe_stream(gemini_stream(prompt, session_id, history), "gemini")
+            try:
+                async for token in tokens:
+                    logger.debug(f"Session {session_id}: Gemini token chunk: {token!r}")
+                    assistant_buffer.append(token)
+                    yield token  # Push each token to the client in real time
+            finally:
+                # Close the backend stream now if the client went away
+                await tokens.aclose()
 
             # Combine all token chunks into the full assistant response  
             full_response = "".join(assistant_buffer)
-            save_history(session_id, "assistant", full_response)
+            await sessions.aappend(session_id, "assistant", full_response)
             logger.info(f"Session {session_id}: Gemini response saved (length {len(full_response)})")
+            REQUESTS.labels("chat_stream", "gemini").inc()
+            REQUEST_LATENCY.labels("chat_stream", "gemini").observe(time.perf_counter() - received)
             return  # End generator after successful streaming
 
         except Exception as e:
             # Log any errors from the Gemini API and clear buffer for fallback
             logger.error(f"Session {session_id}: Gemini stream error: {e}")
+            BACKEND_ERRORS.labels("gemini").inc()
+            FALLBACKS.labels("chat_stream").inc()
             assistant_buffer.clear()
 
         # Fallback: stream response from the local TinyLLaMA instance
         logger.info(f"Session {session_id}: Falling back to TinyLLaMA streaming")
-        async for token in tinyllama_stream(prompt, session_id, history):
-            logger.debug(f"Session {session_id}: TinyLLaMA token chunk: {token!r}")
-            assistant_buffer.append(token)
-            yield token  # Stream tokens to the client
+        tokens = observe_stream(tinyllama_stream(prompt, session_id, history, priority), "tinyllama")
+        try:
+            async for token in tokens:
+                logger.debug(f"Session {session_id}: TinyLLaMA token chunk: {token!r}")
+                assistant_buffer.append(token)
+                yield token  # Stream tokens to the client
+        except (PoolSaturatedError, PoolUnavailableError) as e:
+            # The response has started, so report the rejection as an event
+            logger.warning(f"Session {session_id}: TinyLLaMA rejected the request: {e}")
+            yield {"event": "error", "data": str(e), "retry": LOCAL_POOL_RETRY_AFTER * 1000}
+            return
+        except Exception:
+            BACKEND_ERRORS.labels("tinyllama").inc()
+            raise
+        finally:
+            # Frees the slot or pool instance at once if the client went away
+            await tokens.aclose()
 
         # Save the complete fallback response once streaming finishes
         full_response = "".join(assistant_buffer)
-        save_history(session_id, "assistant", full_response)
+        await sessions.aappend(session_id, "assistant", full_response)
+        REQUESTS.labels("chat_stream", "tinyllama").inc()
+        REQUEST_LATENCY.labels("chat_stream", "tinyllama").observe(time.perf_counter() - received)
         logger.info(f"Session {session_id}: TinyLLaMA response saved (length {len(full_response)})")
 
-    # Return an SSE response that will invoke the event_generator
-    return EventSourceResponse(event_generator())
+    # Return an SSE response that will run the turn
+    return EventSourceResponse(locked_turn())
 
 
 @app.post("/chat_once")
@@ -129,11 +188,14 @@ async def chat_once(payload: dict):
     """
     Handle a single-turn chat request.
     Expects a JSON payload with 'session_id' and 'prompt'.
-    Returns the complete assistant response in one message.
+    Returns the complete assistant response in one message, or 503 when
+    Gemini failed and the local model pool cannot take the request.
     """
+    received = time.perf_counter()
     # Extract session identifier and user prompt from the request payload
     session_id = payload.get("session_id")
     prompt = payload.get("prompt", "")
+    priority = _priority(payload)
 
     # Validate that both session_id and prompt are provided
     if not session_id or not prompt:
@@ -144,29 +206,46 @@ async def chat_once(payload: dict):
     # Log the received prompt for this session
     logger.info(f"Session {session_id}: chat_once prompt: {prompt}")
 
-    # Load existing conversation history for context
-    history = load_history(session_id)
-    # Save the user's message to the history immediately
-    save_history(session_id, "user", prompt)
-    # Reload history to include the newly saved prompt
-    history = load_history(session_id)
-    logger.debug(f"Session {session_id}: History messages: {len(history)}")
+    # Hold the session's lock for the whole turn, so concurrent requests of
+    # one session take turns instead of interleaving their messages
+    async with session_locks.hold(session_id):
+        # Append the user's message to the cached history, which includes it
+        history = await sessions.aappend(session_id, "user", prompt)
+        logger.debug(f"Session {session_id}: History messages: {len(history)}")
 
-    try:
-        # Attempt a single-shot response from the remote Gemini API
-        logger.info(f"Session {session_id}: Calling gemini_once")
-        response_text = await gemini_once(prompt, session_id, history)
-        logger.info(f"Session {session_id}: Received Gemini once response (length {len(response_text)})")
-    except Exception as e:
-        # On failure, log the error and fall back to the local TinyLLaMA model
-        logger.error(f"Session {session_id}: Gemini once failed: {e}")
-        logger.info(f"Session {session_id}: Falling back to tinyllama_once")
-        response_text = await tinyllama_once(prompt, session_id, history)
-        logger.info(f"Session {session_id}: Received TinyLLaMA once response (length {len(response_text)})")
-
-    # Save the assistant's reply to conversation history
-    save_history(session_id, "assistant", response_text)
-    logger.info(f"Session {session_id}: chat_once response saved")
+        try:
+            # Attempt a single-shot response from the remote Gemini API
+            logger.info(f"Session {session_id}: Calling gemini_once")
+            response_text = await gemini_once(prompt, session_id, history)
+            backend = "gemini"
+            logger.info(f"Session {session_id}: Received Gemini once response (length {len(response_text)})")
+        except Exception as e:
+            # On failure, log the error and fall back to the local TinyLLaMA model
+            logger.error(f"Session {session_id}: Gemini once failed: {e}")
+            BACKEND_ERRORS.labels("gemini").inc()
+            FALLBACKS.labels("chat_once").inc()
+            logger.info(f"Session {session_id}: Falling back to tinyllama_once")
+            try:
+                response_text = await tinyllama_once(prompt, session_id, history, priority)
+            except (PoolSaturatedError, PoolUnavailableError) as e:
+                # Every local instance is busy and the queue is full: fail fast
+                logger.warning(f"Session {session_id}: TinyLLaMA rejected the request: {e}")
+                raise HTTPException(
+                    status_code=503,
+                    detail=str(e),
+                    headers={"Retry-After": str(LOCAL_POOL_RETRY_AFTER)}
+                )
+            except Exception:
+                BACKEND_ERRORS.labels("tinyllama").inc()
+                raise
+            backend = "tinyllama"
+            logger.info(f"Session {session_id}: Received TinyLLaMA once response (length {len(response_text)})")
+
+        # Save the assistant's reply to conversation history
+        await sessions.aappend(session_id, "assistant", response_text)
+        logger.info(f"Session {session_id}: chat_once response saved")
+        REQUESTS.labels("chat_once", backend).inc()
+        REQUEST_LATENCY.labels("chat_once", backend).observe(time.perf_counter() - received)
 
     # Return the full assistant response as JSON
     return {"response": response_text}
@@ -178,7 +257,8 @@ async def chat_reset(payload: dict):
     if not session_id:
         logger.warning("Missing session_id in chat_reset request")
         raise HTTPException(status_code=400, detail="Missing session_id")
-    reset_history(session_id)
+    await sessions.areset(session_id)
+    forget_session(session_id)
     logger.info(f"Session {session_id}: History reset")
     return {"status": "reset"}
 
@@ -200,13 +280,91 @@ async def chat_reset(payload: dict):
         raise HTTPException(status_code=400, detail="Missing session_id")
     
     # Perform the history reset operation for this session
-    reset_history(session_id)
+    await sessions.areset(session_id)
+    forget_session(session_id)
     logger.info(f"Session {session_id}: History reset")
 
     # Return a confirmation of the reset action
     return {"status": "reset"}
 
 
+@app.post("/chat_expire")
+async def chat_expire(payload: dict):
+    """
+    Delete every session idle for longer than a given time.
+    Expects a JSON payload with 'older_than' in seconds.
+    Returns the number of sessions deleted.
+    """
+    try:
+        older_than = float(payload.get("older_than"))
+    except (TypeError, ValueError):
+        logger.warning("Missing or invalid older_than in chat_expire request")
+        raise HTTPException(status_code=400, detail="Missing or invalid older_than (seconds)")
+    expired = await sessions.aexpire(older_than)
+    logger.info(f"Expired {len(expired)} sessions idle for more than {older_than:.0f}s")
+    return {"expired": len(expired)}
+
+
+# -----------------------------------------------------------------------------
+# Session Cache Lifecycle
+# -----------------------------------------------------------------------------
+# Shutdown handlers run in registration order: the local engine is drained
+# before the sessions its turns write to are closed.
+@app.on_event("shutdown")
+async def stop_local_pool():
+    """
+    Stop accepting local generations and wait (up to LOCAL_SHUTDOWN_TIMEOUT)
+    for queued and running ones to finish and their turns to save the reply.
+    """
+    deadline = time.monotonic() + LOCAL_SHUTDOWN_TIMEOUT
+    # Wait off the event loop, which still delivers the remaining tokens
+    await asyncio.to_thread(shutdown_pool, True, LOCAL_SHUTDOWN_TIMEOUT)
+    while session_locks.active() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+@app.on_event("shutdown")
+def flush_sessions():
+    """
+    Write every session message still held in memory, then close the
+    session store, before exiting.
+    """
+    sessions.close()
+    store.close()
+
+
+@app.get("/session_stats")
+async def session_stats():
+    """
+    Return the number of sessions held in memory and of messages not yet
+    written to disk.
+    """
+    return sessions.stats()
+
+
+@app.get("/pool_stats")
+async def local_pool_stats():
+    """
+    Return the TinyLLaMA instance pool's busy instances, queued requests
+    and request counters.
+    """
+    return pool_stats()
+
+
+# -----------------------------------------------------------------------------
+# Metrics Endpoint
+# -----------------------------------------------------------------------------
+# Prometheus scrape target: per-backend request counts and latency, fallbacks,
+# time to first token, streaming speed and session storage time.
+@app.get("/metrics")
+async def metrics():
+    """
+    Return all service metrics in the Prometheus text exposition format.
+    """
+    payload, content_type = metrics_payload()
+    return Response(payload, media_type=content_type)
+
+
 # -----------------------------------------------------------------------------
 # Health Check Endpoint
 # -----------------------------------------------------------------------------
@@ -0,0 +1,138 @@
+import time
+from typing import AsyncIterator
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# -----------------------------------------------------------------------------
+# Prometheus Metrics
+# -----------------------------------------------------------------------------
+# Request latency per backend (Gemini vs. local TinyLLaMA), fallbacks and
+# session storage time, exposed at /metrics. Histograms keep per-bucket
+# counts, so Prometheus can compute p50/p95/p99 over any time window.
+
+# Seconds, from a session file read to a long local completion
+_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+# Streaming speed, in chunks per second (one token per chunk for TinyLLaMA)
+_RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200, 400)
+
+REQUESTS = Counter(
+    "chatbot_requests_total",
+    "Chat requests answered, by endpoint and backend",
+    ["endpoint", "backend"]
+)
+FALLBACKS = Counter(
+    "chatbot_fallbacks_total",
+    "Requests that fell back from Gemini to TinyLLaMA",
+    ["endpoint"]
+)
+BACKEND_ERRORS = Counter(
+    "chatbot_backend_errors_total",
+    "Failed backend calls, by backend",
+    ["backend"]
+)
+REQUEST_LATENCY = Histogram(
+    "chatbot_request_duration_seconds",
+    "Time from receiving a chat request to its complete answer",
+    ["endpoint", "backend"],
+    buckets=_LATENCY_BUCKETS
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "chatbot_time_to_first_token_seconds",
+    "Time from calling a backend to its first streamed text (includes prompt evaluation)",
+    ["backend"],
+    buckets=_LATENCY_BUCKETS
+)
+TOKENS_PER_SECOND = Histogram(
+    "chatbot_tokens_per_second",
+    "Streaming speed of a backend after its first chunk",
+    ["backend"],
+    buckets=_RATE_BUCKETS
+)
+PROMPT_TOKENS = Histogram(
+    "chatbot_prompt_tokens",
+    "Tokens of history sent to a backend per turn, after fitting its context budget",
+    ["backend"],
+    buckets=(64, 128, 256, 512, 1024, 1536, 2048, 4096, 8192, 16384, 32768)
+)
+LOCAL_STATE_CACHE = Counter(
+    "chatbot_local_state_cache_total",
+    "TinyLLaMA turns that restored (hit) or lacked (miss) their session's saved model state",
+    ["result"]
+)
+LOCAL_POOL_INSTANCES = Gauge(
+    "chatbot_local_pool_instances",
+    "Local generations that can run at once (pool instances or batch engine slots)"
+)
+LOCAL_POOL_BUSY = Gauge(
+    "chatbot_local_pool_busy",
+    "Local generations running (utilization = busy / instances)"
+)
+LOCAL_POOL_QUEUED = Gauge(
+    "chatbot_local_pool_queued",
+    "Local requests waiting for a free TinyLLaMA instance or batch slot"
+)
+LOCAL_POOL_QUEUE_WAIT = Histogram(
+    "chatbot_local_pool_queue_wait_seconds",
+    "Time a local request waited for a free TinyLLaMA instance or batch slot",
+    buckets=_LATENCY_BUCKETS
+)
+LOCAL_POOL_REJECTED = Counter(
+    "chatbot_local_pool_rejected_total",
+    "Local requests rejected at once (saturated = queue full, unavailable = shut down)",
+    ["reason"]
+)
+LOCAL_BATCH_SEQUENCES = Histogram(
+    "chatbot_local_batch_sequences",
+    "Sequences evaluated together per decode step of the TinyLLaMA batch engine",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+)
+SESSION_IO = Histogram(
+    "chatbot_session_io_seconds",
+    "Time spent in session history storage, by operation",
+    ["operation"],
+    buckets=_LATENCY_BUCKETS
+)
+
+SESSION_CACHE = Counter(
+    "chatbot_session_cache_total",
+    "Session history lookups, by whether they were served from memory (hit) or disk (miss)",
+    ["result"]
+)
+
+SESSION_LOCK_WAIT = Histogram(
+    "chatbot_session_lock_wait_seconds",
+    "Time a request waited for an earlier turn of the same session to finish",
+    buckets=_LATENCY_BUCKETS
+)
+
+
+async def observe_stream(chunks: AsyncIterator[str], backend: str) -> AsyncIterator[str]:
+    """
+    Pass a backend's text stream through, recording its time to first token
+    and streaming speed once it completes. Closing this stream closes the
+    backend's at once, which cancels its generation.
+    """
+    start = time.perf_counter()
+    first = None
+    count = 0
+    try:
+        async for chunk in chunks:
+            if first is None:
+                first = time.perf_counter()
+                TIME_TO_FIRST_TOKEN.labels(backend).observe(first - start)
+            count += 1
+            yield chunk
+    finally:
+        await chunks.aclose()
+    elapsed = time.perf_counter() - first if first is not None else 0.0
+    if count > 1 and elapsed > 0:
+        TOKENS_PER_SECOND.labels(backend).observe((count - 1) / elapsed)
+
+
+def metrics_payload() -> tuple:
+    """
+    Return the current metrics in the Prometheus text format, with its
+    content type.
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
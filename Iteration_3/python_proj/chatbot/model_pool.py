@@ -0,0 +1,218 @@
+import itertools
+import logging
+import math
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from metrics import (
+    LOCAL_POOL_INSTANCES,
+    LOCAL_POOL_BUSY,
+    LOCAL_POOL_QUEUED,
+    LOCAL_POOL_QUEUE_WAIT,
+    LOCAL_POOL_REJECTED
+)
+
+# Create a module-specific logger for diagnostic messages.
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# TinyLLaMA Instance Pool
+# -----------------------------------------------------------------------------
+# A llama.cpp context serves one generation at a time, so one model instance
+# caps the local fallback at one user. The pool runs N instances, each owned
+# by its own worker thread (and given its share of the CPU cores). Requests
+# wait in one shared queue and go to whichever instance frees up first, in
+# arrival order or by priority. The queue is bounded: once it is full, new
+# requests fail at once instead of waiting behind minutes of generation.
+# The weights are memory-mapped, so the instances share them; each adds its
+# own KV cache and buffers.
+
+
+class PoolSaturatedError(Exception):
+    """Raised when every instance is busy and the request queue is full."""
+
+
+class PoolUnavailableError(Exception):
+    """Raised when the pool has been shut down and accepts no new work."""
+
+
+class ModelPool:
+    """
+    Model instances served by one worker thread each, fed from a shared
+    request queue.
+
+    Args:
+        factory: Creates a model instance; called by each worker thread on
+            its first job (replaceable until then, e.g. by a benchmark).
+        size: Number of instances (and worker threads).
+        queue_size: Requests allowed to wait for an instance; beyond that,
+            new requests are rejected.
+        policy: "fifo" serves requests in arrival order; "priority" serves
+            the lowest priority value first (arrival order among equals).
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int, queue_size: int, policy: str = "fifo"):
+        self.factory = factory
+        self.size = size
+        self.queue_size = queue_size
+        self.policy = policy
+        # Entries are (priority, arrival number, job); the arrival number is
+        # unique, so jobs themselves are never compared
+        self._jobs: "queue.PriorityQueue[tuple]" = queue.PriorityQueue()
+        self._arrivals = itertools.count()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._pending = 0
+        self._busy = 0
+        self._loaded = 0
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0}
+        LOCAL_POOL_INSTANCES.set(size)
+
+        self._threads = [
+            threading.Thread(target=self._run, name=f"tinyllama-{i}", daemon=True)
+            for i in range(size)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    # ------------------------------------------------------------------
+    # Worker side
+    # ------------------------------------------------------------------
+    def current(self) -> Any:
+        """
+        Return the instance owned by the calling worker thread, loading it
+        on first use. Only valid inside a job.
+        """
+        llm = getattr(self._local, "llm", None)
+        if llm is None:
+            logger.info(f"Loading TinyLLaMA instance for {threading.current_thread().name}")
+            llm = self.factory()
+            self._local.llm = llm
+            with self._lock:
+                self._loaded += 1
+        return llm
+
+    def _run(self) -> None:
+        """
+        Worker loop: take the next request off the queue and run it on this
+        thread's instance, until the shutdown marker arrives.
+        """
+        while True:
+            _, _, job = self._jobs.get()
+            if job is None:
+                return
+            fn, args, future, enqueued = job
+            if not future.set_running_or_notify_cancel():
+                # The caller gave up while the request was queued; its place
+                # was released when it was cancelled
+                continue
+            LOCAL_POOL_QUEUE_WAIT.observe(time.perf_counter() - enqueued)
+            with self._lock:
+                self._busy += 1
+                self._update_gauges()
+            try:
+                result = fn(self.current(), *args)
+            except BaseException as e:
+                future.set_exception(e)
+                self._done("failed", busy=True)
+            else:
+                future.set_result(result)
+                self._done("completed", busy=True)
+
+    def _done(self, outcome: str, busy: bool = False) -> None:
+        """
+        Count a request's outcome and release its place in the pool.
+        """
+        with self._lock:
+            self._pending -= 1
+            self._counters[outcome] += 1
+            if busy:
+                self._busy -= 1
+            self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        """Export busy instances and queued requests (lock held)."""
+        LOCAL_POOL_BUSY.set(self._busy)
+        LOCAL_POOL_QUEUED.set(self._pending - self._busy)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def submit(self, fn: Callable[..., Any], *args, priority: int = 0) -> Future:
+        """
+        Queue `fn(llm, *args)` to run on the next free instance.
+
+        Cancelling the returned future before an instance picks the request
+        up withdraws it: its place in the queue is freed and it is skipped.
+
+        Args:
+            fn: Function taking a model instance and `args`.
+            priority: Lower values are served first under the "priority"
+                policy; ignored under "fifo".
+
+        Returns:
+            A future of the function's result.
+
+        Raises:
+            PoolSaturatedError: If every instance is busy and the queue is full.
+            PoolUnavailableError: If the pool has been shut down.
+        """
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                LOCAL_POOL_REJECTED.labels("unavailable").inc()
+                raise PoolUnavailableError("TinyLLaMA pool is shut down")
+            if self._pending >= self.size + self.queue_size:
+                self._counters["rejected"] += 1
+                LOCAL_POOL_REJECTED.labels("saturated").inc()
+                raise PoolSaturatedError(
+                    f"TinyLLaMA pool is saturated ({self.size} busy, {self.queue_size} queued)"
+                )
+            self._pending += 1
+            self._counters["submitted"] += 1
+            self._update_gauges()
+            order = priority if self.policy == "priority" else 0
+            self._jobs.put((order, next(self._arrivals), (fn, args, future, time.perf_counter())))
+        # Only a queued request can be cancelled: free its place right away
+        future.add_done_callback(lambda f: f.cancelled() and self._done("cancelled"))
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the pool's size, occupancy and request counters.
+        """
+        with self._lock:
+            return {
+                "engine": "pool",
+                "instances": self.size,
+                "instances_loaded": self._loaded,
+                "busy": self._busy,
+                "queued": self._pending - self._busy,
+                "queue_size": self.queue_size,
+                "policy": self.policy,
+                **self._counters,
+            }
+
+    def shutdown(self, wait: bool = False, timeout: Optional[float] = None) -> None:
+        """
+        Stop accepting requests; the workers exit once the queue is drained.
+
+        Args:
+            wait: Block until the workers have exited.
+            timeout: Maximum seconds to wait (no limit if None).
+        """
+        with self._lock:
+            closing = not self._closed
+            self._closed = True
+        if closing:
+            # Markers sort after every queued request, whatever its priority
+            for _ in self._threads:
+                self._jobs.put((math.inf, next(self._arrivals), None))
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for thread in self._threads:
+                thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
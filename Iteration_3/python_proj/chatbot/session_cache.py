@@ -0,0 +1,283 @@
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from chatbot_config import SESSION_CACHE_SIZE, SESSION_CACHE_TTL, SESSION_FLUSH_INTERVAL, SESSION_IO_THREADS
+from metrics import SESSION_CACHE, SESSION_LOCK_WAIT
+from session_manager import store, load_history, load_and_append, append_messages, reset_history, expire_sessions
+
+# Create a module-specific logger for diagnostic messages.
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# In-Memory Session Cache
+# -----------------------------------------------------------------------------
+# Every chat turn reads the history and adds two messages to it. Hot sessions
+# are kept in an LRU in memory: a turn reads from memory and only touches
+# disk when its session was not cached. New messages are marked dirty and
+# written behind, several per write, by a background flusher thread.
+# Disk writes happen under the cache lock; they are small appends.
+#
+# A shared (networked) store is also written by other workers, so a cached
+# history could be stale: histories then always come from the store, and a
+# new message is appended and the history read back in one round trip.
+#
+# Endpoints use the async methods (aget, aappend, areset, aexpire), which run
+# the calls on dedicated session I/O threads: a slow disk or store, or a
+# flush holding the lock, never blocks the event loop streaming tokens to
+# other clients.
+
+
+class _Entry:
+    """A cached session: its full history and the messages not yet on disk."""
+
+    __slots__ = ("history", "pending", "touched")
+
+    def __init__(self, history: List[Dict[str, str]]):
+        self.history = history
+        self.pending: List[Dict[str, str]] = []
+        self.touched = time.monotonic()
+
+
+class SessionCache:
+    """
+    LRU of conversation histories with write-behind persistence.
+
+    Sessions beyond `max_sessions`, or idle for `idle_ttl` seconds, are
+    written out and evicted. Dirty sessions are flushed every
+    `flush_interval` seconds (0 writes each message through) and on close().
+    With `shared`, nothing is cached and every call goes to the store.
+    """
+
+    def __init__(self, max_sessions: int, idle_ttl: float, flush_interval: float, shared: bool = False,
+                 io_threads: int = 1):
+        self._shared = shared
+        self._io = ThreadPoolExecutor(max_workers=max(1, io_threads), thread_name_prefix="session-io")
+        if shared:
+            flush_interval = 0
+        self._max_sessions = max(1, max_sessions)
+        self._idle_ttl = idle_ttl
+        self._flush_interval = flush_interval
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Held across disk writes too, so a session evicted with unflushed
+        # messages cannot be reloaded from disk before they are written
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._run, name="session-flusher", daemon=True)
+            self._flusher.start()
+
+    def _entry(self, session_id: str) -> _Entry:
+        """
+        Return the cached entry of a session, loading it on a miss.
+        Must be called with the lock held.
+        """
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            SESSION_CACHE.labels("hit").inc()
+            self._entries.move_to_end(session_id)
+        else:
+            SESSION_CACHE.labels("miss").inc()
+            entry = self._entries[session_id] = _Entry(load_history(session_id))
+        entry.touched = time.monotonic()
+        return entry
+
+    def get(self, session_id: str) -> List[Dict[str, str]]:
+        """
+        Return a copy of a session's history, including unflushed messages.
+        """
+        if self._shared:
+            return load_history(session_id)
+        with self._lock:
+            history = list(self._entry(session_id).history)
+            self._evict()
+        return history
+
+    def append(self, session_id: str, role: str, content: str) -> List[Dict[str, str]]:
+        """
+        Add a message to a session and return a copy of the updated history.
+
+        The message reaches disk with the next flush (immediately when
+        write-behind is disabled).
+        """
+        message = {"role": role, "content": content}
+        if self._shared:
+            return load_and_append(session_id, [message])
+        with self._lock:
+            if session_id not in self._entries:
+                # Miss: append and read the history back in one store call
+                SESSION_CACHE.labels("miss").inc()
+                entry = self._entries[session_id] = _Entry(load_and_append(session_id, [message]))
+            else:
+                entry = self._entry(session_id)
+                entry.history.append(message)
+                entry.pending.append(message)
+                if not self._flusher:
+                    self._write(session_id, entry)
+            history = list(entry.history)
+            self._evict()
+        return history
+
+    def reset(self, session_id: str) -> None:
+        """
+        Forget one session ("all" for every session) and reset it on disk.
+        """
+        with self._lock:
+            if session_id == "all":
+                self._entries.clear()
+            else:
+                self._entries.pop(session_id, None)
+            reset_history(session_id)
+
+    def expire(self, older_than: float) -> List[str]:
+        """
+        Delete the sessions not updated for `older_than` seconds from the
+        store and from memory. Pending messages are written first, so
+        sessions that just received a message are kept.
+
+        Returns:
+            The IDs of the deleted sessions.
+        """
+        with self._lock:
+            for session_id, entry in self._entries.items():
+                self._write(session_id, entry)
+            expired = expire_sessions(older_than)
+            for session_id in expired:
+                self._entries.pop(session_id, None)
+        return expired
+
+    def _write(self, session_id: str, entry: _Entry) -> None:
+        """
+        Append a session's unflushed messages to its log in one write.
+        Must be called with the lock held.
+        """
+        if not entry.pending:
+            return
+        try:
+            append_messages(session_id, entry.pending)
+            entry.pending = []
+        except Exception as e:
+            # Kept pending; the next flush retries
+            logger.error(f"Session {session_id}: failed to write {len(entry.pending)} messages: {e}")
+
+    def _evict(self) -> None:
+        """
+        Write out and drop the least recently used sessions beyond capacity
+        and the idle ones. Must be called with the lock held.
+        """
+        now = time.monotonic()
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self._max_sessions and now - entry.touched < self._idle_ttl:
+                break
+            self._write(session_id, entry)
+            if entry.pending:
+                # Could not be written; keep it rather than lose messages
+                self._entries.move_to_end(session_id)
+                break
+            del self._entries[session_id]
+
+    def flush(self) -> None:
+        """Write the unflushed messages of every session."""
+        with self._lock:
+            for session_id, entry in self._entries.items():
+                self._write(session_id, entry)
+
+    def _run(self) -> None:
+        """Flusher thread: write dirty sessions and evict idle ones periodically."""
+        while not self._closed.wait(self._flush_interval):
+            with self._lock:
+                for session_id, entry in self._entries.items():
+                    self._write(session_id, entry)
+                self._evict()
+
+    def close(self) -> None:
+        """Stop the flusher and I/O threads and write every message still in memory."""
+        self._closed.set()
+        if self._flusher:
+            self._flusher.join()
+        self._io.shutdown(wait=True)
+        self.flush()
+
+    # -------- Async API --------
+    async def _run_io(self, fn, *args):
+        """Run a blocking session call on the session I/O threads."""
+        return await asyncio.get_running_loop().run_in_executor(self._io, fn, *args)
+
+    async def aget(self, session_id: str) -> List[Dict[str, str]]:
+        """Async get(): a copy of a session's history."""
+        return await self._run_io(self.get, session_id)
+
+    async def aappend(self, session_id: str, role: str, content: str) -> List[Dict[str, str]]:
+        """Async append(): add a message and return the updated history."""
+        return await self._run_io(self.append, session_id, role, content)
+
+    async def areset(self, session_id: str) -> None:
+        """Async reset(): forget one session, or "all"."""
+        await self._run_io(self.reset, session_id)
+
+    async def aexpire(self, older_than: float) -> List[str]:
+        """Async expire(): delete sessions idle for `older_than` seconds."""
+        return await self._run_io(self.expire, older_than)
+
+    def stats(self) -> dict:
+        """Return the number of cached sessions and of unflushed messages."""
+        with self._lock:
+            return {
+                "backend": type(store).__name__,
+                "shared": self._shared,
+                "sessions": len(self._entries),
+                "capacity": self._max_sessions,
+                "pending_messages": sum(len(e.pending) for e in self._entries.values()),
+            }
+
+
+class SessionLocks:
+    """
+    One asyncio lock per session with a turn in progress.
+
+    A chat turn saves the prompt, generates from the history and saves the
+    reply; two turns of one session running at once would interleave their
+    messages and answer without seeing each other. Endpoints hold the
+    session's lock for the whole turn. Locks are dropped once no request
+    holds or waits for them. They serialize turns within one worker process.
+    """
+
+    def __init__(self):
+        # session_id -> [lock, requests holding or waiting for it]
+        self._locks: Dict[str, list] = {}
+
+    def active(self) -> int:
+        """Return the number of sessions with a turn in progress or waiting."""
+        return len(self._locks)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, session_id: str):
+        entry = self._locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            start = time.perf_counter()
+            async with entry[0]:
+                SESSION_LOCK_WAIT.observe(time.perf_counter() - start)
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[session_id]
+
+
+# Shared by all chatbot endpoints
+sessions = SessionCache(
+    SESSION_CACHE_SIZE,
+    SESSION_CACHE_TTL,
+    SESSION_FLUSH_INTERVAL,
+    shared=store.shared,
+    io_threads=SESSION_IO_THREADS
+)
+session_locks = SessionLocks()
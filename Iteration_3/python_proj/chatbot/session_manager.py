@@ -1,11 +1,22 @@
 import os
-import json
 from typing import List, Dict
 
+from chatbot_config import (
+    SESSION_BACKEND,
+    SESSION_DB_PATH,
+    SESSION_FSYNC,
+    SESSION_REDIS_URL,
+    SESSION_REDIS_TTL,
+    SESSION_REDIS_POOL_SIZE,
+    SESSION_REDIS_PREFIX
+)
+from metrics import SESSION_IO
+from session_store import create_store
+
 # -----------------------------------------------------------------------------
 # Session Storage Directory Setup
 # -----------------------------------------------------------------------------
-# Define the base directory for storing per-session JSON history files.
+# Define the base directory of the file store's per-session logs.
 dir_base = os.path.join(os.path.dirname(__file__), "User")
 # Ensure the directory exists; create it if necessary.
 os.makedirs(dir_base, exist_ok=True)
@@ -20,112 +31,103 @@ with open(_system_prompt_path, "r", encoding="utf-8") as f:
 # Wrap the system prompt in the standard message format.
 SYSTEM_MSG = {"role": "system", "content": SYSTEM_CONTENT}
 
-
-def _session_path(session_id: str) -> str:
+# -----------------------------------------------------------------------------
+# Session Store
+# -----------------------------------------------------------------------------
+# Backend selected by SESSION_BACKEND (see session_store.py); every function
+# below goes through it.
+store = create_store(
+    SESSION_BACKEND,
+    dir_base,
+    SESSION_DB_PATH or os.path.join(dir_base, "sessions.db"),
+    SYSTEM_MSG,
+    fsync=SESSION_FSYNC,
+    redis_url=SESSION_REDIS_URL,
+    redis_ttl=SESSION_REDIS_TTL,
+    redis_pool_size=SESSION_REDIS_POOL_SIZE,
+    redis_prefix=SESSION_REDIS_PREFIX
+)
+
+
+@SESSION_IO.labels("load").time()
+def load_history(session_id: str) -> List[Dict[str, str]]:
     """
-    Construct the file path for storing a session's history JSON.
+    Load or initialize the conversation history for a session.
+
+    If no history exists, one containing only the system message is created.
 
     Args:
         session_id: Unique identifier for the chat session.
 
     Returns:
-        The full filesystem path to the session's JSON file.
+        A list of message dicts, each with 'role' and 'content' keys.
     """
-    filename = f"{session_id}.json"
-    return os.path.join(dir_base, filename)
+    return store.load(session_id)
 
 
-def load_history(session_id: str) -> List[Dict[str, str]]:
+def save_history(session_id: str, role: str, content: str) -> None:
     """
-    Load or initialize the conversation history for a session.
-
-    If no history file exists, create one containing only the system message.
-    If the existing file is invalid or empty, reinitialize it.
+    Append a new message to the session history.
 
     Args:
         session_id: Unique identifier for the chat session.
+        role: Sender role, either 'user' or 'assistant'.
+        content: Text content of the message.
+    """
+    append_messages(session_id, [{"role": role, "content": content}])
 
-    Returns:
-        A list of message dicts, each with 'role' and 'content' keys.
+
+@SESSION_IO.labels("save").time()
+def append_messages(session_id: str, messages: List[Dict[str, str]]) -> None:
     """
-    path = _session_path(session_id)
-
-    # If the session file does not exist, create it with the system prompt.
-    if not os.path.isfile(path):
-        history = [SYSTEM_MSG]
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-        return history
-
-    # Attempt to read and parse the existing history file.
-    try:
-        with open(path, 'r', encoding='utf-8') as f:
-            history = json.load(f)
-        # Ensure the file contains a non-empty list of messages.
-        if isinstance(history, list) and history:
-            return history
-    except Exception:
-        # Fall through to reinitialization on any read/parse error.
-        pass
-
-    # On error or invalid content, reinitialize the file with system prompt.
-    history = [SYSTEM_MSG]
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
-    return history
+    Append several messages to the session history in a single write.
 
+    Args:
+        session_id: Unique identifier for the chat session.
+        messages: Message dicts with 'role' and 'content' keys, in order.
+    """
+    store.append(session_id, messages)
 
-def save_history(session_id: str, role: str, content: str) -> None:
+
+@SESSION_IO.labels("save").time()
+def load_and_append(session_id: str, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
     """
-    Append a new message to the session history and persist to disk.
+    Append messages to the session history and return the updated history,
+    in a single round trip for networked stores.
 
     Args:
         session_id: Unique identifier for the chat session.
-        role: Sender role, either 'user' or 'assistant'.
-        content: Text content of the message.
+        messages: Message dicts with 'role' and 'content' keys, in order.
+
+    Returns:
+        The full history, ending with the appended messages.
     """
-    path = _session_path(session_id)
-    # Load current history (will recreate file if missing).
-    history = load_history(session_id)
-    # Append the new message dict.
-    history.append({"role": role, "content": content})
-    # Overwrite the history file with the updated list.
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
+    return store.load_and_append(session_id, messages)
 
 
+@SESSION_IO.labels("reset").time()
 def reset_history(session_id: str) -> None:
     """
     Reset conversation history for one or all sessions.
 
-    If session_id == "all", delete every JSON file in the User directory.
-    Otherwise, delete the file for the given session_id. On failure,
-    recreate the session file initialized with only the system message.
-
     Args:
         session_id: Session identifier or "all" for a full reset.
     """
-    # Full reset: remove all session files.
     if session_id == "all":
-        for filename in os.listdir(dir_base):
-            if filename.endswith('.json'):
-                try:
-                    os.remove(os.path.join(dir_base, filename))
-                except Exception:
-                    # Ignore individual file deletion errors.
-                    continue
-        return
-
-    # Single-session reset: delete or reinitialize the specific file.
-    path = _session_path(session_id)
-    if os.path.isfile(path):
-        try:
-            os.remove(path)
-        except Exception:
-            # On deletion failure, overwrite with only the system message.
-            with open(path, 'w', encoding='utf-8') as f:
-                json.dump([SYSTEM_MSG], f, ensure_ascii=False, indent=2)
+        store.reset_all()
     else:
-        # If file does not exist, create it with only the system message.
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump([SYSTEM_MSG], f, ensure_ascii=False, indent=2)
+        store.reset(session_id)
+
+
+@SESSION_IO.labels("expire").time()
+def expire_sessions(older_than: float) -> List[str]:
+    """
+    Delete every session not updated for `older_than` seconds.
+
+    Args:
+        older_than: Idle time in seconds.
+
+    Returns:
+        The IDs of the deleted sessions.
+    """
+    return store.expire(older_than)
@@ -0,0 +1,546 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, Iterator, List
+
+# Create a module-specific logger for diagnostic messages.
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Session Store Interface
+# -----------------------------------------------------------------------------
+# session_manager persists conversation histories through a SessionStore, so
+# the storage backend can change without touching the endpoints:
+#   - "file":   one append-only JSONL log per session (the default)
+#   - "sqlite": a single SQLite database in WAL mode, indexed by session and
+#               last update, so admin operations are single queries
+#   - "redis":  a Redis server shared by every worker and VM, for
+#               horizontally scaled deployments
+
+
+class SessionStore:
+    """
+    Storage backend of conversation histories.
+
+    A history is a list of {'role', 'content'} dicts starting with the
+    system message; a session that was never saved loads as just that.
+    """
+
+    # True when other processes write the same sessions (a networked store),
+    # so histories must not be served from a per-process cache
+    shared = False
+
+    def __init__(self, system_msg: Dict[str, str]):
+        self.system_msg = system_msg
+
+    def load(self, session_id: str) -> List[Dict[str, str]]:
+        """Return the full history of a session."""
+        raise NotImplementedError
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        """Add messages, in order, to the end of a session's history."""
+        raise NotImplementedError
+
+    def load_and_append(self, session_id: str, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Add messages to a session and return its full history, including them.
+        Networked stores do both in one round trip.
+        """
+        self.append(session_id, messages)
+        return self.load(session_id)
+
+    def reset(self, session_id: str) -> None:
+        """Delete a session's history."""
+        raise NotImplementedError
+
+    def reset_all(self) -> None:
+        """Delete every stored session."""
+        raise NotImplementedError
+
+    def expire(self, older_than: float) -> List[str]:
+        """
+        Delete the sessions not updated for `older_than` seconds.
+
+        Returns:
+            The IDs of the deleted sessions.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release connections or file handles held by the store."""
+
+
+# -----------------------------------------------------------------------------
+# File Store (Append-Only JSONL Logs)
+# -----------------------------------------------------------------------------
+class FileSessionStore(SessionStore):
+    """
+    One append-only log per session, `{session_id}.jsonl`, holding one JSON
+    message per line: saving a message is a single small append whatever the
+    length of the conversation, and loading streams the records back.
+    Sessions saved as `{session_id}.json` arrays by earlier versions are
+    converted to a log the first time they are loaded.
+
+    With `fsync`, every append and rewrite is flushed to the disk before it
+    returns, so a power loss cannot drop acknowledged messages; otherwise
+    the OS writes them back on its own schedule (a process crash loses
+    nothing either way).
+    """
+
+    def __init__(self, directory: str, system_msg: Dict[str, str], fsync: bool = False):
+        super().__init__(system_msg)
+        self.directory = directory
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+    def _session_path(self, session_id: str) -> str:
+        """Return the file path of a session's append-only message log."""
+        return os.path.join(self.directory, f"{session_id}.jsonl")
+
+    def _legacy_path(self, session_id: str) -> str:
+        """Return the path of a session's history in the old single-JSON-array format."""
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    @staticmethod
+    def _encode(message: Dict[str, str]) -> bytes:
+        """Serialize one message as a single log record (one line)."""
+        return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+    @staticmethod
+    def _read_records(path: str) -> Iterator[Dict[str, str]]:
+        """
+        Stream the messages of a session log, one record per line.
+
+        A line that is not a complete JSON message (e.g. the tail of a write
+        interrupted by a crash) is yielded as None so the caller can compact it away.
+        """
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if isinstance(record, dict) and "role" in record and "content" in record:
+                    yield record
+                else:
+                    yield None
+
+    def _write_log(self, path: str, history: List[Dict[str, str]]) -> None:
+        """
+        Rewrite a whole session log atomically (write a temporary file, then
+        rename it over the log), so a crash never leaves a half-written log.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(b"".join(self._encode(message) for message in history))
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        if self.fsync:
+            # Persist the rename itself
+            dir_fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def compact(self, session_id: str) -> List[Dict[str, str]]:
+        """
+        Rewrite a session log keeping only its complete message records.
+
+        Run automatically when a load finds damaged records; appending after a
+        torn line would otherwise keep the damage in the middle of the log.
+        A log needs no other compaction: records are never updated or deleted
+        in place, so every complete line is a live message.
+
+        Returns:
+            The messages kept, starting with the system message.
+        """
+        path = self._session_path(session_id)
+        history = [r for r in self._read_records(path) if r is not None] if os.path.isfile(path) else []
+        if not history or history[0].get("role") != "system":
+            history.insert(0, self.system_msg)
+        self._write_log(path, history)
+        return history
+
+    def _migrate_legacy(self, session_id: str) -> bool:
+        """
+        Convert a session stored as one JSON array into an append-only log.
+
+        Returns:
+            True if a legacy history was found and converted.
+        """
+        legacy = self._legacy_path(session_id)
+        if not os.path.isfile(legacy):
+            return False
+        with open(legacy, "r", encoding="utf-8") as f:
+            text = f.read()
+        try:
+            history = json.loads(text)
+        except ValueError:
+            # Rewritten whole on every message, the old format could be left
+            # truncated by a crash; keep the messages before the damage
+            history = _salvage_array(text)
+            logger.warning(f"Session {session_id}: damaged history, salvaged {len(history)} messages")
+        history = [m for m in history if isinstance(m, dict) and "role" in m and "content" in m] \
+            if isinstance(history, list) else []
+        if not history or history[0].get("role") != "system":
+            history.insert(0, self.system_msg)
+        self._write_log(self._session_path(session_id), history)
+        os.remove(legacy)
+        logger.info(f"Session {session_id}: converted to an append-only log")
+        return True
+
+    def load(self, session_id: str) -> List[Dict[str, str]]:
+        path = self._session_path(session_id)
+
+        # If the session log does not exist, convert an old-format history or
+        # start a new log with the system prompt.
+        if not os.path.isfile(path) and not self._migrate_legacy(session_id):
+            history = [self.system_msg]
+            self._write_log(path, history)
+            return history
+
+        history = list(self._read_records(path))
+        if history and None not in history:
+            return history
+
+        # On damaged or empty content, keep every complete message.
+        logger.warning(f"Session {session_id}: damaged session log, compacting")
+        return self.compact(session_id)
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        path = self._session_path(session_id)
+        if not os.path.isfile(path):
+            # Create the log (or convert an old-format history) before appending
+            self.load(session_id)
+
+        records = b"".join(self._encode(message) for message in messages)
+        with open(path, "ab+") as f:
+            # A write torn by a crash leaves the last line unterminated; start a
+            # new line so these records stay readable.
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    records = b"\n" + records
+            f.write(records)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def reset(self, session_id: str) -> None:
+        # Delete the log and any old-format history; on deletion failure,
+        # overwrite the log with only the system message.
+        paths = [p for p in (self._session_path(session_id), self._legacy_path(session_id)) if os.path.isfile(p)]
+        try:
+            for path in paths:
+                os.remove(path)
+        except Exception:
+            self._write_log(self._session_path(session_id), [self.system_msg])
+        if not paths:
+            # If no history exists, create a log with only the system message.
+            self._write_log(self._session_path(session_id), [self.system_msg])
+
+    def _session_files(self) -> Iterator[os.DirEntry]:
+        """Yield the directory entries of every session log and old-format history."""
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith((".jsonl", ".json")) and entry.is_file():
+                    yield entry
+
+    def reset_all(self) -> None:
+        for entry in list(self._session_files()):
+            try:
+                os.remove(entry.path)
+            except Exception:
+                # Ignore individual file deletion errors.
+                continue
+
+    def expire(self, older_than: float) -> List[str]:
+        # Files carry no index: every session's modification time is checked
+        cutoff = time.time() - older_than
+        expired = []
+        for entry in list(self._session_files()):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    expired.append(entry.name.rsplit(".", 1)[0])
+            except OSError:
+                continue
+        return expired
+
+
+def _salvage_array(text: str) -> List[Dict[str, str]]:
+    """
+    Decode the complete objects at the start of a truncated JSON array.
+    """
+    decoder = json.JSONDecoder()
+    items = []
+    idx = text.find("[") + 1
+    if not idx:
+        return items
+    while True:
+        # Skip the separator before the next element
+        while idx < len(text) and text[idx] in " \t\r\n,":
+            idx += 1
+        try:
+            item, idx = decoder.raw_decode(text, idx)
+        except ValueError:
+            return items
+        items.append(item)
+
+
+# -----------------------------------------------------------------------------
+# SQLite Store
+# -----------------------------------------------------------------------------
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id  TEXT PRIMARY KEY,
+    updated_at  REAL NOT NULL,
+    next_seq    INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id  TEXT NOT NULL,
+    seq         INTEGER NOT NULL,
+    role        TEXT NOT NULL,
+    content     TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+"""
+
+# Constant statements, so sqlite3's statement cache prepares each only once
+# per connection
+_LOAD = "SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq"
+_NEXT_SEQ = "SELECT next_seq FROM sessions WHERE session_id = ?"
+_UPSERT_SESSION = (
+    "INSERT INTO sessions (session_id, updated_at, next_seq) VALUES (?, ?, ?) "
+    "ON CONFLICT (session_id) DO UPDATE SET updated_at = excluded.updated_at, next_seq = excluded.next_seq"
+)
+_INSERT_MESSAGE = "INSERT INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)"
+_DELETE_MESSAGES = "DELETE FROM messages WHERE session_id = ?"
+_DELETE_SESSION = "DELETE FROM sessions WHERE session_id = ?"
+_EXPIRED = "SELECT session_id FROM sessions WHERE updated_at < ?"
+_EXPIRE_MESSAGES = (
+    "DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE updated_at < ?)"
+)
+_EXPIRE_SESSIONS = "DELETE FROM sessions WHERE updated_at < ?"
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    All sessions in one SQLite database in WAL mode (readers never block the
+    writer). Messages are keyed by (session_id, seq); sessions are indexed
+    by updated_at, so expiry and reset-all are single indexed statements.
+    Each thread uses its own connection.
+    """
+
+    def __init__(self, path: str, system_msg: Dict[str, str], fsync: bool = False):
+        super().__init__(system_msg)
+        self.path = path
+        self.fsync = fsync
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Shared with close() at shutdown, otherwise used by this thread only
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # With WAL, NORMAL only syncs at checkpoints; a power loss may drop
+            # the last transactions but never corrupts the database. FULL
+            # syncs every commit.
+            conn.execute(f"PRAGMA synchronous={'FULL' if self.fsync else 'NORMAL'}")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def load(self, session_id: str) -> List[Dict[str, str]]:
+        rows = self._connect().execute(_LOAD, (session_id,)).fetchall()
+        if rows:
+            return [{"role": role, "content": content} for role, content in rows]
+        # Start a new session with the system prompt
+        self.append(session_id, [self.system_msg])
+        return [self.system_msg]
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        conn = self._connect()
+        # One transaction: the sequence number, the session row and a
+        # batched insert of every message
+        with conn:
+            row = conn.execute(_NEXT_SEQ, (session_id,)).fetchone()
+            seq = row[0] if row else 0
+            if not row and messages[0].get("role") != "system":
+                messages = [self.system_msg] + list(messages)
+            conn.executemany(_INSERT_MESSAGE, [
+                (session_id, seq + i, m["role"], m["content"]) for i, m in enumerate(messages)
+            ])
+            conn.execute(_UPSERT_SESSION, (session_id, time.time(), seq + len(messages)))
+
+    def reset(self, session_id: str) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute(_DELETE_MESSAGES, (session_id,))
+            conn.execute(_DELETE_SESSION, (session_id,))
+
+    def reset_all(self) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM messages")
+            conn.execute("DELETE FROM sessions")
+
+    def expire(self, older_than: float) -> List[str]:
+        cutoff = time.time() - older_than
+        conn = self._connect()
+        with conn:
+            expired = [row[0] for row in conn.execute(_EXPIRED, (cutoff,))]
+            if expired:
+                conn.execute(_EXPIRE_MESSAGES, (cutoff,))
+                conn.execute(_EXPIRE_SESSIONS, (cutoff,))
+        return expired
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+# -----------------------------------------------------------------------------
+# Redis Store
+# -----------------------------------------------------------------------------
+class RedisSessionStore(SessionStore):
+    """
+    Sessions on a Redis server, shared by every chatbot worker.
+
+    Each history is a list, `{prefix}session:{id}`, of JSON messages after the
+    system message (which is constant and added on load); appending is an
+    RPUSH. A sorted set, `{prefix}sessions`, indexes sessions by last update
+    for expiry and reset-all. Keys get a TTL refreshed on every append, and
+    commands of one operation are sent as a single pipeline. Redis drops a
+    key whose TTL lapses but not its index entry, so every append also
+    removes entries last updated more than a TTL ago.
+    """
+
+    shared = True
+
+    def __init__(self, url: str, system_msg: Dict[str, str], ttl: int = 0,
+                 pool_size: int = 20, prefix: str = "chatbot:"):
+        super().__init__(system_msg)
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("SESSION_BACKEND=redis requires the 'redis' package (pip install redis)") from e
+        self.ttl = ttl
+        self.prefix = prefix
+        self._index = f"{prefix}sessions"
+        # Thread-safe client over a bounded pool of connections
+        self._redis = redis.Redis(connection_pool=redis.ConnectionPool.from_url(url, max_connections=pool_size))
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}session:{session_id}"
+
+    def _history(self, records: List[bytes]) -> List[Dict[str, str]]:
+        return [self.system_msg] + [json.loads(record) for record in records]
+
+    def _queue_append(self, pipe, session_id: str, messages: List[Dict[str, str]]) -> None:
+        """Queue the commands appending messages on a pipeline."""
+        key = self._key(session_id)
+        records = [json.dumps(m, ensure_ascii=False) for m in messages if m.get("role") != "system"]
+        if records:
+            pipe.rpush(key, *records)
+        now = time.time()
+        if self.ttl > 0:
+            pipe.expire(key, self.ttl)
+            pipe.zremrangebyscore(self._index, "-inf", f"({now - self.ttl}")
+        pipe.zadd(self._index, {session_id: now})
+
+    def load(self, session_id: str) -> List[Dict[str, str]]:
+        return self._history(self._redis.lrange(self._key(session_id), 0, -1))
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        if not any(m.get("role") != "system" for m in messages):
+            return
+        with self._redis.pipeline() as pipe:
+            self._queue_append(pipe, session_id, messages)
+            pipe.execute()
+
+    def load_and_append(self, session_id: str, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        with self._redis.pipeline() as pipe:
+            self._queue_append(pipe, session_id, messages)
+            pipe.lrange(self._key(session_id), 0, -1)
+            return self._history(pipe.execute()[-1])
+
+    def reset(self, session_id: str) -> None:
+        with self._redis.pipeline() as pipe:
+            pipe.delete(self._key(session_id))
+            pipe.zrem(self._index, session_id)
+            pipe.execute()
+
+    def _delete(self, session_ids: List[str]) -> None:
+        """Delete sessions and their index entries, in pipelined batches."""
+        for start in range(0, len(session_ids), 500):
+            batch = session_ids[start:start + 500]
+            with self._redis.pipeline() as pipe:
+                pipe.delete(*(self._key(sid) for sid in batch))
+                pipe.zrem(self._index, *batch)
+                pipe.execute()
+
+    def reset_all(self) -> None:
+        self._delete([sid.decode() for sid in self._redis.zrange(self._index, 0, -1)])
+
+    def expire(self, older_than: float) -> List[str]:
+        cutoff = time.time() - older_than
+        expired = [sid.decode() for sid in self._redis.zrangebyscore(self._index, "-inf", f"({cutoff}")]
+        self._delete(expired)
+        return expired
+
+    def close(self) -> None:
+        self._redis.close()
+        self._redis.connection_pool.disconnect()
+
+
+def create_store(backend: str, directory: str, db_path: str, system_msg: Dict[str, str],
+                 fsync: bool = False, redis_url: str = "", redis_ttl: int = 0, redis_pool_size: int = 20,
+                 redis_prefix: str = "chatbot:") -> SessionStore:
+    """
+    Build the session store selected by SESSION_BACKEND.
+
+    Args:
+        backend: "file", "sqlite" or "redis".
+        directory: Directory of the file store's session logs.
+        db_path: Database file of the SQLite store.
+        system_msg: First message of every new history.
+        fsync: Flush every write of the file and SQLite stores to the disk.
+        redis_url: Server URL of the Redis store.
+        redis_ttl: Seconds a Redis session lives after its last update (0 = forever).
+        redis_pool_size: Maximum connections to the Redis server.
+        redis_prefix: Prefix of every Redis key.
+
+    Returns:
+        The configured SessionStore.
+    """
+    if backend == "file":
+        return FileSessionStore(directory, system_msg, fsync)
+    if backend == "sqlite":
+        return SQLiteSessionStore(db_path, system_msg, fsync)
+    if backend == "redis":
+        return RedisSessionStore(redis_url, system_msg, redis_ttl, redis_pool_size, redis_prefix)
+    raise ValueError(f"Unknown SESSION_BACKEND {backend!r} (expected 'file', 'sqlite' or 'redis')")
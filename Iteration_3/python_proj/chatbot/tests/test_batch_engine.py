@@ -0,0 +1,261 @@
+import threading
+import time
+
+import pytest
+
+# The engine samples with numpy and drives llama.cpp (see requirements.txt)
+np = pytest.importorskip("numpy")
+pytest.importorskip("llama_cpp")
+
+from batch_engine import BatchEngine, _apply_stops  # noqa: E402
+from benchmark import StubBatchDecoder  # noqa: E402
+from model_pool import PoolSaturatedError, PoolUnavailableError  # noqa: E402
+
+SAMPLING = {"temperature": 0.7, "top_k": 40, "top_p": 0.95}
+TIMEOUT = 10
+
+
+class RecordingDecoder(StubBatchDecoder):
+    """Stub decoder that records cache operations and can hold decode steps."""
+
+    def __init__(self, answer_tokens: int = 4):
+        super().__init__(tokens_per_second=2000, answer_tokens=answer_tokens, batch_cost=0.0)
+        self.copies = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def decode(self, entries):
+        assert self.gate.wait(TIMEOUT)
+        return super().decode(entries)
+
+    def copy(self, source, target, end):
+        self.copies.append((source, target, end))
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def make_engine(decoder, slots=2, queue_size=2):
+    return BatchEngine(lambda: decoder, slots, queue_size, batch_tokens=512, max_backlog=64)
+
+
+def prompt(decoder, user, system="You are a helpful careers assistant."):
+    return decoder.prompt_tokens([
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ])
+
+
+def test_generates_requests_in_one_batch():
+    decoder = RecordingDecoder()
+    engine = make_engine(decoder, slots=3)
+    try:
+        requests = [engine.submit(prompt(decoder, f"question {i}"), 16, SAMPLING) for i in range(3)]
+        replies = [r.future.result(TIMEOUT) for r in requests]
+        stats = engine.stats()
+    finally:
+        engine.shutdown()
+    assert all(len(reply.split()) == 4 for reply in replies)
+    assert stats["completed"] == 3
+    assert stats["busy"] == 0
+    assert stats["mean_sequences_per_step"] > 1
+
+
+def test_apply_stops_holds_back_partial_stop():
+    assert _apply_stops("Hello User", ["User:"]) == ("Hello ", "User", False)
+    assert _apply_stops("Hello User: hi", ["User:", "hi"]) == ("Hello ", "", True)
+    assert _apply_stops("Hello", ["User:"]) == ("Hello", "", False)
+
+
+def test_stop_string_ends_reply():
+    decoder = RecordingDecoder(answer_tokens=20)
+    engine = make_engine(decoder)
+    fragments = []
+    try:
+        # "can" is held back until " help" completes the stop string
+        request = engine.submit(prompt(decoder, "question"), 20, SAMPLING,
+                                on_text=fragments.append, stop=["can help"])
+        reply = request.future.result(TIMEOUT)
+        stats = engine.stats()
+    finally:
+        engine.shutdown()
+    assert reply == " Sure I "
+    assert "".join(fragments) == reply
+    assert stats["completed"] == 1
+    assert stats["busy"] == 0
+
+
+def test_rejects_when_saturated_and_after_shutdown():
+    decoder = RecordingDecoder()
+    decoder.gate.clear()
+    engine = make_engine(decoder, slots=1, queue_size=1)
+    running = engine.submit(prompt(decoder, "first"), 16, SAMPLING)
+    wait_until(lambda: engine.stats()["busy"] == 1)
+    queued = engine.submit(prompt(decoder, "second"), 16, SAMPLING)
+    with pytest.raises(PoolSaturatedError):
+        engine.submit(prompt(decoder, "third"), 16, SAMPLING)
+    assert engine.stats()["rejected"] == 1
+
+    engine.shutdown()
+    with pytest.raises(PoolUnavailableError):
+        engine.submit(prompt(decoder, "fourth"), 16, SAMPLING)
+    # Accepted requests still complete after shutdown
+    decoder.gate.set()
+    assert running.future.result(TIMEOUT)
+    assert queued.future.result(TIMEOUT)
+
+
+def test_rejects_prompt_longer_than_context():
+    decoder = RecordingDecoder()
+    engine = make_engine(decoder)
+    try:
+        with pytest.raises(ValueError):
+            engine.submit([1] * decoder.seq_ctx, 16, SAMPLING)
+    finally:
+        engine.shutdown()
+
+
+def test_withdraws_queued_request():
+    decoder = RecordingDecoder()
+    decoder.gate.clear()
+    engine = make_engine(decoder, slots=1, queue_size=1)
+    try:
+        running = engine.submit(prompt(decoder, "first"), 16, SAMPLING)
+        wait_until(lambda: engine.stats()["busy"] == 1)
+        queued = engine.submit(prompt(decoder, "second"), 16, SAMPLING)
+        queued.cancel()
+        stats = engine.stats()
+        assert stats["queued"] == 0
+        assert stats["cancelled"] == 1
+        # The freed queue place can be taken again
+        engine.submit(prompt(decoder, "third"), 16, SAMPLING)
+        decoder.gate.set()
+        assert running.future.result(TIMEOUT)
+        assert queued.future.cancelled()
+    finally:
+        decoder.gate.set()
+        engine.shutdown()
+
+
+def test_cancel_stops_generation_at_next_token():
+    decoder = RecordingDecoder(answer_tokens=1000)
+    engine = make_engine(decoder)
+    fragments = []
+    request = None
+
+    def on_text(text):
+        fragments.append(text)
+        if len(fragments) == 3:
+            request.cancel()
+
+    try:
+        request = engine.submit(prompt(decoder, "long answer"), 1000, SAMPLING, on_text=on_text)
+        reply = request.future.result(TIMEOUT)
+        stats = engine.stats()
+    finally:
+        engine.shutdown()
+    assert len(reply.split()) == 3
+    assert stats["cancelled"] == 1
+    assert stats["busy"] == 0
+
+
+def test_new_request_copies_shared_prefix_from_busy_slot():
+    decoder = RecordingDecoder(answer_tokens=1000)
+    engine = make_engine(decoder)
+    started = threading.Event()
+    try:
+        first_prompt = prompt(decoder, "first question")
+        first = engine.submit(first_prompt, 1000, SAMPLING, on_text=lambda text: started.set())
+        assert started.wait(TIMEOUT)
+        second_prompt = prompt(decoder, "second question")
+        second = engine.submit(second_prompt, 4, SAMPLING)
+        assert second.future.result(TIMEOUT)
+        first.cancel()
+        first.future.result(TIMEOUT)
+    finally:
+        engine.shutdown()
+    shared = next(i for i, (a, b) in enumerate(zip(first_prompt, second_prompt)) if a != b)
+    assert (first.slot.seq_id, second.slot.seq_id, shared) in decoder.copies
+
+
+def test_next_turn_reuses_its_slot_cache():
+    decoder = RecordingDecoder()
+    engine = make_engine(decoder)
+    try:
+        first_prompt = prompt(decoder, "first question")
+        first = engine.submit(first_prompt, 16, SAMPLING)
+        first.future.result(TIMEOUT)
+        decoded = engine.stats()["tokens_decoded"]
+        second = engine.submit(first_prompt + decoder.tokenize(b"follow up", add_bos=False), 16, SAMPLING)
+        second.future.result(TIMEOUT)
+        stats = engine.stats()
+    finally:
+        engine.shutdown()
+    assert second.slot is first.slot
+    # Only the new part of the prompt and the reply are evaluated
+    assert stats["tokens_decoded"] - decoded < len(first_prompt)
+
+
+def test_request_error_fails_only_that_request():
+    decoder = RecordingDecoder()
+    engine = make_engine(decoder)
+
+    def broken(text):
+        raise RuntimeError("event loop is closed")
+
+    try:
+        failing = engine.submit(prompt(decoder, "first"), 16, SAMPLING, on_text=broken)
+        healthy = engine.submit(prompt(decoder, "second"), 16, SAMPLING)
+        with pytest.raises(RuntimeError):
+            failing.future.result(TIMEOUT)
+        assert healthy.future.result(TIMEOUT)
+        # The engine keeps serving
+        assert engine.submit(prompt(decoder, "third"), 16, SAMPLING).future.result(TIMEOUT)
+        stats = engine.stats()
+    finally:
+        engine.shutdown()
+    assert stats["failed"] == 1
+    assert stats["completed"] == 2
+    assert stats["busy"] == 0
+
+
+def test_invalid_logits_fail_the_request():
+    decoder = RecordingDecoder()
+    decoder.decode = lambda entries: [np.full(decoder.n_vocab, np.nan) for entry in entries if entry[3]]
+    engine = make_engine(decoder)
+    try:
+        request = engine.submit(prompt(decoder, "first"), 16, SAMPLING)
+        with pytest.raises(ValueError):
+            request.future.result(TIMEOUT)
+        assert engine.stats()["busy"] == 0
+    finally:
+        engine.shutdown()
+
+
+def test_fatal_error_fails_all_requests_and_closes_engine():
+    decoder = RecordingDecoder()
+    engine = make_engine(decoder, slots=1, queue_size=1)
+    release = threading.Event()
+
+    def broken_step():
+        release.wait(TIMEOUT)
+        raise MemoryError("out of memory")
+
+    engine._step = broken_step
+    running = engine.submit(prompt(decoder, "first"), 16, SAMPLING)
+    wait_until(lambda: engine.stats()["busy"] == 1)
+    queued = engine.submit(prompt(decoder, "second"), 16, SAMPLING)
+    release.set()
+    for request in (running, queued):
+        with pytest.raises(MemoryError):
+            request.future.result(TIMEOUT)
+    with pytest.raises(PoolUnavailableError):
+        engine.submit(prompt(decoder, "third"), 16, SAMPLING)
+    stats = engine.stats()
+    assert stats["failed"] == 2
+    assert stats["busy"] == 0
+    assert stats["queued"] == 0
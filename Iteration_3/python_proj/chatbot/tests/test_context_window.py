@@ -0,0 +1,69 @@
+from context_window import ContextWindow, TokenCounter
+
+SYSTEM = {"role": "system", "content": "sys"}
+
+
+def words(n):
+    return len(n.split())
+
+
+def conversation(turns, tag="m"):
+    """System message, then alternating user/assistant messages of 10 tokens each, ending with a user one."""
+    history = [SYSTEM]
+    for i in range(1, turns + 1):
+        role = "user" if i % 2 else "assistant"
+        history.append({"role": role, "content": " ".join([f"{tag}{i}"] * 6)})
+    return history
+
+
+def make_window(budget=60, summary_tokens=20, slack=0.5):
+    return ContextWindow("test", budget, TokenCounter(words), summary_tokens, slack)
+
+
+def test_short_history_is_sent_whole():
+    history = conversation(3)
+    assert make_window().fit("s1", history) == history
+
+
+def test_drops_oldest_messages_into_summary():
+    history = conversation(9)
+    messages = make_window().fit("s1", history)
+    assert messages[1:] == history[9:]
+    summary = messages[0]["content"]
+    assert summary.startswith("sys\n\nSummary of the earlier conversation:\n")
+    # Only the most recent gists fit the summary budget
+    assert summary.splitlines()[3:] == ["- User: m7 m7 m7 m7 m7 m7", "- You: m8 m8 m8 m8 m8 m8"]
+
+
+def test_window_never_opens_on_a_reply():
+    history = conversation(9)
+    history[9:9] = [{"role": "assistant", "content": "a"}]
+    history.append({"role": "user", "content": "b"})
+    messages = make_window(slack=0).fit("s1", history)
+    assert messages[1]["role"] == "user"
+
+
+def test_window_start_is_sticky_until_messages_no_longer_fit():
+    window = make_window()
+    history = conversation(9)
+    first = window.fit("s1", history)
+
+    history = conversation(11)
+    second = window.fit("s1", history)
+    # Same start and system prompt: the previous prompt is a prefix of this one
+    assert second[:len(first)] == first
+    assert second[1:] == history[9:]
+
+    history = conversation(13)
+    third = window.fit("s1", history)
+    assert third[1:] == history[13:]
+    assert "m11" in third[0]["content"]
+
+
+def test_summary_restarts_after_history_reset():
+    window = make_window()
+    window.fit("s1", conversation(9, tag="old"))
+    assert window.fit("s1", conversation(1, tag="new")) == conversation(1, tag="new")
+    summary = window.fit("s1", conversation(9, tag="new"))[0]["content"]
+    assert "old" not in summary
+    assert "new8" in summary
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+from kv_cache import SessionStateCache
+
+
+class FakeModel:
+    """Saves states of a fixed size, as llama_cpp.Llama.save_state does."""
+
+    def __init__(self, kv_bytes, scores_bytes, ids_bytes=8):
+        self.sizes = (kv_bytes, scores_bytes, ids_bytes)
+        self.loaded = None
+
+    def save_state(self):
+        kv_bytes, scores_bytes, ids_bytes = self.sizes
+        return SimpleNamespace(llama_state_size=kv_bytes,
+                               scores=SimpleNamespace(nbytes=scores_bytes),
+                               input_ids=SimpleNamespace(nbytes=ids_bytes))
+
+    def load_state(self, state):
+        self.loaded = state
+
+
+def test_budget_counts_logits_and_token_ids():
+    cache = SessionStateCache(capacity_bytes=250)
+    llm = FakeModel(kv_bytes=50, scores_bytes=42)
+    cache.save(llm, "a")
+    assert cache.stats()["bytes"] == 100
+    cache.save(llm, "b")
+    # A third state would exceed the budget: the least recently used goes
+    assert cache.restore(llm, "a")
+    cache.save(llm, "c")
+    assert cache.stats() == {"sessions": 2, "bytes": 200, "capacity_bytes": 250}
+    assert not cache.restore(llm, "b")
+
+    cache.save(llm, "a")
+    assert cache.stats()["bytes"] == 200
+    cache.discard("a")
+    assert cache.stats()["bytes"] == 100
+
+
+def test_skips_state_larger_than_budget():
+    cache = SessionStateCache(capacity_bytes=100)
+    cache.save(FakeModel(kv_bytes=50, scores_bytes=60), "a")
+    assert cache.stats()["sessions"] == 0
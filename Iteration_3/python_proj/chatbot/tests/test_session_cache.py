@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+
+from benchmark import _placeholder_api_key
+from session_store import FileSessionStore
+
+with _placeholder_api_key():
+    # chatbot_config refuses to load without an API key
+    import session_cache
+    from session_cache import SessionCache, SessionLocks
+
+SYSTEM = {"role": "system", "content": "You are a helpful careers assistant."}
+
+
+def user(text):
+    return {"role": "user", "content": text}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = FileSessionStore(str(tmp_path), SYSTEM)
+    monkeypatch.setattr(session_cache, "load_history", store.load)
+    monkeypatch.setattr(session_cache, "load_and_append", store.load_and_append)
+    monkeypatch.setattr(session_cache, "append_messages", store.append)
+    monkeypatch.setattr(session_cache, "reset_history",
+                        lambda session_id: store.reset_all() if session_id == "all" else store.reset(session_id))
+    monkeypatch.setattr(session_cache, "expire_sessions", store.expire)
+    return store
+
+
+@pytest.fixture
+def make_cache():
+    caches = []
+
+    def make(max_sessions=10, idle_ttl=3600, flush_interval=3600, shared=False):
+        cache = SessionCache(max_sessions, idle_ttl, flush_interval, shared=shared)
+        caches.append(cache)
+        return cache
+
+    yield make
+    for cache in caches:
+        cache.close()
+
+
+def test_messages_are_written_behind(store, make_cache):
+    cache = make_cache()
+    # A miss appends and reads the history back in one store call
+    assert cache.append("s1", "user", "hello") == [SYSTEM, user("hello")]
+    assert cache.append("s1", "user", "again") == [SYSTEM, user("hello"), user("again")]
+    assert cache.get("s1") == [SYSTEM, user("hello"), user("again")]
+    assert store.load("s1") == [SYSTEM, user("hello")]
+    assert cache.stats()["pending_messages"] == 1
+
+    cache.flush()
+    assert store.load("s1") == [SYSTEM, user("hello"), user("again")]
+    assert cache.stats()["pending_messages"] == 0
+
+
+def test_no_flush_interval_writes_through(store, make_cache):
+    cache = make_cache(flush_interval=0)
+    cache.append("s1", "user", "hello")
+    cache.append("s1", "user", "again")
+    assert store.load("s1") == [SYSTEM, user("hello"), user("again")]
+
+
+def test_eviction_writes_unflushed_messages(store, make_cache):
+    cache = make_cache(max_sessions=1)
+    cache.append("s1", "user", "hello")
+    cache.append("s1", "user", "again")
+    cache.get("s2")
+    assert cache.stats()["sessions"] == 1
+    assert store.load("s1") == [SYSTEM, user("hello"), user("again")]
+    # Reloaded from the store on the next turn
+    assert cache.get("s1") == [SYSTEM, user("hello"), user("again")]
+
+
+def test_eviction_keeps_session_that_cannot_be_written(store, make_cache, monkeypatch):
+    cache = make_cache(max_sessions=1)
+    cache.append("s1", "user", "hello")
+    cache.append("s1", "user", "again")
+
+    def failing(session_id, messages):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(session_cache, "append_messages", failing)
+    cache.get("s2")
+    # Over capacity rather than losing the message
+    assert cache.stats()["sessions"] == 2
+    assert cache.get("s1") == [SYSTEM, user("hello"), user("again")]
+
+    monkeypatch.setattr(session_cache, "append_messages", store.append)
+    cache.flush()
+    assert store.load("s1") == [SYSTEM, user("hello"), user("again")]
+
+
+def test_expire_writes_pending_messages_first(store, make_cache):
+    cache = make_cache()
+    cache.append("s1", "user", "hello")
+    cache.append("s1", "user", "again")
+    assert cache.expire(3600) == []
+    assert store.load("s1") == [SYSTEM, user("hello"), user("again")]
+    assert cache.expire(0) == ["s1"]
+    assert cache.stats()["sessions"] == 0
+
+
+def test_reset_forgets_cached_history(store, make_cache):
+    cache = make_cache()
+    cache.append("s1", "user", "hello")
+    cache.append("s2", "user", "hello")
+    cache.reset("s1")
+    assert cache.get("s1") == [SYSTEM]
+    cache.reset("all")
+    assert cache.stats()["sessions"] == 0
+    assert cache.get("s2") == [SYSTEM]
+
+
+def test_shared_mode_reads_through_to_store(store, make_cache):
+    cache = make_cache(shared=True)
+    cache.append("s1", "user", "hello")
+    assert store.load("s1") == [SYSTEM, user("hello")]
+    # Another worker's message is seen at once
+    store.append("s1", [user("from another worker")])
+    assert cache.get("s1") == [SYSTEM, user("hello"), user("from another worker")]
+    assert cache.stats()["sessions"] == 0
+
+
+def run_turns(locks, session_ids):
+    """Run one turn per session ID concurrently and return the order of their steps."""
+    steps = []
+
+    async def turn(i, session_id):
+        async with locks.hold(session_id):
+            steps.append(f"start {i}")
+            await asyncio.sleep(0.01)
+            steps.append(f"end {i}")
+
+    async def main():
+        await asyncio.gather(*(turn(i, sid) for i, sid in enumerate(session_ids)))
+
+    asyncio.run(main())
+    return steps
+
+
+def test_turns_of_one_session_take_turns():
+    locks = SessionLocks()
+    assert run_turns(locks, ["s1", "s1", "s1"]) == ["start 0", "end 0", "start 1", "end 1", "start 2", "end 2"]
+    assert locks.active() == 0
+
+
+def test_turns_of_different_sessions_overlap():
+    locks = SessionLocks()
+    assert run_turns(locks, ["s1", "s2"]) == ["start 0", "start 1", "end 0", "end 1"]
+    assert locks.active() == 0
@@ -0,0 +1,156 @@
+import json
+import os
+import time
+
+import pytest
+
+from session_store import FileSessionStore, RedisSessionStore, SQLiteSessionStore, _salvage_array
+
+SYSTEM = {"role": "system", "content": "You are a helpful careers assistant."}
+
+
+def user(text):
+    return {"role": "user", "content": text}
+
+
+@pytest.fixture
+def file_store(tmp_path):
+    return FileSessionStore(str(tmp_path), SYSTEM)
+
+
+def test_file_load_compacts_torn_last_line(file_store):
+    file_store.append("s1", [user("hello")])
+    path = file_store._session_path("s1")
+    with open(path, "ab") as f:
+        f.write(b'{"role": "user", "cont')
+    assert file_store.load("s1") == [SYSTEM, user("hello")]
+    with open(path, "rb") as f:
+        assert f.read() == FileSessionStore._encode(SYSTEM) + FileSessionStore._encode(user("hello"))
+
+
+def test_file_append_after_torn_line_keeps_new_records(file_store):
+    file_store.append("s1", [user("hello")])
+    with open(file_store._session_path("s1"), "ab") as f:
+        f.write(b'{"role": "user", "cont')
+    file_store.append("s1", [user("again")])
+    assert file_store.load("s1") == [SYSTEM, user("hello"), user("again")]
+
+
+def test_file_rewrite_failure_keeps_old_log(file_store, monkeypatch):
+    file_store.append("s1", [user("hello")])
+
+    def failing(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", failing)
+    with pytest.raises(OSError):
+        file_store.compact("s1")
+    monkeypatch.undo()
+    assert file_store.load("s1") == [SYSTEM, user("hello")]
+    assert sorted(os.listdir(file_store.directory)) == ["s1.jsonl"]
+
+
+def test_sqlite_fsync_syncs_every_commit(tmp_path):
+    for fsync, level in ((False, 1), (True, 2)):
+        store = SQLiteSessionStore(str(tmp_path / f"{fsync}.db"), SYSTEM, fsync=fsync)
+        try:
+            assert store._connect().execute("PRAGMA synchronous").fetchone() == (level,)
+            store.append("s1", [user("hello")])
+            assert store.load("s1") == [SYSTEM, user("hello")]
+        finally:
+            store.close()
+
+
+def test_salvage_array_keeps_complete_elements():
+    text = json.dumps([SYSTEM, user("hello"), user("again")])
+    assert _salvage_array(text) == [SYSTEM, user("hello"), user("again")]
+    assert _salvage_array(text[:-20]) == [SYSTEM, user("hello")]
+    assert _salvage_array("[") == []
+    assert _salvage_array("") == []
+
+
+def test_file_load_migrates_legacy_history(file_store):
+    with open(file_store._legacy_path("s1"), "w", encoding="utf-8") as f:
+        json.dump([SYSTEM, user("hello")], f)
+    assert file_store.load("s1") == [SYSTEM, user("hello")]
+    assert not os.path.exists(file_store._legacy_path("s1"))
+    assert os.path.isfile(file_store._session_path("s1"))
+    file_store.append("s1", [user("again")])
+    assert file_store.load("s1") == [SYSTEM, user("hello"), user("again")]
+
+
+def test_file_append_migrates_truncated_legacy_history(file_store):
+    # Legacy histories without a system message get one; a truncated one
+    # keeps its complete messages
+    with open(file_store._legacy_path("s1"), "w", encoding="utf-8") as f:
+        f.write(json.dumps([user("hello"), user("again")])[:-10])
+    file_store.append("s1", [user("new")])
+    assert file_store.load("s1") == [SYSTEM, user("hello"), user("new")]
+
+
+@pytest.fixture
+def redis_store(request):
+    fakeredis = pytest.importorskip("fakeredis")
+    ttl = getattr(request, "param", 0)
+    store = RedisSessionStore("redis://localhost:6379/0", SYSTEM, ttl=ttl, prefix="test:")
+    store._redis = fakeredis.FakeRedis()
+    yield store
+    store.close()
+
+
+def test_redis_load_and_append_is_one_pipeline(redis_store, monkeypatch):
+    redis_store.append("s1", [user("hello")])
+
+    def unpipelined(*args, **options):
+        raise AssertionError(f"command sent outside a pipeline: {args[0]}")
+
+    monkeypatch.setattr(redis_store._redis, "execute_command", unpipelined)
+    history = redis_store.load_and_append("s1", [user("again"), {"role": "assistant", "content": "hi"}])
+    assert history == [SYSTEM, user("hello"), user("again"), {"role": "assistant", "content": "hi"}]
+
+
+def test_redis_ignores_system_messages(redis_store):
+    redis_store.append("s1", [SYSTEM])
+    assert redis_store.load("s1") == [SYSTEM]
+    assert redis_store._redis.exists(redis_store._key("s1")) == 0
+
+
+@pytest.mark.parametrize("redis_store", [100], indirect=True)
+def test_redis_append_refreshes_ttl(redis_store):
+    key = redis_store._key("s1")
+    redis_store.append("s1", [user("hello")])
+    redis_store._redis.expire(key, 5)
+    redis_store.append("s1", [user("again")])
+    assert redis_store._redis.ttl(key) > 5
+
+
+@pytest.mark.parametrize("redis_store", [100], indirect=True)
+def test_redis_append_drops_index_entries_of_lapsed_keys(redis_store):
+    redis_store.append("old", [user("hello")])
+    # Redis removed the key when its TTL lapsed
+    redis_store._redis.delete(redis_store._key("old"))
+    redis_store._redis.zadd(redis_store._index, {"old": time.time() - 200})
+    redis_store.append("new", [user("hello")])
+    assert redis_store._redis.zrange(redis_store._index, 0, -1) == [b"new"]
+
+
+def test_redis_reset_and_reset_all(redis_store):
+    for sid in ("s1", "s2", "s3"):
+        redis_store.append(sid, [user(sid)])
+    redis_store.reset("s1")
+    assert redis_store.load("s1") == [SYSTEM]
+    assert redis_store._redis.zscore(redis_store._index, "s1") is None
+    assert redis_store.load("s2") == [SYSTEM, user("s2")]
+
+    redis_store.reset_all()
+    assert redis_store._redis.keys("test:*") == []
+
+
+def test_redis_expire_deletes_idle_sessions(redis_store):
+    redis_store.append("idle", [user("hello")])
+    redis_store.append("active", [user("hello")])
+    redis_store._redis.zadd(redis_store._index, {"idle": time.time() - 120})
+    assert redis_store.expire(60) == ["idle"]
+    assert redis_store.load("idle") == [SYSTEM]
+    assert redis_store.load("active") == [SYSTEM, user("hello")]
+    assert redis_store._redis.zrange(redis_store._index, 0, -1) == [b"active"]
@@ -1,31 +1,90 @@
 import os
-from typing import AsyncGenerator, List, Dict
-from llama_cpp import Llama
+import asyncio
+import threading
+import concurrent.futures
+from typing import AsyncGenerator, List, Dict, Optional
+import logging
+from llama_cpp import Llama, LlamaRAMCache
 
-from chatbot_config import LOCAL_MODEL_PATH, LOCAL_GEN_CONFIG
+from chatbot_config import (
+    LOCAL_MODEL_PATH,
+    LOCAL_GEN_CONFIG,
+    LOCAL_PROMPT_CACHE_MB,
+    LOCAL_CONTEXT_TOKENS,
+    LOCAL_SESSION_STATE_MB,
+    LOCAL_STREAM_QUEUE_SIZE,
+    LOCAL_POOL_SIZE,
+    LOCAL_THREADS_PER_INSTANCE,
+    LOCAL_POOL_QUEUE_SIZE,
+    LOCAL_POOL_POLICY,
+    LOCAL_ENGINE,
+    LOCAL_BATCH_SLOTS,
+    LOCAL_BATCH_TOKENS,
+    LOCAL_BATCH_THREADS,
+    CONTEXT_SUMMARY_TOKENS,
+    CONTEXT_SLACK
+)
+from context_window import ContextWindow, TokenCounter
+from kv_cache import SessionStateCache
+from model_pool import ModelPool
+from batch_engine import BatchEngine, LlamaBatchDecoder
+
+# Create a module-specific logger for diagnostic messages.
+logger = logging.getLogger(__name__)
 
 # -----------------------------------------------------------------------------
 # Model Initialization
 # -----------------------------------------------------------------------------
-# Cache for the Llama model instance to avoid reloading on each call.
-_llm: Llama = None
+def load_model() -> Llama:
+    """
+    Create one Llama model instance for the pool.
 
-def init_model() -> Llama:
+    Uses the LOCAL_MODEL_PATH and the context size from LOCAL_GEN_CONFIG,
+    with LOCAL_THREADS_PER_INSTANCE threads so the pool's instances split
+    the CPU cores. When LOCAL_PROMPT_CACHE_MB is set, the instance gets its
+    share of it as a bounded RAM state cache, primed with the system prompt.
     """
-    Initialize and cache the Llama model instance.
+    # Instantiate the Llama model with context window and thread settings
+    llm = Llama(
+        model_path=LOCAL_MODEL_PATH,
+        n_ctx=LOCAL_GEN_CONFIG.get("n_ctx", 2048),
+        n_threads=LOCAL_THREADS_PER_INSTANCE
+    )
+    if LOCAL_PROMPT_CACHE_MB > 0:
+        capacity = int(LOCAL_PROMPT_CACHE_MB * 1024 * 1024 / LOCAL_POOL_SIZE)
+        llm.set_cache(LlamaRAMCache(capacity_bytes=capacity))
+        _prime_system_prompt(llm)
+    return llm
 
-    Uses the LOCAL_MODEL_PATH and config parameters from LOCAL_GEN_CONFIG.
-    Subsequent calls return the already loaded model to improve performance.
+
+def load_batch_decoder() -> LlamaBatchDecoder:
+    """
+    Load the model for the batch engine and open its multi-sequence context:
+    LOCAL_BATCH_SLOTS sequences, each with the model's full context size.
     """
-    global _llm
-    if _llm is None:
-        # Instantiate the Llama model with context window and thread settings
-        _llm = Llama(
-            model_path=LOCAL_MODEL_PATH,
-            n_ctx=LOCAL_GEN_CONFIG.get("n_ctx", 2048),
-            n_threads=LOCAL_GEN_CONFIG.get("n_threads", 6)
-        )
-    return _llm
+    # Generation runs in the decoder's own context, so keep the instance's small
+    llm = Llama(
+        model_path=LOCAL_MODEL_PATH,
+        n_ctx=LOCAL_BATCH_TOKENS,
+        n_threads=LOCAL_BATCH_THREADS
+    )
+    return LlamaBatchDecoder(
+        llm, LOCAL_BATCH_SLOTS, LOCAL_GEN_CONFIG.get("n_ctx", 2048), LOCAL_BATCH_TOKENS, LOCAL_BATCH_THREADS
+    )
+
+
+def _prime_system_prompt(llm: Llama) -> None:
+    """
+    Evaluate the system prompt once so its state is in the prompt cache.
+
+    Every chat prompt starts with the same system message; with its state
+    cached, each request only evaluates the conversation that follows it.
+    """
+    llm.create_chat_completion(
+        messages=[{"role": "system", "content": get_default_system_prompt()}],
+        max_tokens=1
+    )
+    logger.info("TinyLLaMA system prompt state cached")
 
 # -----------------------------------------------------------------------------
 # Default System Prompt Loading
@@ -43,29 +102,165 @@ def get_default_system_prompt() -> str:
 # -----------------------------------------------------------------------------
 # Construct Chat Messages List
 # -----------------------------------------------------------------------------
-def build_messages(prompt: str, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+def _count_tokens(text: str) -> int:
+    """
+    Number of TinyLLaMA tokens of a text, from the batch engine's model or
+    the calling pool worker's instance (the tokenizer needs no context, so
+    any instance will do).
+    """
+    tokenizer = _engine.decoder() if _engine is not None else _pool.current()
+    return len(tokenizer.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+
+# History window fitted into LOCAL_CONTEXT_TOKENS of the model's context
+_context = ContextWindow(
+    "tinyllama", LOCAL_CONTEXT_TOKENS, TokenCounter(_count_tokens), CONTEXT_SUMMARY_TOKENS, CONTEXT_SLACK
+)
+
+# Model state after each session's last local reply (see kv_cache.py); a
+# state saved by one instance of the pool restores into any other
+_session_states = SessionStateCache(int(LOCAL_SESSION_STATE_MB * 1024 * 1024))
+
+
+def forget_session(session_id: str) -> None:
+    """
+    Drop the saved model state of a reset session ("all" for every session).
     """
-    Assemble the full list of chat messages for the model.
+    _session_states.discard(session_id)
 
-    The list consists of:
-      1. A system message loaded from the system prompt file.
-      2. All previous messages from history.
-      3. The current user prompt.
+
+def build_messages(prompt: str, history: List[Dict[str, str]], session_id: str = "") -> List[Dict[str, str]]:
+    """
+    Assemble the chat messages for the model. Runs off the event loop (on a
+    pool worker, or an executor thread for the batch engine).
+
+    The session history already starts with the system message and ends with
+    the current user prompt; it is cut to the most recent messages that fit
+    LOCAL_CONTEXT_TOKENS, with older ones summarized in the system message.
 
     Args:
         prompt: The latest user input.
         history: List of prior messages, each a dict with 'role' and 'content'.
+        session_id: Identifier of the conversation (keys its rolling summary).
 
     Returns:
         A list of message dicts suitable for create_chat_completion().
     """
-    # Start with the system message to establish context
-    messages = [{"role": "system", "content": get_default_system_prompt()}]
-    # Append the existing conversation history
-    messages.extend(history)
-    # Finally include the new user prompt
-    messages.append({"role": "user", "content": prompt})
-    return messages
+    if not history or history[0].get("role") != "system":
+        history = [{"role": "system", "content": get_default_system_prompt()}] + list(history)
+    # Callers that pass only the prior history still get the prompt
+    if history[-1] != {"role": "user", "content": prompt}:
+        history = list(history) + [{"role": "user", "content": prompt}]
+    return _context.fit(session_id, history)
+
+# -----------------------------------------------------------------------------
+# Local Inference Engine
+# -----------------------------------------------------------------------------
+# llama.cpp generation is synchronous and CPU-bound. It runs on engine
+# threads, never on the event loop, so other connections (including Gemini
+# streams) keep receiving tokens while TinyLLaMA generates. With
+# LOCAL_ENGINE=batch, one engine decodes up to LOCAL_BATCH_SLOTS
+# conversations per forward pass (see batch_engine.py); otherwise a pool of
+# LOCAL_POOL_SIZE instances serves one conversation each (see model_pool.py).
+# Either way, further requests wait in a bounded queue.
+_engine = BatchEngine(
+    load_batch_decoder, LOCAL_BATCH_SLOTS, LOCAL_POOL_QUEUE_SIZE, LOCAL_POOL_POLICY,
+    LOCAL_BATCH_TOKENS, LOCAL_STREAM_QUEUE_SIZE
+) if LOCAL_ENGINE == "batch" else None
+_pool = ModelPool(
+    load_model, LOCAL_POOL_SIZE, LOCAL_POOL_QUEUE_SIZE, LOCAL_POOL_POLICY
+) if _engine is None else None
+
+# End-of-stream marker on a token queue
+_DONE = object()
+
+
+def _generation_params() -> dict:
+    """LOCAL_GEN_CONFIG as create_chat_completion arguments (both engines apply all of it)."""
+    return {
+        "max_tokens": LOCAL_GEN_CONFIG.get("MAX_TOKENS", LOCAL_GEN_CONFIG.get("max_tokens", 512)),
+        "temperature": LOCAL_GEN_CONFIG.get("TEMPERATURE", LOCAL_GEN_CONFIG.get("temperature", 0.7)),
+        "top_k": LOCAL_GEN_CONFIG.get("top_k", 40),
+        "top_p": LOCAL_GEN_CONFIG.get("top_p", 0.95),
+        "stop": LOCAL_GEN_CONFIG.get("stop") or None,
+    }
+
+
+def _sampling_params() -> dict:
+    """Sampling settings of the batch engine (llama.cpp's defaults otherwise)."""
+    params = _generation_params()
+    return {key: params[key] for key in ("temperature", "top_k", "top_p")}
+
+
+def _stream_tokens(llm: Llama, prompt: str, session_id: str, history: List[Dict[str, str]],
+                   emit, cancelled: threading.Event) -> None:
+    """
+    Generate a streamed reply on a pool worker, passing each text fragment
+    to `emit` (which blocks while the consumer's queue is full). Stops at
+    the next token once `cancelled` is set.
+    """
+    # Fit the system message, recent history and user prompt into the context budget
+    messages = build_messages(prompt, history, session_id)
+    # Restore the state of the session's previous turn so only the new
+    # tokens of the prompt are evaluated
+    _session_states.restore(llm, session_id)
+
+    # Begin streaming completion tokens
+    streamer = llm.create_chat_completion(messages=messages, stream=True, **_generation_params())
+    try:
+        # Iterate over each chunk returned by the streamer
+        for chunk in streamer:
+            # Extract the content delta from the first choice
+            data = chunk.get("choices", [])[0]
+            delta = data.get("delta", {})
+            content = delta.get("content")
+            # Pass on only actual text content
+            if content and not emit(content):
+                return
+            if cancelled.is_set():
+                return
+    finally:
+        streamer.close()
+    _session_states.save(llm, session_id)
+
+
+def _complete(llm: Llama, prompt: str, session_id: str, history: List[Dict[str, str]]) -> str:
+    """
+    Generate a complete reply on a pool worker.
+    """
+    # Fit the system message, recent history and user prompt into the context budget
+    messages = build_messages(prompt, history, session_id)
+    _session_states.restore(llm, session_id)
+
+    # Request a non-streaming chat completion
+    response = llm.create_chat_completion(messages=messages, stream=False, **_generation_params())
+    _session_states.save(llm, session_id)
+
+    # Extract and return the generated content from the first choice
+    result = response.get("choices", [])[0]
+    return result.get("message", {}).get("content", "")
+
+
+def _batch_prompt(prompt: str, session_id: str, history: List[Dict[str, str]]) -> List[int]:
+    """
+    Fit the history into the context budget and tokenize it with the chat
+    template, for the batch engine.
+    """
+    return _engine.decoder().prompt_tokens(build_messages(prompt, history, session_id))
+
+
+async def _submit_batch(prompt: str, session_id: str, history: List[Dict[str, str]],
+                        priority: int, on_text=None):
+    """
+    Queue a turn on the batch engine and return its request.
+    """
+    loop = asyncio.get_running_loop()
+    # Fitting the history tokenizes new messages (and the first call loads
+    # the model): keep it off the event loop
+    tokens = await loop.run_in_executor(None, _batch_prompt, prompt, session_id, history)
+    params = _generation_params()
+    return _engine.submit(tokens, params["max_tokens"], _sampling_params(), on_text, priority, params["stop"])
+
 
 # -----------------------------------------------------------------------------
 # Streaming Chat Output via TinyLLaMA
@@ -73,44 +268,113 @@ def build_messages(prompt: str, history: List[Dict[str, str]]) -> List[Dict[str,
 async def tinyllama_stream(
     prompt: str,
     session_id: str,
-    history: List[Dict[str, str]]
+    history: List[Dict[str, str]],
+    priority: int = 0
 ) -> AsyncGenerator[str, None]:
     """
     Stream chat responses from the local TinyLLaMA model.
 
-    Uses Llama's create_chat_completion with stream=True to yield tokens
-    incrementally as they are generated.
+    Generation runs on the batch engine or a free instance of the pool. A
+    slow client pauses its generation (after LOCAL_STREAM_QUEUE_SIZE
+    fragments) instead of buffering without limit. Closing this generator
+    (e.g. when the client disconnects) cancels the generation, or withdraws
+    the request if it is still waiting in the queue.
 
     Args:
         prompt: The user's latest input.
-        session_id: Identifier for this conversation (unused here but kept for interface consistency).
+        session_id: Identifier for this conversation (keys its rolling summary).
         history: Full conversation history for context.
+        priority: Queue priority under the "priority" pool policy (lower first).
 
     Yields:
         Individual text fragments as the model produces them.
+
+    Raises:
+        PoolSaturatedError: If the queue is full (before any fragment).
+        PoolUnavailableError: If the engine has been shut down.
     """
-    # Initialize or retrieve the cached model
-    llm = init_model()
-    # Build the message sequence including system, history, and user prompt
-    messages = build_messages(prompt, history)
+    stream = (_batch_stream if _engine is not None else _pool_stream)(prompt, session_id, history, priority)
+    try:
+        async for text in stream:
+            yield text
+    finally:
+        await stream.aclose()
 
-    # Begin streaming completion tokens
-    streamer = llm.create_chat_completion(
-        messages=messages,
-        stream=True,
-        max_tokens=LOCAL_GEN_CONFIG.get("MAX_TOKENS", LOCAL_GEN_CONFIG.get("max_tokens", 512)),
-        temperature=LOCAL_GEN_CONFIG.get("TEMPERATURE", LOCAL_GEN_CONFIG.get("temperature", 0.7))
+
+async def _batch_stream(prompt: str, session_id: str, history: List[Dict[str, str]],
+                        priority: int) -> AsyncGenerator[str, None]:
+    """
+    Stream a reply generated by the batch engine. The engine must never
+    wait for a client, so fragments are queued without bound; the engine
+    pauses a sequence whose client falls behind.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    request = await _submit_batch(
+        prompt, session_id, history, priority,
+        on_text=lambda text: loop.call_soon_threadsafe(queue.put_nowait, text)
     )
+    # Fragments are queued before the request resolves, so this comes last
+    request.future.add_done_callback(lambda f: loop.call_soon_threadsafe(queue.put_nowait, _DONE))
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            request.consumed()
+            yield item
+        # Re-raises a failed generation
+        request.future.result()
+    finally:
+        # Withdraws the request if still queued, otherwise stops the
+        # generation at its next token
+        request.cancel()
+
 
-    # Iterate over each chunk returned by the streamer
-    for chunk in streamer:
-        # Extract the content delta from the first choice
-        data = chunk.get("choices", [])[0]
-        delta = data.get("delta", {})
-        content = delta.get("content")
-        # Yield only if there is actual text content
-        if content:
-            yield content
+async def _pool_stream(prompt: str, session_id: str, history: List[Dict[str, str]],
+                       priority: int) -> AsyncGenerator[str, None]:
+    """
+    Stream a reply generated on a pool instance, handing fragments over
+    through a bounded queue (LOCAL_STREAM_QUEUE_SIZE).
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=LOCAL_STREAM_QUEUE_SIZE)
+    cancelled = threading.Event()
+
+    def emit(item) -> bool:
+        """Queue an item from the pool worker; False once cancelled."""
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                future.result(timeout=0.1)
+                return True
+            except concurrent.futures.TimeoutError:
+                if cancelled.is_set():
+                    future.cancel()
+                    return False
+
+    def produce(llm: Llama) -> None:
+        try:
+            _stream_tokens(llm, prompt, session_id, history, emit, cancelled)
+            emit(_DONE)
+        except Exception as e:
+            # Re-raised on the event loop by the consumer
+            emit(e)
+
+    job = _pool.submit(produce, priority=priority)
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Withdraws the request if still queued, otherwise stops the
+        # generation at its next token
+        job.cancel()
+        cancelled.set()
 
 # -----------------------------------------------------------------------------
 # One-Shot Chat Output via TinyLLaMA
@@ -118,35 +382,57 @@ async def tinyllama_stream(
 async def tinyllama_once(
     prompt: str,
     session_id: str,
-    history: List[Dict[str, str]]
+    history: List[Dict[str, str]],
+    priority: int = 0
 ) -> str:
     """
     Perform a single-turn chat completion with the TinyLLaMA model.
 
-    Uses Llama's create_chat_completion with stream=False to get the full
-    response in one call.
+    Runs on the batch engine, or with Llama's create_chat_completion on a
+    free instance of the pool, so the event loop keeps serving other
+    requests meanwhile.
 
     Args:
         prompt: The user's latest input.
-        session_id: Identifier for this conversation (unused here but kept for interface consistency).
+        session_id: Identifier for this conversation (keys its rolling summary).
         history: Full conversation history for context.
+        priority: Queue priority under the "priority" pool policy (lower first).
 
     Returns:
         The complete text response from the model.
+
+    Raises:
+        PoolSaturatedError: If the queue is full.
+        PoolUnavailableError: If the engine has been shut down.
     """
-    # Initialize or retrieve the cached model
-    llm = init_model()
-    # Build the message sequence including system, history, and user prompt
-    messages = build_messages(prompt, history)
+    if _engine is not None:
+        request = await _submit_batch(prompt, session_id, history, priority)
+        try:
+            return await asyncio.wrap_future(request.future)
+        finally:
+            # Stops the generation if the caller was cancelled
+            request.cancel()
+    # Awaiting the wrapped future withdraws a still queued request if the
+    # caller is cancelled
+    return await asyncio.wrap_future(_pool.submit(_complete, prompt, session_id, history, priority=priority))
 
-    # Request a non-streaming chat completion
-    response = llm.create_chat_completion(
-        messages=messages,
-        stream=False,
-        max_tokens=LOCAL_GEN_CONFIG.get("MAX_TOKENS", LOCAL_GEN_CONFIG.get("max_tokens", 512)),
-        temperature=LOCAL_GEN_CONFIG.get("TEMPERATURE", LOCAL_GEN_CONFIG.get("temperature", 0.7))
-    )
 
-    # Extract and return the generated content from the first choice
-    result = response.get("choices", [])[0]
-    return result.get("message", {}).get("content", "")
+# -----------------------------------------------------------------------------
+# Engine Status and Shutdown
+# -----------------------------------------------------------------------------
+def pool_stats() -> dict:
+    """
+    Return the local engine's occupancy and request counters.
+    """
+    return (_engine or _pool).stats()
+
+
+def shutdown_pool(wait: bool = False, timeout: Optional[float] = None) -> None:
+    """
+    Stop accepting local requests; queued ones still complete.
+
+    Args:
+        wait: Block until queued and running requests have finished.
+        timeout: Maximum seconds to wait (no limit if None).
+    """
+    (_engine or _pool).shutdown(wait, timeout)
@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, AsyncGenerator, AsyncIterable, Dict, Tuple
+
+from generator import plan_sections, cached_section
+from pipeline import CVAssembler, SectionDone, run_section
+from inference_pool import InferencePool, PoolSaturatedError
+
+# Create a module-specific logger for diagnostic messages.
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before retrying a section the pool rejected as saturated
+_SATURATED_BACKOFF = 0.5
+
+
+async def iter_jsonl(chunks: AsyncIterable[bytes]) -> AsyncGenerator[Tuple[int, Any], None]:
+    """
+    Parse a stream of byte chunks as JSON Lines.
+
+    Yields:
+        (index, record) per non-empty line, where index counts records from
+        0 and record is the parsed object, or the ValueError raised while
+        parsing a malformed line.
+    """
+    buffer = b""
+    index = 0
+
+    def parse(line: bytes):
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("record is not a JSON object")
+            return record
+        except ValueError as e:
+            return e
+
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield index, parse(line)
+                index += 1
+    if buffer.strip():
+        yield index, parse(buffer)
+
+
+def _record_key(user_info: dict) -> str:
+    """Canonical hash of a record, used to detect duplicates in a batch."""
+    canonical = json.dumps(user_info, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class BatchScheduler:
+    """
+    Generates many CVs over one inference pool.
+
+    All section prompts of the batch are scheduled on the pool, at most
+    `max_in_flight` at a time so a large batch neither monopolizes the
+    admission queue nor gets rejected by it; sections rejected because other
+    traffic saturated the pool are retried after a short back-off.
+
+    Work is deduplicated within the batch: identical records share one CV,
+    and identical section prompts (same cache key, e.g. attendees with the
+    same education and target job) are generated once.
+    """
+
+    def __init__(self, pool: InferencePool, max_in_flight: int):
+        self._pool = pool
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._records: Dict[str, asyncio.Task] = {}
+        self._sections: Dict[str, asyncio.Task] = {}
+        self.counters = {
+            "records": 0,
+            "duplicate_records": 0,
+            "sections": 0,
+            "duplicate_sections": 0,
+            "cached_sections": 0,
+            "generated_sections": 0,
+            "tokens_decoded": 0,
+        }
+
+    async def _generate_section(self, section: dict) -> SectionDone:
+        """
+        Return the completed section, from the cache or the pool.
+        """
+        # The lookup may read the disk tier, so it runs off the event loop
+        cached = await asyncio.to_thread(cached_section, section)
+        if cached is not None:
+            self.counters["cached_sections"] += 1
+            return SectionDone(section["key"], cached, cached=True)
+        async with self._slots:
+            while True:
+                try:
+                    result = await self._pool.run(run_section, section, False)
+                    self.counters["generated_sections"] += 1
+                    self.counters["tokens_decoded"] += result.tokens
+                    return result
+                except PoolSaturatedError:
+                    await asyncio.sleep(_SATURATED_BACKOFF)
+
+    def _section(self, section: dict) -> asyncio.Task:
+        """
+        Return the task generating a section, shared by identical prompts.
+        """
+        self.counters["sections"] += 1
+        task = self._sections.get(section["cache_key"])
+        if task is None:
+            task = asyncio.ensure_future(self._generate_section(section))
+            self._sections[section["cache_key"]] = task
+        else:
+            self.counters["duplicate_sections"] += 1
+        return task
+
+    async def _generate_cv(self, user_info: dict) -> dict:
+        sections = plan_sections(user_info)
+        results = await asyncio.gather(*(self._section(s) for s in sections))
+
+        assembler = CVAssembler()
+        for done in results:
+            assembler.add(done)
+        return assembler.finish(user_info).cv
+
+    def generate_cv(self, user_info: dict) -> asyncio.Task:
+        """
+        Return the task generating a record's CV, shared by duplicate records.
+        """
+        self.counters["records"] += 1
+        key = _record_key(user_info)
+        task = self._records.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._generate_cv(user_info))
+            self._records[key] = task
+        else:
+            self.counters["duplicate_records"] += 1
+        return task
+
+    def cancel(self) -> None:
+        """Cancel every unfinished section and CV task."""
+        for task in list(self._sections.values()) + list(self._records.values()):
+            task.cancel()
+
+
+async def run_batch(
+    records: AsyncIterable[Tuple[int, Any]],
+    pool: InferencePool,
+    max_in_flight: int
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Generate a CV for every record and yield results as each CV completes.
+
+    Records are scheduled as soon as they are read, so generation overlaps
+    with ingesting the rest of the input.
+
+    Args:
+        records: (index, user_info or parse error) pairs, e.g. from iter_jsonl().
+        pool: Inference pool to run the section prompts on.
+        max_in_flight: Maximum sections of this batch on the pool at once.
+    Yields:
+        {"index", "cv"} or {"index", "error"} per record, in completion
+        order, then one final {"summary": {...}} with aggregate throughput.
+    """
+    start = time.time()
+    scheduler = BatchScheduler(pool, max_in_flight)
+    results: asyncio.Queue = asyncio.Queue()
+    failed = 0
+
+    async def handle(index: int, user_info: dict):
+        try:
+            cv = await scheduler.generate_cv(user_info)
+            await results.put({"index": index, "cv": cv})
+        except Exception as e:
+            logger.warning(f"Batch record {index} failed: {e}")
+            await results.put({"index": index, "error": str(e)})
+
+    async def ingest():
+        handlers = []
+        async for index, record in records:
+            if isinstance(record, Exception):
+                await results.put({"index": index, "error": f"Invalid record: {record}"})
+                continue
+            handlers.append(asyncio.ensure_future(handle(index, record)))
+        await asyncio.gather(*handlers)
+        await results.put(None)
+
+    ingest_task = asyncio.ensure_future(ingest())
+    completed = 0
+    try:
+        while True:
+            item = await results.get()
+            if item is None:
+                break
+            if "error" in item:
+                failed += 1
+            else:
+                completed += 1
+            yield item
+        # Surface errors raised while reading the input itself
+        await ingest_task
+    finally:
+        ingest_task.cancel()
+        scheduler.cancel()
+
+    elapsed = time.time() - start
+    yield {"summary": {
+        **scheduler.counters,
+        "completed": completed,
+        "failed": failed,
+        "elapsed_s": round(elapsed, 2),
+        "cvs_per_minute": round(completed / elapsed * 60, 2) if elapsed else 0.0,
+        "sections_per_second": round(scheduler.counters["generated_sections"] / elapsed, 3) if elapsed else 0.0,
+    }}
@@ -0,0 +1,98 @@
+"""
+Generate CVs in bulk from a JSON Lines file, without going through HTTP.
+
+Each input line is one user information object, as accepted by /generate_cv.
+Results are written as NDJSON in completion order, followed by a summary line.
+
+Usage:
+    python batch_cli.py attendees.jsonl -o cvs.ndjson
+    cat attendees.jsonl | python batch_cli.py - --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from batch import iter_jsonl, run_batch
+from inference_pool import InferencePool
+from model_registry import registry
+from generator import output_sink, prepare_cache_keys
+from cv_config import POOL_WORKERS, BATCH_MAX_IN_FLIGHT
+
+
+async def _read_chunks(stream, size: int = 64 * 1024):
+    """
+    Read a binary file object in chunks without blocking the event loop.
+    """
+    while True:
+        chunk = await asyncio.to_thread(stream.read, size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _positive_int(value: str) -> int:
+    """argparse type of counts that must be at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected an integer, got {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+async def _main(args, source, out) -> int:
+    # Split the cores between the model instances unless told otherwise
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    pool = InferencePool(lambda: registry.create(n_threads=threads), args.workers, args.workers)
+    failed = 0
+    try:
+        await asyncio.to_thread(prepare_cache_keys)
+        results = run_batch(iter_jsonl(_read_chunks(source)), pool, args.max_in_flight)
+        async for item in results:
+            out.write(json.dumps(item, ensure_ascii=False) + "\n")
+            out.flush()
+            if "error" in item:
+                failed += 1
+            if "summary" in item:
+                print(json.dumps(item["summary"]), file=sys.stderr)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+        pool.shutdown()
+        output_sink.close()
+    return 1 if failed else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Generate CVs in bulk from a JSONL file.")
+    parser.add_argument("input", help="JSONL file of user information records ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="NDJSON output file (default: stdout)")
+    parser.add_argument("--workers", type=_positive_int, default=POOL_WORKERS,
+                        help="model instances to run in parallel")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="CPU threads per model instance (default: cores / workers)")
+    parser.add_argument("--max-in-flight", type=_positive_int, default=BATCH_MAX_IN_FLIGHT,
+                        help="maximum section prompts scheduled at once")
+    args = parser.parse_args()
+    if args.threads < 0:
+        parser.error("--threads must not be negative")
+    try:
+        source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    except OSError as e:
+        parser.error(f"cannot open input: {e}")
+    try:
+        out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    except OSError as e:
+        if source is not sys.stdin.buffer:
+            source.close()
+        parser.error(f"cannot open output: {e}")
+    return asyncio.run(_main(args, source, out))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,455 @@
+"""
+Reproducible CV generation benchmark.
+
+Generates synthetic user records (0-10 education and work entries each),
+runs them in-process through generate_cv_text or over HTTP against the
+/generate_cv or /generate_stream endpoints at a configurable concurrency,
+and prints one JSON report (throughput, latency percentiles, tokens/s,
+peak RSS) so runs can be compared across commits.
+
+By default the model is a stub that simulates llama.cpp timing, so the
+benchmark runs on any machine; pass --model with a GGUF file (a tiny one
+is enough) to measure real inference.
+
+Usage:
+    python benchmark.py inprocess --requests 50 --concurrency 3
+    python benchmark.py http --serve --endpoint generate_stream --concurrency 8
+    python benchmark.py http --url http://localhost:8000 --model remote
+    python benchmark.py inprocess --model ~/models/tiny.gguf -o run.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import re
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from metrics import percentile
+
+# -----------------------------------------------------------------------------
+# Synthetic Payloads
+# -----------------------------------------------------------------------------
+_DEGREES = [
+    ("Bachelor", "Computer Science"), ("Master", "Business Administration"),
+    ("Diploma", "Office Administration"), ("Certificate IV", "Accounting"),
+    ("Bachelor", "Nursing"), ("Master", "Data Science"),
+]
+_INSTITUTIONS = ["Monash University", "Sydney TAFE", "RMIT", "University of Melbourne", "Deakin University"]
+_JOBS = [
+    ("Mailroom Supervisor", "Australia Post"), ("Administrative Assistant", "City Council"),
+    ("Data Entry Specialist", "Freelance"), ("Retail Manager", "Coles"),
+    ("Bookkeeper", "Smith & Co"), ("Registered Nurse", "Alfred Health"),
+]
+
+
+def synthetic_user_info(rng: random.Random, index: int, education: int, work: int) -> Dict[str, Any]:
+    """
+    Build one user record in the /generate_cv format with the given number
+    of education and work entries; half of the records target a job.
+    """
+    year = rng.randint(1975, 2000)
+    info: Dict[str, Any] = {
+        "name": f"Benchmark User {index}",
+        "education": [],
+        "work_experience": [],
+    }
+    for _ in range(education):
+        degree_type, degree_name = rng.choice(_DEGREES)
+        info["education"].append({
+            "degree_type": degree_type,
+            "degree_name": degree_name,
+            "institution": rng.choice(_INSTITUTIONS),
+            "year_start": str(year),
+            "year_end": str(year + 3),
+        })
+        year += 3
+    for _ in range(work):
+        title, organization = rng.choice(_JOBS)
+        length = rng.randint(1, 8)
+        info["work_experience"].append({
+            "job_title": title,
+            "organization": organization,
+            "year_start": str(year),
+            "year_end": str(year + length),
+        })
+        year += length
+    if index % 2:
+        title, organization = rng.choice(_JOBS)
+        info["job"] = {"title": title, "company_name": organization}
+    return info
+
+
+def synthetic_payloads(count: int, seed: int, min_entries: int, max_entries: int) -> List[Dict[str, Any]]:
+    """
+    Return `count` reproducible user records with entry counts drawn
+    uniformly from [min_entries, max_entries] per section.
+    """
+    rng = random.Random(seed)
+    return [
+        synthetic_user_info(
+            rng, i,
+            rng.randint(min_entries, max_entries),
+            rng.randint(min_entries, max_entries)
+        )
+        for i in range(count)
+    ]
+
+
+# -----------------------------------------------------------------------------
+# Stub Model
+# -----------------------------------------------------------------------------
+_SENTENCES = [
+    "I coordinated daily operations and kept every deadline.",
+    "I trained new staff members and improved team processes.",
+    "My attention to detail ensured accurate records.",
+    "I communicated clearly with customers and colleagues.",
+    "I adapted quickly to new systems and technologies.",
+    "I managed schedules, budgets and reports for the office.",
+    "My studies gave me a strong foundation in the field.",
+]
+
+
+class StubState:
+    """Saved state of a StubLlama (the evaluated tokens)."""
+
+    def __init__(self, tokens: List[int]):
+        self.tokens = list(tokens)
+        self.llama_state_size = 4096 + 64 * len(tokens)
+
+
+class StubLlama:
+    """
+    Stand-in for llama_cpp.Llama with the interface the generator uses.
+
+    Words are tokens. Prompt evaluation and decoding sleep (releasing the
+    GIL, like llama.cpp) at the configured rates; already evaluated prompt
+    prefixes are reused as llama.cpp does. Output is deterministic per
+    prompt: a paragraph of sentences, a blank line, then more text, so stop
+    sequences and budgets behave as with the real model.
+    """
+
+    def __init__(self, prompt_tps: float = 400.0, decode_tps: float = 40.0):
+        self._prompt_tps = prompt_tps
+        self._decode_tps = decode_tps
+        self.input_ids: List[int] = []
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self.input_ids)
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        tokens = [zlib.crc32(word) % 32000 for word in text.split()]
+        return [1] + tokens if add_bos else tokens
+
+    def reset(self) -> None:
+        self.input_ids = []
+
+    def eval(self, tokens: List[int]) -> None:
+        time.sleep(len(tokens) / self._prompt_tps)
+        self.input_ids = self.input_ids + list(tokens)
+
+    def save_state(self) -> StubState:
+        return StubState(self.input_ids)
+
+    def load_state(self, state: StubState) -> None:
+        self.input_ids = list(state.tokens)
+
+    def _completion_words(self, prompt: str) -> List[str]:
+        rng = random.Random(zlib.crc32(prompt.encode("utf-8")))
+        first = rng.sample(_SENTENCES, rng.randint(2, 5))
+        rest = rng.sample(_SENTENCES, 3)
+        text = " " + " ".join(first) + "\n\n" + " ".join(rest)
+        return re.findall(r"\s*\S+", text)
+
+    def __call__(self, prompt: str, max_tokens: int = 16, stream: bool = False, **kwargs):
+        tokens = self.tokenize(prompt.encode("utf-8"))
+        common = 0
+        for a, b in zip(self.input_ids, tokens):
+            if a != b:
+                break
+            common += 1
+        self.input_ids = self.input_ids[:common]
+        self.eval(tokens[common:])
+
+        words = self._completion_words(prompt)[:max_tokens]
+        finish_reason = "length" if len(words) == max_tokens else "stop"
+
+        def chunks():
+            for i, word in enumerate(words):
+                time.sleep(1 / self._decode_tps)
+                last = i == len(words) - 1
+                yield {"choices": [{"text": word, "finish_reason": finish_reason if last else None}]}
+
+        if stream:
+            return chunks()
+        text = "".join(chunk["choices"][0]["text"] for chunk in chunks())
+        return {"choices": [{"text": text, "finish_reason": finish_reason}]}
+
+
+# -----------------------------------------------------------------------------
+# Measurement Helpers
+# -----------------------------------------------------------------------------
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    return {
+        "mean": round(sum(samples) / len(samples), 4),
+        "p50": round(percentile(samples, 50), 4),
+        "p95": round(percentile(samples, 95), 4),
+        "p99": round(percentile(samples, 99), 4),
+        "max": round(max(samples), 4),
+    }
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident set size of this process (ru_maxrss is in KiB on Linux)."""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _report(args, results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """
+    Aggregate per-request results ({"latency", "tokens", "ttfb"?, "error"?,
+    "rejected"?}) into the JSON report.
+    """
+    ok = [r for r in results if "error" not in r]
+    rejected = sum(1 for r in results if r.get("rejected"))
+    tokens = sum(r["tokens"] for r in ok)
+    report = {
+        "commit": _git_commit(),
+        "mode": args.mode,
+        "endpoint": args.endpoint if args.mode == "http" else "generate_cv_text",
+        "model": args.model,
+        "concurrency": args.concurrency,
+        "requests": len(results),
+        "rejected_429": rejected,
+        "errors": len(results) - len(ok) - rejected,
+        "entries": [args.min_entries, args.max_entries],
+        "seed": args.seed,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "cvs_per_minute": round(len(ok) / elapsed * 60, 2) if elapsed else 0.0,
+        "latency_s": _percentiles([r["latency"] for r in ok]),
+        "tokens_decoded": tokens,
+        "tokens_per_second": round(tokens / elapsed, 2) if elapsed else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    ttfb = [r["ttfb"] for r in ok if r.get("ttfb") is not None]
+    if ttfb:
+        report["time_to_first_byte_s"] = _percentiles(ttfb)
+    errors = sorted({r["error"] for r in results if "error" in r and not r.get("rejected")})
+    if errors:
+        report["error_samples"] = errors[:5]
+    return report
+
+
+# -----------------------------------------------------------------------------
+# Model Setup
+# -----------------------------------------------------------------------------
+def _configure(args) -> None:
+    """
+    Set the service configuration before any cv_builder module is imported.
+
+    The section cache is off unless --cache is given, so every request runs
+    inference; generated CVs are not stored.
+    """
+    os.environ.setdefault("CV_CACHE_ENABLED", "1" if args.cache else "0")
+    os.environ.setdefault("CV_OUTPUT_SINK", "none")
+    if args.model not in ("stub", "remote"):
+        os.environ["CV_MODEL_PATH"] = os.path.expanduser(args.model)
+
+
+def _model_factory(args):
+    """
+    Return a function creating one model instance for a worker thread.
+    """
+    if args.model == "stub":
+        return lambda n_threads=None: StubLlama(args.stub_prompt_tps, args.stub_decode_tps)
+    from model_registry import registry
+    return registry.create
+
+
+# -----------------------------------------------------------------------------
+# In-Process Mode
+# -----------------------------------------------------------------------------
+def run_inprocess(args, payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Run generate_cv_text on `concurrency` threads, each with its own model.
+    """
+    from pipeline import generate_cv_text
+
+    factory = _model_factory(args)
+    threads = max(1, (os.cpu_count() or 1) // args.concurrency)
+    local = threading.local()
+
+    def one(info: Dict[str, Any]) -> Dict[str, Any]:
+        if not hasattr(local, "model"):
+            local.model = factory(n_threads=threads)
+        start = time.perf_counter()
+        try:
+            cv = generate_cv_text(info, local.model)
+        except Exception as e:
+            return {"latency": time.perf_counter() - start, "error": repr(e)}
+        return {"latency": time.perf_counter() - start, "tokens": cv.get("tokens_decoded", 0)}
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one, payloads[:args.warmup]))
+        start = time.perf_counter()
+        results = list(executor.map(one, payloads[args.warmup:]))
+        elapsed = time.perf_counter() - start
+    return _report(args, results, elapsed)
+
+
+# -----------------------------------------------------------------------------
+# HTTP Mode
+# -----------------------------------------------------------------------------
+_TOKENS_DECODED = re.compile(r"\((\d+) tokens decoded\)")
+
+
+async def _http_request(client, url: str, endpoint: str, info: Dict[str, Any]) -> Dict[str, Any]:
+    import httpx
+
+    start = time.perf_counter()
+    try:
+        if endpoint == "generate_cv":
+            resp = await client.post(f"{url}/generate_cv", json=info)
+            resp.raise_for_status()
+            tokens = resp.json().get("tokens_decoded", 0)
+            return {"latency": time.perf_counter() - start, "tokens": tokens}
+
+        ttfb, tokens = None, 0
+        async with client.stream("POST", f"{url}/generate_stream", json=info) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                match = _TOKENS_DECODED.search(line)
+                if match:
+                    tokens = int(match.group(1))
+        return {"latency": time.perf_counter() - start, "tokens": tokens, "ttfb": ttfb}
+    except httpx.HTTPStatusError as e:
+        # 429 means the service shed load at admission, as designed
+        rejected = e.response.status_code == 429
+        return {"latency": time.perf_counter() - start, "error": f"HTTP {e.response.status_code}", "rejected": rejected}
+    except Exception as e:
+        return {"latency": time.perf_counter() - start, "error": repr(e)}
+
+
+async def _http_load(args, url: str, payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    import httpx
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for info in payloads[args.warmup:]:
+        queue.put_nowait(info)
+    results: List[Dict[str, Any]] = []
+
+    async def worker(client):
+        while not queue.empty():
+            results.append(await _http_request(client, url, args.endpoint, queue.get_nowait()))
+
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        await asyncio.gather(*(_http_request(client, url, args.endpoint, info) for info in payloads[:args.warmup]))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    return _report(args, results, elapsed)
+
+
+def _serve_in_process(args) -> str:
+    """
+    Start the CV service in a background thread on a free local port, with
+    pool workers using the benchmark's model, and return its base URL.
+    """
+    import uvicorn
+    from model_registry import registry
+    import main
+
+    if args.model == "stub":
+        # Pool workers load their models through the registry
+        registry.create = _model_factory(args)
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="benchmark-server", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def run_http(args, payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Send the payloads to the HTTP service from `concurrency` clients.
+    """
+    url = _serve_in_process(args) if args.serve else args.url.rstrip("/")
+    report = asyncio.run(_http_load(args, url, payloads))
+    report["url"] = url
+    # Peak RSS covers the service only when it runs in this process
+    if not args.serve:
+        report.pop("peak_rss_mb")
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark CV generation.")
+    parser.add_argument("mode", choices=("inprocess", "http"), help="call generate_cv_text directly or the HTTP API")
+    parser.add_argument("--requests", type=int, default=30, help="measured requests")
+    parser.add_argument("--warmup", type=int, default=3, help="unmeasured requests sent first")
+    parser.add_argument("--concurrency", type=int, default=3, help="requests in flight at once")
+    parser.add_argument("--min-entries", type=int, default=0, help="minimum education/work entries per record")
+    parser.add_argument("--max-entries", type=int, default=10, help="maximum education/work entries per record")
+    parser.add_argument("--seed", type=int, default=5210, help="seed of the synthetic records")
+    parser.add_argument("--model", default="stub",
+                        help="'stub' (default), a GGUF model path, or 'remote' with --url")
+    parser.add_argument("--stub-prompt-tps", type=float, default=400.0, help="stub prompt evaluation tokens/s")
+    parser.add_argument("--stub-decode-tps", type=float, default=40.0, help="stub decoding tokens/s")
+    parser.add_argument("--cache", action="store_true", help="keep the section result cache enabled")
+    parser.add_argument("--endpoint", choices=("generate_cv", "generate_stream"), default="generate_cv",
+                        help="HTTP endpoint to call (http mode)")
+    parser.add_argument("--url", default="http://localhost:8000", help="service URL (http mode)")
+    parser.add_argument("--serve", action="store_true",
+                        help="start the service in this process instead of using --url (http mode)")
+    parser.add_argument("--timeout", type=float, default=600.0, help="HTTP request timeout in seconds")
+    parser.add_argument("-o", "--output", default="-", help="JSON report file (default: stdout)")
+    args = parser.parse_args()
+    if args.model == "remote" and (args.mode != "http" or args.serve):
+        parser.error("--model remote requires http mode against --url")
+
+    _configure(args)
+    payloads = synthetic_payloads(args.requests + args.warmup, args.seed, args.min_entries, args.max_entries)
+    # Generation logs are printed; keep them out of a report written to stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_inprocess(args, payloads) if args.mode == "inprocess" else run_http(args, payloads)
+
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import os
+import json
+
+# -----------------------------------------------------------------------------
+# Module: CV Builder Service Configuration
+# -----------------------------------------------------------------------------
+# This module centralizes the runtime settings of the CV Builder service.
+# Every value can be overridden through an environment variable so the same
+# code can run on the Azure VM, a developer laptop or a CI box. Settings may
+# also be given in a JSON config file (CV_CONFIG_FILE, default cv_config.json
+# next to this module); environment variables take precedence over the file.
+
+_CONFIG_PATH = os.getenv(
+    "CV_CONFIG_FILE",
+    os.path.join(os.path.dirname(__file__), "cv_config.json")
+)
+
+try:
+    with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+        _FILE_CONFIG = json.load(f)
+except FileNotFoundError:
+    _FILE_CONFIG = {}
+except Exception as e:
+    # Fail fast on a config file that exists but cannot be parsed
+    raise RuntimeError(f"Failed to load CV config from {_CONFIG_PATH}: {e}")
+
+
+def _setting(name: str, default, cast=str):
+    """
+    Resolve one setting: environment variable `name`, then the config file
+    entry of the same name, then `default`, converted with `cast`.
+    """
+    value = os.getenv(name, _FILE_CONFIG.get(name, default))
+    if cast is bool and isinstance(value, str):
+        return value.lower() in ("1", "true", "yes")
+    return cast(value)
+
+
+# -------- Model --------
+# Path to the local GGUF-formatted TinyLLaMA model file.
+MODEL_PATH = os.path.expanduser(_setting(
+    "CV_MODEL_PATH", "/home/azureuser/models/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf"
+))
+
+# Context window size (tokens) and prompt-evaluation batch size.
+MODEL_N_CTX = _setting("CV_N_CTX", 2048, int)
+MODEL_N_BATCH = _setting("CV_N_BATCH", 512, int)
+
+# Memory-map the model file (fast, shared page cache between instances) and
+# optionally lock it in RAM so the OS never pages it out.
+MODEL_USE_MMAP = _setting("CV_USE_MMAP", True, bool)
+MODEL_USE_MLOCK = _setting("CV_USE_MLOCK", False, bool)
+
+# Load every worker's model and run a short generation at startup, so the
+# first real request does not pay the load cost. /ready reports progress.
+MODEL_WARM_UP = _setting("CV_WARM_UP", True, bool)
+
+# -------- Inference Worker Pool --------
+# Number of worker threads, each owning its own Llama instance. llama.cpp
+# releases the GIL while decoding, so threads run inferences in parallel.
+POOL_WORKERS = max(1, _setting("CV_POOL_WORKERS", 3, int))
+
+# Number of requests allowed to wait for a free worker. Requests arriving
+# when every worker is busy and this queue is full are rejected with 429.
+# A CV counts as one request, even when its sections run on separate workers.
+POOL_QUEUE_SIZE = max(0, _setting("CV_POOL_QUEUE_SIZE", 8, int))
+
+# CPU threads given to each Llama instance. Defaults to an even split of the
+# available cores so concurrent workers do not oversubscribe the CPU.
+POOL_THREADS_PER_WORKER = max(
+    1,
+    _setting("CV_THREADS_PER_WORKER", (os.cpu_count() or 1) // POOL_WORKERS, int)
+)
+
+# Seconds suggested to clients in the Retry-After header of a 429 response.
+POOL_RETRY_AFTER = _setting("CV_POOL_RETRY_AFTER", 5, int)
+
+# -------- Section-Parallel Generation --------
+# When enabled, the Profile, Education and Work prompts of one CV are
+# dispatched to separate pool workers (separate model contexts) and run
+# concurrently, so CV latency approaches that of the slowest section.
+SECTION_PARALLEL = _setting("CV_SECTION_PARALLEL", True, bool)
+
+# -------- Token Streaming --------
+# /generate_stream forwards section text token by token. When enabled, text
+# is only released up to the last complete sentence, so the stream never has
+# to retract a trailing partial sentence, at the cost of a later first token.
+STREAM_HOLD_BACK = _setting("CV_STREAM_HOLD_BACK", False, bool)
+
+# -------- Constrained Output --------
+# Constrain every section with a GBNF grammar to one paragraph of sentences
+# ending in a period, so generation can only finish on a complete sentence.
+# Stop sequences end sections early regardless of this setting.
+SECTION_GRAMMAR = _setting("CV_SECTION_GRAMMAR", False, bool)
+
+# -------- Adaptive Token Budgets --------
+# Section max_tokens budgets are learned from observed output lengths per
+# section and entry count: the BUDGET_PERCENTILE of the last BUDGET_WINDOW
+# completions times BUDGET_HEADROOM, rounded up to BUDGET_STEP tokens and
+# capped by the fixed (entries + 0.5) * 60 heuristic, which is used until
+# BUDGET_MIN_SAMPLES completions were observed.
+BUDGET_ADAPTIVE = _setting("CV_BUDGET_ADAPTIVE", True, bool)
+BUDGET_PERCENTILE = _setting("CV_BUDGET_PERCENTILE", 90, float)
+BUDGET_WINDOW = _setting("CV_BUDGET_WINDOW", 200, int)
+BUDGET_MIN_SAMPLES = _setting("CV_BUDGET_MIN_SAMPLES", 20, int)
+BUDGET_HEADROOM = _setting("CV_BUDGET_HEADROOM", 1.15, float)
+BUDGET_STEP = _setting("CV_BUDGET_STEP", 16, int)
+
+# -------- Section Result Cache --------
+# Generation is deterministic (temperature 0.0), so section texts are cached
+# under a hash of the prompt, the generation parameters and the model file.
+CACHE_ENABLED = _setting("CV_CACHE_ENABLED", True, bool)
+
+# Maximum number of section texts held in the in-memory LRU tier.
+CACHE_MAX_ENTRIES = _setting("CV_CACHE_MAX_ENTRIES", 1024, int)
+
+# Seconds after which a cached section is regenerated (0 = never expires).
+CACHE_TTL = _setting("CV_CACHE_TTL", 7 * 24 * 3600, float)
+
+# Directory of the optional on-disk tier surviving restarts (empty = disabled)
+# and the maximum number of entries kept there.
+CACHE_DIR = _setting("CV_CACHE_DIR", "")
+CACHE_DISK_MAX_ENTRIES = _setting("CV_CACHE_DISK_MAX_ENTRIES", 20000, int)
+
+# -------- Prompt Prefix State Cache --------
+# Each worker evaluates the fixed instruction preamble of every prompt once,
+# snapshots the llama.cpp state and restores it for later prompts, so only
+# the user-specific suffix is evaluated. Bounded per worker by the number of
+# saved states and their total size (0 disables the byte limit).
+PREFIX_CACHE_STATES = _setting("CV_PREFIX_CACHE_STATES", 6, int)
+PREFIX_CACHE_MAX_BYTES = int(_setting("CV_PREFIX_CACHE_MB", 256, float) * 1024 * 1024)
+
+# -------- Batch Generation --------
+# Maximum section prompts of one /generate_cv_batch request (or batch CLI run)
+# on the inference pool at once. Defaults to the worker count, which keeps
+# every worker busy while leaving the admission queue to interactive requests.
+BATCH_MAX_IN_FLIGHT = max(1, _setting("CV_BATCH_MAX_IN_FLIGHT", POOL_WORKERS, int))
+
+# Largest /generate_cv_batch request body accepted (MB); larger ones get 413.
+# The body is read in full before the response starts.
+BATCH_MAX_BODY_BYTES = int(_setting("CV_BATCH_MAX_BODY_MB", 16, float) * 1024 * 1024)
+
+# -------- Generated CV Output Sink --------
+# Where finished CVs are stored: "none" (default, not stored) or "file", which
+# writes each CV to its own file named by request ID from a background thread.
+OUTPUT_SINK = _setting("CV_OUTPUT_SINK", "none").lower()
+OUTPUT_DIR = _setting("CV_OUTPUT_DIR", os.path.join(os.path.dirname(__file__), "cv_outputs"))
+OUTPUT_COMPRESS = _setting("CV_OUTPUT_COMPRESS", False, bool)
+
+# Maximum number of stored CV files; the oldest are deleted first (0 = keep all).
+OUTPUT_RETENTION = _setting("CV_OUTPUT_RETENTION", 1000, int)
+
+# CVs waiting to be written; beyond this, new CVs are dropped instead of
+# slowing down requests.
+OUTPUT_QUEUE_SIZE = _setting("CV_OUTPUT_QUEUE_SIZE", 256, int)
@@ -1,32 +1,141 @@
-import os
 import time  # For optional benchmarking and timing operations
 import re
-from llama_cpp import Llama
+import threading
+import uuid
+from functools import lru_cache
+from typing import TYPE_CHECKING
+from cv_config import (
+    SECTION_GRAMMAR,
+    CACHE_ENABLED,
+    CACHE_MAX_ENTRIES,
+    CACHE_TTL,
+    CACHE_DIR,
+    CACHE_DISK_MAX_ENTRIES,
+    PREFIX_CACHE_STATES,
+    PREFIX_CACHE_MAX_BYTES,
+    OUTPUT_SINK,
+    OUTPUT_DIR,
+    OUTPUT_COMPRESS,
+    OUTPUT_RETENTION,
+    OUTPUT_QUEUE_SIZE,
+    BUDGET_ADAPTIVE,
+    BUDGET_PERCENTILE,
+    BUDGET_WINDOW,
+    BUDGET_MIN_SAMPLES,
+    BUDGET_HEADROOM,
+    BUDGET_STEP
+)
+from model_registry import registry
+from output_sink import create_sink
+from result_cache import SectionCache, cache_key, model_digest
+from prefix_cache import prefix_cache_for
+from token_budget import BudgetEstimator, stop_index, partial_stop_length
+from metrics import SECTION_PROMPT_EVAL, SECTION_DURATION, SECTION_TOKENS_PER_SECOND, SECTION_TOKENS
 from prompt_builder import (
     build_profile_prompt,
     build_education_prompt,
-    build_work_prompt
+    build_work_prompt,
+    prompt_preamble,
+    SECTION_STOPS,
+    SECTION_GRAMMAR as SECTION_GRAMMAR_GBNF
 )
 
-# === Model Configuration ===
-# Path to the local GGUF-formatted TinyLLaMA model file
-model_path = os.path.expanduser(
-    "/home/azureuser/models/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf"
-)
+if TYPE_CHECKING:
+    from llama_cpp import Llama
 
-# Inference parameters for the LLaMA model
-n_ctx = 2048           # Maximum context window size (number of tokens)
+# === Model Configuration ===
+# The model itself is loaded lazily through `model_registry`; its path and
+# load options live in cv_config. These are the sampling parameters.
 temperature = 0.0      # Sampling temperature: 0.0 for deterministic output
 top_k = 5              # Number of highest-probability tokens to keep for sampling
 repeat_penalty = 1.1    # Penalty factor to discourage repeated text sequences
 
-# Instantiate the LLaMA model with the specified configuration
-llm = Llama(
-    model_path=model_path,
-    n_ctx=n_ctx,
-    verbose=False       # Suppress verbose logging during inference
+# Parsed section grammar per worker thread; llama.cpp advances a grammar's
+# state while sampling, so one instance must not be shared between workers.
+_grammar_local = threading.local()
+
+
+def section_grammar():
+    """
+    Return this thread's parsed section grammar, or None if disabled.
+    """
+    if not SECTION_GRAMMAR:
+        return None
+    grammar = getattr(_grammar_local, "grammar", None)
+    if grammar is None:
+        from llama_cpp import LlamaGrammar
+        grammar = _grammar_local.grammar = LlamaGrammar.from_string(SECTION_GRAMMAR_GBNF, verbose=False)
+    return grammar
+
+# === Section Result Cache ===
+# Output is deterministic at temperature 0.0, so identical prompts can be
+# answered from the cache instead of re-running inference.
+section_cache = SectionCache(
+    CACHE_MAX_ENTRIES,
+    ttl=CACHE_TTL,
+    disk_dir=CACHE_DIR or None,
+    disk_max_entries=CACHE_DISK_MAX_ENTRIES
+) if CACHE_ENABLED and temperature == 0.0 else None
+
+# === Token Budgets ===
+# max_tokens per section is learned from how long completions really are,
+# instead of always decoding up to the worst-case heuristic.
+budget_estimator = BudgetEstimator(
+    enabled=BUDGET_ADAPTIVE,
+    percentile=BUDGET_PERCENTILE,
+    window=BUDGET_WINDOW,
+    min_samples=BUDGET_MIN_SAMPLES,
+    headroom=BUDGET_HEADROOM,
+    step=BUDGET_STEP
 )
 
+# === Generated CV Output ===
+# Finished CVs are handed to a configurable sink (disabled by default)
+# instead of being written synchronously inside the request.
+output_sink = create_sink(OUTPUT_SINK, OUTPUT_DIR, OUTPUT_COMPRESS, OUTPUT_RETENTION, OUTPUT_QUEUE_SIZE)
+
+
+@lru_cache(maxsize=1)
+def _model_digest() -> str:
+    """Digest of the model file, part of every cache key (computed once)."""
+    return model_digest(registry.model_path)
+
+
+def prepare_cache_keys() -> None:
+    """
+    Compute the model digest ahead of the first request. It reads the model
+    file, so call it from a thread rather than the event loop.
+    """
+    _model_digest()
+
+
+def section_cache_key(prompt: str, stop) -> str:
+    """
+    Return the cache key of a section prompt under the current model and
+    generation parameters. The budget is left out, so a changed max_tokens
+    still finds texts that finished on their own (see cached_section).
+    """
+    return cache_key(prompt, {
+        "stop": list(stop),
+        "grammar": SECTION_GRAMMAR_GBNF if SECTION_GRAMMAR else None,
+        "temperature": temperature,
+        "top_k": top_k,
+        "repeat_penalty": repeat_penalty,
+        "n_ctx": registry.n_ctx,
+        "model": _model_digest(),
+    })
+
+
+def cached_section(section: dict):
+    """
+    Return the cached text of a planned section, or None if it must be
+    generated. A text that ran out of budget is only reused if the section's
+    budget is not larger.
+    """
+    if section_cache is None:
+        return None
+    return section_cache.get(section["cache_key"], section["max_tokens"])
+
 # === Utility Functions ===
 
 def clean_text(text: str) -> str:
@@ -88,90 +197,282 @@ def clean_education_output(text: str) -> str:
     main_content = cleaned.split("------")[0]
     return trim_to_last_period(main_content)
 
-# === CV Generation (Full Output) ===
+class SentenceStreamer:
+    """
+    Incremental counterpart of `trim_to_last_period(clean_text(...))` for
+    text that arrives token by token.
+
+    Each call to `feed` re-cleans the growing buffer and releases the text
+    not sent yet. With `hold_back`, only text up to the last complete
+    sentence is released, so nothing ever has to be taken back. Without it,
+    text is released as soon as it is produced (lowest time-to-first-token)
+    and `finish` reports how many trailing characters of an unfinished
+    sentence the final trim removed, so the client can retract them.
+    """
+
+    def __init__(self, hold_back: bool = False):
+        self._hold_back = hold_back
+        self._raw = ""
+        self._sent = ""
+
+    def _advance(self, text: str) -> str:
+        """
+        Return the part of `text` not released yet. If `text` no longer
+        extends what was released, nothing more is released.
+        """
+        if not text.startswith(self._sent):
+            return ""
+        delta = text[len(self._sent):]
+        self._sent = text
+        return delta
+
+    def feed(self, chunk: str) -> str:
+        """
+        Add a raw chunk and return newly releasable text (may be empty).
+        """
+        self._raw += chunk
+        cleaned = clean_text(self._raw)
+        if self._hold_back:
+            last_idx = cleaned.rfind(".")
+            cleaned = cleaned[:last_idx + 1] if last_idx != -1 else ""
+        return self._advance(cleaned)
+
+    def finish(self) -> tuple:
+        """
+        Post-process the complete buffer.
+
+        Returns:
+            tuple: (remaining text to release, number of already released
+            trailing characters to retract). At most one of them is non-empty.
+        """
+        final = trim_to_last_period(clean_text(self._raw))
+        if final.startswith(self._sent):
+            return self._advance(final), 0
+        retract = len(self._sent) - len(final) if self._sent.startswith(final) else 0
+        if retract:
+            self._sent = final
+        return "", retract
+
+    @property
+    def text(self) -> str:
+        """The text released so far, net of retractions."""
+        return self._sent
 
-def generate_cv_text(user_info: dict) -> dict:
+
+def sse_frame(text: str) -> str:
+    """
+    Format text as one SSE event, splitting embedded newlines into several
+    "data:" lines so clients reassemble them with the line breaks intact.
     """
-    Generate a complete CV based on structured user input.
+    return "".join(f"data: {line}\n" for line in text.split("\n")) + "\n"
 
-    This function orchestrates the following steps:
-      1. Initialize log storage and helper function.
-      2. Estimate token budgets for each CV section based on data counts.
-      3. Build tailored prompts for Profile, Education, and Work sections.
-      4. Run the LLaMA model for each prompt and clean its output.
-      5. Compose human-editable headings and bullet summaries.
-      6. Assemble final text, save to file, and return structured output.
+# === Section Planning & Inference ===
 
-    Args:
-        user_info (dict): A dictionary containing user details:
-            - 'name': Candidate's full name.
-            - 'education': List of education record dicts.
-            - 'work_experience': List of work experience dicts.
-            - 'job' (optional): Dict with 'title' and 'company_name'.
+# Log labels per section key, as shown by the synchronous and streaming paths
+SECTION_LABELS = {
+    "profile": ("Profile", "Generating Profile...", "Profile"),
+    "education": ("Education", "Generating education parts...", "Education"),
+    "work": ("Experience", "Generating work experience parts...", "Work Experience"),
+}
 
-    Returns:
-        dict: Contains generated CV headings, content per section, lists, and logs.
+# Static headings shown to the user above each generated paragraph
+CV_CONTACT_LINES = (
+    "Phone: [Please enter your phone number]",
+    "E-mail: [Please enter your email address]",
+)
+PROFILE_HEADING = "Profile:\n[You can briefly add a few sentences to describe yourself. Example:]"
+EXPERIENCE_HEADING = "Work Experience:\n[You can briefly describe your experience. Example:]"
+
+
+def education_heading(has_education: bool) -> str:
+    """
+    Return the Education heading, which depends on whether entries exist.
     """
-    # --- 1. Initialize logging ---
-    logs = []
+    return (
+        "Education:\n[You can briefly describe your education experience. Example:]"
+        if has_education else
+        "Education:\n[You can fill in your education background here.]"
+    )
 
-    def log(msg):
-        print(msg)
-        logs.append(msg)
 
-    # --- 2. Estimate token budgets ---
+def plan_sections(user_info: dict) -> list:
+    """
+    Estimate token budgets and build the prompt for every CV section.
+
+    The sections are independent of each other, so the returned plan can be
+    executed sequentially or dispatched to several model instances at once.
+
+    Args:
+        user_info (dict): Structured user input (see generate_cv_text).
+    Returns:
+        list: Section dicts in document order, each with 'key', 'prompt',
+        'entries', 'max_tokens', 'stop' and 'cache_key'. Education is
+        omitted when there are no entries.
+    """
     edu_len = len(user_info.get("education", []))
     work_len = len(user_info.get("work_experience", []))
     total_len = edu_len + work_len
 
-    # Allocate tokens: profile approx half entries * 60, others based on count
-    max_tokens_profile = int(((total_len / 2) + 0.5) * 60)
-    max_tokens_edu = int((edu_len + 0.5) * 60) if edu_len > 0 else 0
-    max_tokens_work = int((work_len + 0.5) * 60)
+    # Heuristic budgets: profile approx half entries * 60, others based on
+    # count. They cap the budgets learned from observed output lengths.
+    sections = [{
+        "key": "profile",
+        "prompt": build_profile_prompt(user_info),
+        "entries": total_len,
+        "max_tokens": int(((total_len / 2) + 0.5) * 60),
+    }]
+    if edu_len > 0:
+        sections.append({
+            "key": "education",
+            "prompt": build_education_prompt(user_info),
+            "entries": edu_len,
+            "max_tokens": int((edu_len + 0.5) * 60),
+        })
+    sections.append({
+        "key": "work",
+        "prompt": build_work_prompt(user_info),
+        "entries": work_len,
+        "max_tokens": int((work_len + 0.5) * 60),
+    })
+    for section in sections:
+        section["max_tokens"] = budget_estimator.budget(
+            section["key"], section["entries"], section["max_tokens"]
+        )
+        section["stop"] = SECTION_STOPS[section["key"]]
+        section["cache_key"] = section_cache_key(section["prompt"], section["stop"])
+    return sections
 
-    # --- 3. Build prompts ---
-    profile_prompt = build_profile_prompt(user_info)
-    edu_prompt = build_education_prompt(user_info) if edu_len > 0 else None
-    work_prompt = build_work_prompt(user_info)
 
-    # --- 4. LLaMA inference helper ---
-    def run_llama(prompt_text, label="", max_tokens=200):
-        """
-        Send prompt to LLaMA, log timing, and clean output.
+def prepare_prefix(model: "Llama", section: dict) -> None:
+    """
+    Restore (or build) the evaluated state of the section prompt's fixed
+    preamble so the model only has to process the user-specific suffix.
+    """
+    cache = prefix_cache_for(model, PREFIX_CACHE_STATES, PREFIX_CACHE_MAX_BYTES)
+    cache.prepare(prompt_preamble(section["prompt"]))
 
-        Args:
-            prompt_text (str): The text to feed the model.
-            label (str): Section name for logging.
-            max_tokens (int): Token limit for generation.
 
-        Returns:
-            str: Cleaned, complete-sentence output.
-        """
-        log(f"🤖 Generating {label}...")
-        start = time.time()
-        output = llm(
-            prompt=prompt_text,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            top_k=top_k,
-            repeat_penalty=repeat_penalty
-        )
-        duration = time.time() - start
-        log(f"✅ {label} done in {duration:.2f}s")
-        return trim_to_last_period(clean_text(output["choices"][0]["text"]))
+def decode_section(model: "Llama", section: dict, usage: dict):
+    """
+    Run the model on a planned section and yield the raw completion text
+    piece by piece, stopping early at the section's stop sequences (see
+    prompt_builder.SECTION_STOPS) and, if enabled, constrained by the
+    section grammar.
 
-    # Generate content for each CV section
-    profile_output = run_llama(profile_prompt, "Profile", max_tokens_profile)
-    education_output = run_llama(edu_prompt, "Education", max_tokens_edu) if edu_prompt else ""
-    work_output = run_llama(work_prompt, "Experience", max_tokens_work)
+    Stop sequences are matched here rather than through llama.cpp's `stop`
+    argument, which would also cut a completion opening with a blank line;
+    closing the stream ends decoding just as early. Text that could be the
+    start of a stop sequence is held back until it is resolved, so nothing
+    past the stop point is ever yielded.
 
-    # --- 5. Prepare headings and summaries ---
-    # Top-of-document heading with placeholders for user input
-    cv_heading = f"Name: {user_info.get('name', '[Unknown]')}\n" \
-                 f"Phone: [Please enter your phone number]\n" \
-                 f"E-mail: [Please enter your email address]"
+    Args:
+        model (Llama): Model instance to run on.
+        section (dict): One entry of plan_sections().
+        usage (dict): Filled with 'generated' (tokens decoded, counted as
+            streamed chunks), 'truncated' (True if the budget ran out
+            first), 'prompt_eval' (seconds until the first token) and
+            'decode' (seconds from the first token to the end).
+    Yields:
+        str: Raw completion text.
+    """
+    start = time.perf_counter()
+    first_token = None
+    prepare_prefix(model, section)
+    chunks = model(
+        prompt=section["prompt"],
+        max_tokens=section["max_tokens"],
+        temperature=temperature,
+        top_k=top_k,
+        repeat_penalty=repeat_penalty,
+        grammar=section_grammar(),
+        stream=True
+    )
+    stops = section["stop"]
+    raw, sent, generated, finish_reason = "", 0, 0, None
+
+    def timings() -> dict:
+        now = time.perf_counter()
+        first = first_token or now
+        return {"prompt_eval": first - start, "decode": now - first}
+
+    try:
+        for chunk in chunks:
+            if first_token is None:
+                first_token = time.perf_counter()
+            generated += 1
+            choice = chunk["choices"][0]
+            finish_reason = choice.get("finish_reason") or finish_reason
+            raw += choice["text"]
+            stop = stop_index(raw, stops)
+            if stop != -1:
+                if stop > sent:
+                    yield raw[sent:stop]
+                usage.update(generated=generated, truncated=False, **timings())
+                return
+            ready = len(raw) - partial_stop_length(raw, stops)
+            if ready > sent:
+                yield raw[sent:ready]
+                sent = ready
+    finally:
+        # Stops the llama.cpp generator when leaving early
+        chunks.close()
+    if len(raw) > sent:
+        yield raw[sent:]
+    usage.update(generated=generated, truncated=finish_reason == "length", **timings())
+
+
+def record_usage(model: "Llama", section: dict, usage: dict, text: str) -> None:
+    """
+    Report a finished completion to the budget estimator, counting the
+    tokens of the kept text to measure how much decoding was wasted, and
+    to the section metrics.
+    """
+    key, generated = section["key"], usage["generated"]
+    SECTION_PROMPT_EVAL.labels(key).observe(usage["prompt_eval"])
+    SECTION_DURATION.labels(key).observe(usage["prompt_eval"] + usage["decode"])
+    SECTION_TOKENS.labels(key).inc(generated)
+    if generated > 1 and usage["decode"] > 0:
+        # The first token is part of the prompt evaluation time
+        SECTION_TOKENS_PER_SECOND.labels(key).observe((generated - 1) / usage["decode"])
+
+    kept = len(model.tokenize(text.encode("utf-8"), add_bos=False)) if text else 0
+    budget_estimator.record(
+        key,
+        section["entries"],
+        section["max_tokens"],
+        generated,
+        kept,
+        usage["truncated"]
+    )
 
-    profile_heading = "Profile:\n[You can briefly add a few sentences to describe yourself. Example:]"
+
+def assemble_cv(user_info: dict, outputs: dict, logs: list, tokens_decoded: int = 0) -> dict:
+    """
+    Compose headings, bullet summaries and generated paragraphs into the
+    final CV, pass it to the output sink under a new request ID and return
+    the structured result.
+
+    Args:
+        user_info (dict): Structured user input.
+        outputs (dict): Generated text per section key; a missing key
+            yields an empty section.
+        logs (list): Log messages collected so far; appended to in place.
+        tokens_decoded (int): Tokens decoded for the CV's sections (0 when
+            every section came from the cache).
+    Returns:
+        dict: Contains generated CV headings, content per section, lists,
+        the request ID, tokens decoded and logs.
+    """
+    def log(msg):
+        print(msg)
+        logs.append(msg)
+
+    profile_output = outputs.get("profile", "")
+    education_output = outputs.get("education", "")
+    work_output = outputs.get("work", "")
+
+    # Top-of-document heading with placeholders for user input
+    cv_heading = f"Name: {user_info.get('name', '[Unknown]')}\n" + "\n".join(CV_CONTACT_LINES)
 
     # Bullet-style lists of raw entries for manual editing
     education_list = [
@@ -184,155 +485,42 @@ def generate_cv_text(user_info: dict) -> dict:
         for w in user_info.get("work_experience", [])
     ]
 
-    education_heading = (
-        "Education:\n[You can briefly describe your education experience. Example:]"
-        if education_list else
-        "Education:\n[You can fill in your education background here.]"
-    )
-
-    experience_heading = "Work Experience:\n[You can briefly describe your experience. Example:]"
+    edu_heading = education_heading(bool(education_list))
 
-    # --- 6. Assemble final document and persist ---
-    lines = [cv_heading + "\n", profile_heading, profile_output + "\n"]
-    lines.append(education_heading)
+    # Assemble final document and persist
+    lines = [cv_heading + "\n", PROFILE_HEADING, profile_output + "\n"]
+    lines.append(edu_heading)
     if education_list:
         lines.extend(education_list)
         lines.append(education_output + "\n")
     else:
         lines.append("[You can fill in your education background here.]\n")
 
-    lines.append(experience_heading.split("\n")[0])
+    lines.append(EXPERIENCE_HEADING.split("\n")[0])
     lines.extend(experience_list)
     lines.append(work_output + "\n")
 
     final_text = "\n".join(lines)
 
-    # Save generated CV to a file
-    with open("cv_output.txt", "w", encoding="utf-8") as f:
-        f.write(final_text)
-    log("✅ CV saved to cv_output.txt")
+    log(f"🔢 {tokens_decoded} tokens decoded for this CV")
+
+    # Hand the CV to the output sink; writing happens off the request path
+    request_id = uuid.uuid4().hex
+    if output_sink.submit(request_id, final_text):
+        log(f"✅ CV queued for saving as {request_id}")
 
     # Return a structured representation for API or further processing
     return {
         "cv_heading": cv_heading,
-        "profile_heading": profile_heading,
+        "profile_heading": PROFILE_HEADING,
         "profile_content": profile_output,
-        "education_heading": education_heading,
+        "education_heading": edu_heading,
         "education_list": education_list,
         "education_content": education_output if education_list else "",
-        "experience_heading": experience_heading,
+        "experience_heading": EXPERIENCE_HEADING,
         "experience_list": experience_list,
         "experience_content": work_output,
+        "request_id": request_id,
+        "tokens_decoded": tokens_decoded,
         "logs": logs
     }
-
-# === CV Generation (Streaming Version) ===
-def generate_cv_stream(user_info: dict):
-    """
-    Stream CV content in real-time using Server-Sent Events (SSE).
-
-    This generator yields:
-      - Initial heading placeholders.
-      - Section-by-section log messages and content lines.
-      - A final completion event.
-
-    Args:
-        user_info (dict): Same structure as for generate_cv_text.
-
-    Yields:
-        str: Formatted SSE "data:" frames with '\n\n' separators.
-    """
-    # Local import for timing inside generator
-    import time
-
-    # Helper to yield log messages as SSE events
-    def stream_log(msg):
-        print(msg)
-        yield f"data: {msg}\n\n"
-
-    start_all = time.time()
-
-    # Estimate token budgets (same logic as synchronous version)
-    edu_len = len(user_info.get("education", []))
-    work_len = len(user_info.get("work_experience", []))
-    total_len = edu_len + work_len
-
-    max_tokens_profile = int(((total_len / 2) + 0.5) * 60)
-    max_tokens_edu = int((edu_len + 0.5) * 60) if edu_len > 0 else 0
-    max_tokens_work = int((work_len + 0.5) * 60)
-
-    # Prepare prompts
-    profile_prompt = build_profile_prompt(user_info)
-    edu_prompt = build_education_prompt(user_info) if edu_len > 0 else None
-    work_prompt = build_work_prompt(user_info)
-
-    # --- CV heading events ---
-    name = user_info.get("name", "[Unknown]")
-    yield f"data: Name: {name}\n\n"
-    yield "data: Phone: [Please enter your phone number]\n\n"
-    yield "data: E-mail: [Please enter your email address]\n\n"
-
-    # --- Profile section ---
-    yield from stream_log("Generating Profile...")
-    profile_heading = "Profile:\n[You can briefly add a few sentences to describe yourself. Example:]"
-    yield f"data: {profile_heading}\n\n"
-    start = time.time()
-    profile_output = llm(
-        prompt=profile_prompt,
-        max_tokens=max_tokens_profile,
-        temperature=temperature,
-        top_k=top_k,
-        repeat_penalty=repeat_penalty
-    )
-    profile_text = trim_to_last_period(clean_text(profile_output["choices"][0]["text"]))
-    for line in profile_text.split("\n"):
-        yield f"data: {line.strip()}\n\n"
-    duration = time.time() - start
-    yield f"data: ✅ Profile done in {duration:.2f}s\n\n"
-
-    # --- Education section ---
-    if edu_prompt:
-        yield from stream_log("Generating education parts...")
-        education_heading = (
-            "Education:\n[You can briefly describe your education experience. Example:]"
-            if edu_len else
-            "Education:\n[You can fill in your education background here.]"
-        )
-        yield f"data: {education_heading}\n\n"
-        start = time.time()
-        edu_output = llm(
-            prompt=edu_prompt,
-            max_tokens=max_tokens_edu,
-            temperature=temperature,
-            top_k=top_k,
-            repeat_penalty=repeat_penalty
-        )
-        edu_text = trim_to_last_period(clean_text(edu_output["choices"][0]["text"]))
-        for line in edu_text.split("\n"):
-            yield f"data: {line.strip()}\n\n"
-        duration = time.time() - start
-        yield f"data: ✅ Education done in {duration:.2f}s\n\n"
-
-    # --- Work Experience section ---
-    yield from stream_log("Generating work experience parts...")
-    experience_heading = "Work Experience:\n[You can briefly describe your experience. Example:]"
-    yield f"data: {experience_heading}\n\n"
-    start = time.time()
-    work_output = llm(
-        prompt=work_prompt,
-        max_tokens=max_tokens_work,
-        temperature=temperature,
-        top_k=top_k,
-        repeat_penalty=repeat_penalty
-    )
-    work_text = trim_to_last_period(clean_text(work_output["choices"][0]["text"]))
-    for line in work_text.split("\n"):
-        yield f"data: {line.strip()}\n\n"
-    duration = time.time() - start
-    yield f"data: ✅ Work Experience done in {duration:.2f}s\n\n"
-
-    # --- Completion event ---
-    total_duration = time.time() - start_all
-    yield f"data: ✅ CV generated in {total_duration:.2f}s\n\n"
-    yield "data: [DONE]\n\n"
-
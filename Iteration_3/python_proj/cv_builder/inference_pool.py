@@ -0,0 +1,393 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Callable, Deque, Dict, Iterator, List
+
+from metrics import QUEUE_WAIT, POOL_RUN_TIME, percentile
+
+# Create a module-specific logger for diagnostic messages.
+logger = logging.getLogger(__name__)
+
+
+class PoolSaturatedError(Exception):
+    """Raised when every worker is busy and the admission queue is full (HTTP 429)."""
+
+
+class PoolUnavailableError(Exception):
+    """Raised when the pool has been shut down and accepts no new work (HTTP 503)."""
+
+
+# Sentinel pushed onto a stream queue once the worker-side generator is exhausted.
+_STREAM_END = object()
+
+
+class _Admission:
+    """
+    Pool capacity held by one request until each of its jobs is done.
+    """
+
+    def __init__(self, jobs: int):
+        self.jobs = jobs
+
+
+class InferencePool:
+    """
+    A bounded pool of inference worker threads.
+
+    Each worker thread lazily creates its own Llama instance through
+    `llm_factory` on first use and keeps it for the lifetime of the thread,
+    so concurrent requests never share a model context. Admission is bounded
+    to `workers + queue_size` outstanding requests, however many jobs each
+    one runs (e.g. one per CV section); beyond that new work is rejected
+    immediately instead of piling up behind a busy CPU.
+    """
+
+    def __init__(
+        self,
+        llm_factory: Callable[[], Any],
+        workers: int,
+        queue_size: int,
+        sample_window: int = 500
+    ):
+        self._llm_factory = llm_factory
+        self._workers = workers
+        self._capacity = workers + queue_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="cv-infer"
+        )
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Admission and outcome counters: `_pending` counts admitted requests,
+        # `_jobs` and `_running` their outstanding and running jobs
+        self._pending = 0
+        self._jobs = 0
+        self._running = 0
+        self._workers_loaded = 0
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+
+        # Rolling windows of per-request timings (seconds)
+        self._queue_wait: Deque[float] = deque(maxlen=sample_window)
+        self._run_time: Deque[float] = deque(maxlen=sample_window)
+
+    # ------------------------------------------------------------------
+    # Worker-side helpers
+    # ------------------------------------------------------------------
+    def _worker_llm(self):
+        """
+        Return the Llama instance owned by the current worker thread,
+        creating it on the first job this thread executes.
+        """
+        llm = getattr(self._local, "llm", None)
+        if llm is None:
+            logger.info(f"Loading model for worker {threading.current_thread().name}")
+            llm = self._llm_factory()
+            self._local.llm = llm
+            with self._lock:
+                self._workers_loaded += 1
+        return llm
+
+    def _admit(self, jobs: int = 1) -> _Admission:
+        """
+        Reserve capacity for one request running `jobs` jobs, or raise if
+        the pool cannot take it.
+        """
+        with self._lock:
+            if self._closed:
+                raise PoolUnavailableError("Inference pool is shut down")
+            if self._pending >= self._capacity:
+                self._counters["rejected"] += 1
+                raise PoolSaturatedError(
+                    f"Inference pool is saturated ({self._pending}/{self._capacity} requests)"
+                )
+            self._pending += 1
+            self._jobs += jobs
+            self._counters["submitted"] += jobs
+        return _Admission(jobs)
+
+    def _release(self, admission: _Admission) -> None:
+        """
+        Account for one finished job of a request, releasing the request's
+        capacity with its last job (lock held).
+        """
+        self._jobs -= 1
+        admission.jobs -= 1
+        if admission.jobs == 0:
+            self._pending -= 1
+
+    def _start(self, enqueued_at: float) -> float:
+        """
+        Record the queue wait of a job that has just reached a worker.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self._running += 1
+            self._queue_wait.append(started - enqueued_at)
+        QUEUE_WAIT.observe(started - enqueued_at)
+        return started
+
+    def _finish(self, admission: _Admission, enqueued_at: float, started: float, ok: bool) -> None:
+        """
+        Record the run time and outcome of a job and release its slot.
+        """
+        finished = time.perf_counter()
+        with self._lock:
+            self._running -= 1
+            self._release(admission)
+            self._run_time.append(finished - started)
+            self._counters["completed" if ok else "failed"] += 1
+        POOL_RUN_TIME.observe(finished - started)
+        logger.info(
+            f"Inference job {'done' if ok else 'failed'}: "
+            f"queued {started - enqueued_at:.2f}s, ran {finished - started:.2f}s"
+        )
+
+    def _release_unstarted(self, admission: _Admission) -> None:
+        """
+        Release the slot of a job that never reached a worker.
+        """
+        with self._lock:
+            self._release(admission)
+            self._counters["failed"] += 1
+
+    def _submit(self, fn: Callable[..., Any], args: tuple, admission: _Admission) -> asyncio.Future:
+        """
+        Hand an already-admitted job to the executor and return an awaitable
+        future for `fn(llm, *args)`.
+        """
+        enqueued_at = time.perf_counter()
+
+        def job():
+            started = self._start(enqueued_at)
+            ok = False
+            try:
+                result = fn(self._worker_llm(), *args)
+                ok = True
+                return result
+            finally:
+                self._finish(admission, enqueued_at, started, ok)
+
+        try:
+            future = self._executor.submit(job)
+        except RuntimeError:
+            # The executor refused the job (shut down between admit and submit)
+            self._release_unstarted(admission)
+            raise PoolUnavailableError("Inference pool is shut down")
+        # A job cancelled before reaching a worker never runs `_finish`
+        future.add_done_callback(lambda f: f.cancelled() and self._release_unstarted(admission))
+        return asyncio.wrap_future(future)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        Run `fn(llm, *args)` on a worker thread and await its result.
+
+        Raises:
+            PoolSaturatedError: If the admission queue is full.
+            PoolUnavailableError: If the pool has been shut down.
+        """
+        admission = self._admit()
+        return await self._submit(fn, args, admission)
+
+    def submit_all(
+        self, fn: Callable[..., Any], arg_list: List[tuple]
+    ) -> List[asyncio.Future]:
+        """
+        Dispatch `fn(llm, *args)` once per entry of `arg_list` so the jobs
+        run on separate workers concurrently.
+
+        The whole group is admitted at once, as one request, so a request is
+        either fully scheduled or rejected without leaving orphaned jobs
+        behind.
+
+        Returns:
+            One awaitable future per entry, in the order of `arg_list`.
+        """
+        if not arg_list:
+            return []
+        admission = self._admit(len(arg_list))
+        futures = []
+        for i, args in enumerate(arg_list):
+            try:
+                futures.append(self._submit(fn, args, admission))
+            except PoolUnavailableError:
+                # Release the slots reserved for the jobs never submitted
+                for _ in arg_list[i + 1:]:
+                    self._release_unstarted(admission)
+                raise
+        return futures
+
+    def _submit_stream(
+        self, gen_fn: Callable[..., Iterator[Any]], args: tuple, admission: _Admission
+    ) -> "StreamRelay":
+        """
+        Hand an already-admitted streaming job to the executor and return
+        the relay its items are forwarded to.
+        """
+        enqueued_at = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        relay = StreamRelay()
+
+        def push(item):
+            loop.call_soon_threadsafe(relay._queue.put_nowait, item)
+
+        def job():
+            started = self._start(enqueued_at)
+            ok = False
+            try:
+                # Skip work whose consumer went away while it was queued
+                if not relay._cancelled.is_set():
+                    gen = gen_fn(self._worker_llm(), *args)
+                    try:
+                        for item in gen:
+                            if relay._cancelled.is_set():
+                                break
+                            push(item)
+                    finally:
+                        gen.close()
+                ok = True
+            except Exception as e:
+                push(e)
+            finally:
+                self._finish(admission, enqueued_at, started, ok)
+                push(_STREAM_END)
+
+        try:
+            self._executor.submit(job)
+        except RuntimeError:
+            self._release_unstarted(admission)
+            raise PoolUnavailableError("Inference pool is shut down")
+        return relay
+
+    def open_stream(
+        self, gen_fn: Callable[..., Iterator[Any]], *args
+    ) -> "StreamRelay":
+        """
+        Start `gen_fn(llm, *args)` on a worker thread and return a relay
+        yielding each item it produces.
+
+        Admission happens immediately, so callers can turn a saturated pool
+        into an HTTP error before any response has been started. If the
+        consumer stops iterating (e.g. the client disconnected), the
+        worker-side generator is closed at its next yield.
+        """
+        admission = self._admit()
+        return self._submit_stream(gen_fn, args, admission)
+
+    def open_streams(
+        self, gen_fn: Callable[..., Iterator[Any]], arg_list: List[tuple]
+    ) -> List["StreamRelay"]:
+        """
+        Start `gen_fn(llm, *args)` once per entry of `arg_list` on separate
+        workers, admitting the whole group at once as one request.
+
+        Items of streams not being consumed yet are buffered in their relay,
+        so callers can read the streams one after another while all of them
+        are generated concurrently.
+
+        Returns:
+            One relay per entry, in the order of `arg_list`.
+        """
+        if not arg_list:
+            return []
+        admission = self._admit(len(arg_list))
+        relays = []
+        for i, args in enumerate(arg_list):
+            try:
+                relays.append(self._submit_stream(gen_fn, args, admission))
+            except PoolUnavailableError:
+                for relay in relays:
+                    relay.cancel()
+                for _ in arg_list[i + 1:]:
+                    self._release_unstarted(admission)
+                raise
+        return relays
+
+    def warm_up(self, fn: Callable[[Any], Any]) -> asyncio.Future:
+        """
+        Load the model of every worker and run `fn(llm)` once on each.
+
+        One job is sent per worker and the jobs wait for each other on a
+        barrier, which guarantees they land on distinct threads. Warm-up
+        bypasses admission control.
+
+        Returns:
+            A future resolving once every worker has been warmed up.
+        """
+        barrier = threading.Barrier(self._workers)
+
+        def job():
+            barrier.wait()
+            return fn(self._worker_llm())
+
+        return asyncio.gather(*(
+            asyncio.wrap_future(self._executor.submit(job)) for _ in range(self._workers)
+        ))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of pool occupancy, counters and timing percentiles.
+        """
+        with self._lock:
+            return {
+                "workers": self._workers,
+                "workers_loaded": self._workers_loaded,
+                "capacity": self._capacity,
+                "requests": self._pending,
+                "running": self._running,
+                "queued": self._jobs - self._running,
+                **self._counters,
+                "queue_wait_p50_s": round(percentile(self._queue_wait, 50), 4),
+                "queue_wait_p95_s": round(percentile(self._queue_wait, 95), 4),
+                "run_time_p50_s": round(percentile(self._run_time, 50), 4),
+                "run_time_p95_s": round(percentile(self._run_time, 95), 4),
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop admitting work and wait for running jobs to finish.
+        """
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait)
+
+
+class StreamRelay:
+    """
+    Async iterable receiving the items a worker-side generator yields.
+
+    Iterate it with `async for`; call `cancel()` to make the worker stop at
+    its next item (or skip the job entirely if it has not started yet).
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """
+        Ask the worker to stop producing items for this relay.
+        """
+        self._cancelled.set()
+
+    async def _iterate(self) -> AsyncGenerator[Any, None]:
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.cancel()
+
+    def __aiter__(self) -> AsyncGenerator[Any, None]:
+        return self._iterate()
@@ -1,6 +1,30 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
-from generator import generate_cv_text, generate_cv_stream
+import asyncio
+import json
+import time
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from model_registry import registry
+from generator import (
+    prepare_cache_keys,
+    section_cache,
+    budget_estimator,
+    output_sink
+)
+from pipeline import open_cv_events, observe_latency, collect_cv_async, sse_stream
+from metrics import POOL_REJECTED, metrics_payload
+from prefix_cache import prefix_cache_stats
+from batch import iter_jsonl, run_batch
+from inference_pool import InferencePool, PoolSaturatedError, PoolUnavailableError
+from cv_config import (
+    POOL_WORKERS,
+    POOL_QUEUE_SIZE,
+    POOL_THREADS_PER_WORKER,
+    POOL_RETRY_AFTER,
+    SECTION_PARALLEL,
+    MODEL_WARM_UP,
+    BATCH_MAX_IN_FLIGHT,
+    BATCH_MAX_BODY_BYTES
+)
 
 # Instantiate the FastAPI application with metadata
 app = FastAPI(
@@ -9,6 +33,72 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# -----------------------------------------------------------------------------
+# Inference Worker Pool
+# -----------------------------------------------------------------------------
+# CV generation is CPU-bound and blocking, so it runs on a bounded pool of
+# worker threads instead of the event loop. Each worker loads its own model
+# instance from the registry on first use (or during startup warm-up).
+def _load_worker_model():
+    """
+    Model factory for pool workers, splitting the CPU cores between them.
+    """
+    return registry.create(n_threads=POOL_THREADS_PER_WORKER)
+
+
+pool = InferencePool(_load_worker_model, POOL_WORKERS, POOL_QUEUE_SIZE)
+
+# Startup warm-up task (None when warm-up is disabled)
+_warm_up = None
+
+
+def _warm_up_worker(model):
+    """
+    Run a one-token generation so the first real request starts hot.
+    """
+    model(prompt="Hello", max_tokens=1)
+
+
+def _pool_error(e: Exception) -> HTTPException:
+    """
+    Translate a pool admission failure into the matching HTTP error.
+    """
+    if isinstance(e, PoolSaturatedError):
+        POOL_REJECTED.labels("saturated").inc()
+        return HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(POOL_RETRY_AFTER)}
+        )
+    POOL_REJECTED.labels("unavailable").inc()
+    return HTTPException(status_code=503, detail=str(e))
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    """
+    Compute the model digest of the section cache keys, then load every
+    worker's model in the background when warm-up is enabled; /ready
+    reports 503 until it completes.
+    """
+    global _warm_up
+    # Section cache keys include a digest of the model file: read it now,
+    # off the event loop, instead of inside the first request
+    await asyncio.to_thread(prepare_cache_keys)
+    if MODEL_WARM_UP:
+        _warm_up = asyncio.ensure_future(pool.warm_up(_warm_up_worker))
+
+
+@app.on_event("shutdown")
+def shutdown_pool():
+    """
+    Stop accepting work, let running generations finish and flush CVs
+    still waiting to be saved.
+    """
+    pool.shutdown()
+    output_sink.close()
+
+
 @app.get("/", tags=["health"])
 def hello():
     """
@@ -17,6 +107,76 @@ def hello():
     """
     return {"message": "✅ CV Generator API is running."}
 
+
+@app.get("/ready", tags=["health"])
+def ready():
+    """
+    Readiness endpoint.
+    Returns 200 once the service can generate without a model-load delay
+    (immediately when warm-up is disabled and models load on first use),
+    otherwise 503. Includes model load status either way.
+    """
+    if _warm_up is None:
+        state = "disabled"
+    elif not _warm_up.done():
+        state = "pending"
+    elif _warm_up.cancelled() or _warm_up.exception() is not None:
+        state = "failed"
+    else:
+        state = "done"
+    is_ready = state in ("disabled", "done")
+    body = {
+        "ready": is_ready,
+        "warm_up": state,
+        "workers": POOL_WORKERS,
+        "workers_loaded": pool.stats()["workers_loaded"],
+        **registry.status(),
+    }
+    return JSONResponse(body, status_code=200 if is_ready else 503)
+
+
+@app.get("/pool_stats", tags=["health"])
+def pool_stats():
+    """
+    Inference pool status endpoint.
+    Returns worker occupancy, admission counters and queue-wait/run-time percentiles.
+    """
+    return pool.stats()
+
+
+@app.get("/cache_stats", tags=["health"])
+def cache_stats():
+    """
+    Cache status endpoint.
+    Returns section result cache hit/miss/eviction counters ({"enabled": false}
+    if caching is off) and the prompt prefix state cache counters.
+    """
+    if section_cache is None:
+        return {"enabled": False, "prefix_states": prefix_cache_stats()}
+    return {"enabled": True, **section_cache.stats(), "prefix_states": prefix_cache_stats()}
+
+
+@app.get("/budget_stats", tags=["health"])
+def budget_stats():
+    """
+    Token budget status endpoint.
+    Returns decoded, wasted and truncated token counts per section and the
+    budgets learned per entry count.
+    """
+    return budget_estimator.stats()
+
+
+@app.get("/metrics", tags=["health"])
+def metrics():
+    """
+    Prometheus metrics endpoint.
+    Returns queue wait, prompt evaluation, tokens/s, time-to-first-token and
+    request latency histograms plus section and admission counters.
+    """
+    payload, content_type = metrics_payload()
+    return Response(payload, media_type=content_type)
+
+
 @app.post("/generate_cv", tags=["generation"])
 async def generate(request: Request):
     """
@@ -24,12 +184,19 @@ async def generate(request: Request):
     Expects:
       - request.json(): a dict containing user information.
     Returns:
-      - A complete CV text generated by the `generate_cv_text` function.
+      - The complete CV assembled by the section pipeline (see pipeline.py).
+      - 429 if the inference queue is full, 503 if the service is shutting down.
     """
+    received = time.perf_counter()
     # Parse the incoming JSON payload into a Python dict
     user_info = await request.json()
-    # Delegate CV text generation to the synchronous generator function
-    return generate_cv_text(user_info)
+    # Run the section pipeline on pool workers, one per section when parallel
+    try:
+        events = await open_cv_events(user_info, pool, SECTION_PARALLEL)
+    except (PoolSaturatedError, PoolUnavailableError) as e:
+        raise _pool_error(e)
+    return await collect_cv_async(observe_latency(events, "generate_cv", received))
+
 
 @app.post("/generate_stream", tags=["generation", "stream"])
 async def generate_stream(request: Request):
@@ -38,25 +205,59 @@ async def generate_stream(request: Request):
     Expects:
       - request.json(): a dict containing user information.
     Streams:
-      - Progressive log messages from `generate_cv_stream`.
+      - Progressive log messages and section content token by token; a
+        named "retract" event removes a trailing partial sentence.
     """
+    received = time.perf_counter()
     # Parse incoming JSON payload into a Python dict
     user_info = await request.json()
 
-    def event_generator():
-        """
-        Internal generator function that yields CV generation logs
-        formatted as SSE data events.
-        """
-        # Iterate over each log message from the streaming generator
-        for log in generate_cv_stream(user_info):
-            # Send each log as an SSE data event
-            yield f"data: {log}\n\n"
-        # Signal completion of the stream to the client
-        yield "data: [DONE]\n\n"
+    # Reserve workers before the response starts so overload maps to 429/503
+    try:
+        events = await open_cv_events(user_info, pool, SECTION_PARALLEL)
+    except (PoolSaturatedError, PoolUnavailableError) as e:
+        raise _pool_error(e)
 
     # Return a StreamingResponse with the required media type for SSE
     return StreamingResponse(
-        event_generator(),
+        sse_stream(observe_latency(events, "generate_stream", received)),
         media_type="text/event-stream"
     )
+
+
+@app.post("/generate_cv_batch", tags=["generation", "stream"])
+async def generate_cv_batch(request: Request):
+    """
+    Batch CV generation endpoint.
+    Expects:
+      - A JSON Lines request body, one user information object per line,
+        of at most CV_BATCH_MAX_BODY_MB (413 otherwise).
+    Streams:
+      - NDJSON: {"index", "cv"} or {"index", "error"} per record as each CV
+        completes, then a final {"summary": {...}} line with throughput and
+        deduplication counters.
+    """
+    # Read the whole body before the response starts: while a streaming
+    # response runs, servers older than ASGI 2.4 hand receive() to
+    # Starlette's disconnect listener, and reading the body there hangs
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > BATCH_MAX_BODY_BYTES:
+        raise HTTPException(status_code=413, detail=f"Batch body exceeds {BATCH_MAX_BODY_BYTES} bytes")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > BATCH_MAX_BODY_BYTES:
+            raise HTTPException(status_code=413, detail=f"Batch body exceeds {BATCH_MAX_BODY_BYTES} bytes")
+
+    async def chunks():
+        yield bytes(body)
+
+    async def ndjson_lines():
+        results = run_batch(iter_jsonl(chunks()), pool, BATCH_MAX_IN_FLIGHT)
+        async for item in results:
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        ndjson_lines(),
+        media_type="application/x-ndjson"
+    )
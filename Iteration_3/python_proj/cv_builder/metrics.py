@@ -0,0 +1,99 @@
+from typing import Iterable
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+# -----------------------------------------------------------------------------
+# Prometheus Metrics
+# -----------------------------------------------------------------------------
+# Latency and throughput of every stage of CV generation, exposed at /metrics.
+# Histograms keep per-bucket counts, so p50/p95/p99 can be computed by
+# Prometheus (histogram_quantile) over any time window.
+
+# Seconds, from a cache hit to a slow multi-section CV on a loaded machine
+_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+# Decoding speed of TinyLLaMA on CPU, in tokens per second
+_RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+
+# -------- Inference Pool --------
+QUEUE_WAIT = Histogram(
+    "cv_pool_queue_wait_seconds",
+    "Time a job waited for a free inference worker",
+    buckets=_LATENCY_BUCKETS
+)
+POOL_RUN_TIME = Histogram(
+    "cv_pool_run_seconds",
+    "Time a job occupied an inference worker",
+    buckets=_LATENCY_BUCKETS
+)
+POOL_REJECTED = Counter(
+    "cv_pool_rejected_total",
+    "Requests rejected at admission (saturated = 429, unavailable = 503)",
+    ["reason"]
+)
+
+# -------- Sections --------
+SECTIONS = Counter(
+    "cv_sections_total",
+    "Sections produced, by where the text came from (model or cache)",
+    ["section", "source"]
+)
+SECTION_PROMPT_EVAL = Histogram(
+    "cv_section_prompt_eval_seconds",
+    "Time from starting a section to its first generated token (prefix restore and prompt evaluation)",
+    ["section"],
+    buckets=_LATENCY_BUCKETS
+)
+SECTION_DURATION = Histogram(
+    "cv_section_duration_seconds",
+    "Total generation time of a section",
+    ["section"],
+    buckets=_LATENCY_BUCKETS
+)
+SECTION_TOKENS_PER_SECOND = Histogram(
+    "cv_section_tokens_per_second",
+    "Decoding speed of a section after its first token",
+    ["section"],
+    buckets=_RATE_BUCKETS
+)
+SECTION_TOKENS = Counter(
+    "cv_section_tokens_total",
+    "Tokens decoded, by section",
+    ["section"]
+)
+
+# -------- Requests --------
+TIME_TO_FIRST_TOKEN = Histogram(
+    "cv_time_to_first_token_seconds",
+    "Time from receiving a request to the first generated text of its CV",
+    ["endpoint"],
+    buckets=_LATENCY_BUCKETS
+)
+REQUEST_LATENCY = Histogram(
+    "cv_request_duration_seconds",
+    "Time from receiving a request to its CV being complete",
+    ["endpoint"],
+    buckets=_LATENCY_BUCKETS
+)
+
+
+def percentile(samples: Iterable[float], pct: float) -> float:
+    """
+    Return the given percentile (0-100) of a sample window, or 0.0 if empty.
+
+    Used for the in-process statistics (pool stats, token budgets and
+    benchmark reports), which keep raw samples rather than histograms.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def metrics_payload() -> tuple:
+    """
+    Return the current metrics in the Prometheus text format, with its
+    content type.
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from cv_config import (
+    MODEL_PATH,
+    MODEL_N_CTX,
+    MODEL_N_BATCH,
+    MODEL_USE_MMAP,
+    MODEL_USE_MLOCK
+)
+
+# Create a module-specific logger for diagnostic messages.
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Lazily loads and tracks the Llama instances of the CV Builder.
+
+    Nothing is loaded at import time: `llama_cpp` itself is only imported on
+    the first load, so modules depending on the registry can be imported by
+    tests and tooling on machines without the model. `get()` returns one
+    shared instance loaded on first use (thread-safe); `create()` loads an
+    additional instance for an inference worker that needs its own context.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        n_ctx: int,
+        n_batch: int,
+        use_mmap: bool,
+        use_mlock: bool
+    ):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self._n_batch = n_batch
+        self._use_mmap = use_mmap
+        self._use_mlock = use_mlock
+        self._shared = None
+        # Guards the first load of the shared instance; kept separate from
+        # `_lock` so status() never blocks behind a multi-second load.
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._loaded = 0
+        self._load_seconds = 0.0
+        self._last_error: Optional[str] = None
+
+    def create(self, n_threads: Optional[int] = None):
+        """
+        Load a new, independent Llama instance.
+
+        Args:
+            n_threads: CPU threads for this instance (llama.cpp default if None).
+        Returns:
+            A freshly loaded Llama instance.
+        """
+        from llama_cpp import Llama
+
+        start = time.time()
+        try:
+            model = Llama(
+                model_path=self.model_path,
+                n_ctx=self.n_ctx,
+                n_batch=self._n_batch,
+                n_threads=n_threads,
+                use_mmap=self._use_mmap,
+                use_mlock=self._use_mlock,
+                verbose=False       # Suppress verbose logging during inference
+            )
+        except Exception as e:
+            with self._lock:
+                self._last_error = str(e)
+            raise
+        duration = time.time() - start
+        with self._lock:
+            self._loaded += 1
+            self._load_seconds += duration
+            self._last_error = None
+        logger.info(f"Loaded {self.model_path} in {duration:.2f}s")
+        return model
+
+    def get(self):
+        """
+        Return the shared instance, loading it on first use.
+        """
+        if self._shared is None:
+            # Serialize the first load so concurrent callers share one instance
+            with self._load_lock:
+                if self._shared is None:
+                    self._shared = self.create()
+        return self._shared
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Return how many instances are loaded and the time spent loading them.
+        """
+        with self._lock:
+            return {
+                "model_path": self.model_path,
+                "instances_loaded": self._loaded,
+                "load_seconds": round(self._load_seconds, 2),
+                "last_error": self._last_error,
+            }
+
+
+# Registry configured from cv_config, used by the generator and the service.
+registry = ModelRegistry(
+    MODEL_PATH,
+    MODEL_N_CTX,
+    MODEL_N_BATCH,
+    MODEL_USE_MMAP,
+    MODEL_USE_MLOCK
+)
@@ -0,0 +1,115 @@
+import gzip
+import logging
+import os
+import queue
+import threading
+from collections import deque
+
+# Create a module-specific logger for diagnostic messages.
+logger = logging.getLogger(__name__)
+
+# Sentinel telling the writer thread to exit once the queue is drained.
+_STOP = object()
+
+
+class NullSink:
+    """
+    Output sink that discards generated CVs (the default).
+    """
+
+    enabled = False
+
+    def submit(self, request_id: str, text: str) -> bool:
+        return False
+
+    def close(self) -> None:
+        pass
+
+
+class AsyncFileSink:
+    """
+    Output sink storing each generated CV in its own file, off the request path.
+
+    `submit` only enqueues the text; a background thread writes it to
+    `<directory>/<request_id>.txt` (or `.txt.gz` when `compress` is set), so
+    concurrent requests never share a file and never wait on disk I/O. When
+    more than `retention` files exist, the oldest are deleted (0 keeps all).
+    If the writer falls behind and the queue is full, new CVs are dropped
+    with a warning rather than blocking the request.
+    """
+
+    enabled = True
+
+    def __init__(self, directory: str, compress: bool, retention: int, queue_size: int):
+        self._directory = directory
+        self._compress = compress
+        self._retention = retention
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        os.makedirs(directory, exist_ok=True)
+
+        # Existing files, oldest first, so retention also covers earlier runs
+        existing = [
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.endswith((".txt", ".txt.gz"))
+        ]
+        existing.sort(key=os.path.getmtime)
+        self._files = deque(existing)
+
+        self._thread = threading.Thread(target=self._run, name="cv-output-sink", daemon=True)
+        self._thread.start()
+
+    def submit(self, request_id: str, text: str) -> bool:
+        """
+        Queue a CV for writing. Returns False if it had to be dropped.
+        """
+        try:
+            self._queue.put_nowait((request_id, text))
+            return True
+        except queue.Full:
+            logger.warning(f"Output sink queue full, CV {request_id} not saved")
+            return False
+
+    def _write(self, request_id: str, text: str) -> None:
+        suffix = ".txt.gz" if self._compress else ".txt"
+        path = os.path.join(self._directory, f"{request_id}{suffix}")
+        data = text.encode("utf-8")
+        if self._compress:
+            data = gzip.compress(data)
+        with open(path, "wb") as f:
+            f.write(data)
+        self._files.append(path)
+
+        while self._retention and len(self._files) > self._retention:
+            oldest = self._files.popleft()
+            try:
+                os.remove(oldest)
+            except OSError:
+                continue
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            try:
+                self._write(*item)
+            except Exception as e:
+                logger.error(f"Failed to save CV {item[0]}: {e}")
+
+    def close(self) -> None:
+        """
+        Write every queued CV, then stop the writer thread.
+        """
+        self._queue.put(_STOP)
+        self._thread.join()
+
+
+def create_sink(kind: str, directory: str, compress: bool, retention: int, queue_size: int):
+    """
+    Build the output sink selected by configuration ("none" or "file").
+    """
+    if kind == "file":
+        return AsyncFileSink(directory, compress, retention, queue_size)
+    if kind != "none":
+        logger.warning(f"Unknown output sink {kind!r}, generated CVs will not be saved")
+    return NullSink()
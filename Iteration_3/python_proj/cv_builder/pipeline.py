@@ -0,0 +1,424 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from itertools import chain
+from typing import TYPE_CHECKING, AsyncIterator, Iterable, Iterator, Union
+
+from model_registry import registry
+from generator import (
+    SentenceStreamer,
+    plan_sections,
+    cached_section,
+    decode_section,
+    record_usage,
+    assemble_cv,
+    section_cache,
+    sse_frame,
+    education_heading,
+    CV_CONTACT_LINES,
+    PROFILE_HEADING,
+    EXPERIENCE_HEADING,
+    SECTION_LABELS
+)
+from cv_config import STREAM_HOLD_BACK
+from metrics import SECTIONS, TIME_TO_FIRST_TOKEN, REQUEST_LATENCY
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+    from inference_pool import InferencePool
+
+# -----------------------------------------------------------------------------
+# Section Pipeline
+# -----------------------------------------------------------------------------
+# Every way of generating a CV runs through the same stages:
+#
+#   plan (budgets + prompts) -> infer -> post-process -> render
+#
+# The engine functions below produce a stream of typed events; the JSON
+# endpoint, the SSE endpoint, the batch scheduler and the plain
+# generate_cv_text / generate_cv_stream helpers only consume them. Caching,
+# stop sequences, token budgets and instrumentation are applied in the
+# engine, so they hold for every consumer.
+
+
+# === Events ===
+
+@dataclass(frozen=True)
+class CVStarted:
+    """Generation of a CV began; `parallel` if its sections run concurrently."""
+    user_info: dict
+    parallel: bool = False
+
+
+@dataclass(frozen=True)
+class SectionStarted:
+    """A section is about to be generated, or replayed from the cache."""
+    key: str
+    cached: bool = False
+
+
+@dataclass(frozen=True)
+class SectionToken:
+    """New cleaned text to append to the section."""
+    key: str
+    text: str
+
+
+@dataclass(frozen=True)
+class SectionRetract:
+    """The last `chars` characters sent for the section must be removed."""
+    key: str
+    chars: int
+
+
+@dataclass(frozen=True)
+class SectionDone:
+    """A section is complete; `text` is its final, post-processed content."""
+    key: str
+    text: str
+    duration: float = 0.0
+    first_token: float = 0.0
+    tokens: int = 0
+    cached: bool = False
+
+
+@dataclass(frozen=True)
+class CVDone:
+    """The CV is assembled; `cv` is the structured result of assemble_cv()."""
+    cv: dict
+    duration: float
+    tokens: int
+
+
+CVEvent = Union[CVStarted, SectionStarted, SectionToken, SectionRetract, SectionDone, CVDone]
+
+
+# === Infer + Post-process ===
+
+def cached_section_events(key: str, text: str) -> list:
+    """
+    Return the section events replaying a cached section text.
+    """
+    return [SectionToken(key, text), SectionDone(key, text, cached=True)]
+
+
+def section_events(model: "Llama", section: dict, check_cache: bool = True) -> Iterator[CVEvent]:
+    """
+    Run the model on one planned section, streaming its cleaned text.
+
+    Args:
+        model (Llama): Model instance to run on.
+        section (dict): One entry of plan_sections().
+        check_cache (bool): Look the section up in the result cache first;
+            callers that already did so pass False.
+    Yields:
+        SectionToken for each new piece of cleaned text, SectionRetract if
+        a trailing partial sentence must be removed, then SectionDone.
+    """
+    key = section["key"]
+    cached = cached_section(section) if check_cache else None
+    if cached is not None:
+        yield from cached_section_events(key, cached)
+        return
+
+    start = time.time()
+    first_token = None
+    usage = {}
+    streamer = SentenceStreamer(hold_back=STREAM_HOLD_BACK)
+    for piece in decode_section(model, section, usage):
+        if first_token is None:
+            first_token = time.time() - start
+        delta = streamer.feed(piece)
+        if delta:
+            yield SectionToken(key, delta)
+    delta, retract = streamer.finish()
+    if delta:
+        yield SectionToken(key, delta)
+    if retract:
+        yield SectionRetract(key, retract)
+    duration = time.time() - start
+    record_usage(model, section, usage, streamer.text)
+    if section_cache is not None:
+        section_cache.put(section["cache_key"], streamer.text,
+                          section["max_tokens"] if usage["truncated"] else None)
+    yield SectionDone(key, streamer.text, duration, first_token or duration, usage["generated"])
+
+
+def run_section(model: "Llama", section: dict, check_cache: bool = True) -> SectionDone:
+    """
+    Run one planned section to completion and return its SectionDone event.
+    """
+    for event in section_events(model, section, check_cache):
+        if isinstance(event, SectionDone):
+            return event
+
+
+class CVAssembler:
+    """
+    Collects the section events of one CV, keeping the generation log, and
+    assembles the final CV once every section is done.
+    """
+
+    def __init__(self):
+        self.outputs = {}
+        self.logs = []
+        self.tokens = 0
+        self._start = time.time()
+
+    def _log(self, msg: str) -> None:
+        print(msg)
+        self.logs.append(msg)
+
+    def add(self, event: CVEvent) -> None:
+        """Record one event; only section start and completion matter here."""
+        if isinstance(event, SectionStarted) and not event.cached:
+            self._log(f"🤖 Generating {SECTION_LABELS[event.key][0]}...")
+        elif isinstance(event, SectionDone):
+            label = SECTION_LABELS[event.key][0]
+            self.outputs[event.key] = event.text
+            SECTIONS.labels(event.key, "cache" if event.cached else "model").inc()
+            if event.cached:
+                self._log(f"♻️ {label} served from cache")
+            else:
+                self.tokens += event.tokens
+                self._log(f"✅ {label} done in {event.duration:.2f}s ({event.tokens} tokens)")
+
+    def finish(self, user_info: dict) -> CVDone:
+        """Assemble the CV from the sections recorded so far."""
+        cv = assemble_cv(user_info, self.outputs, self.logs, self.tokens)
+        return CVDone(cv, time.time() - self._start, self.tokens)
+
+
+# === Engines ===
+
+def cv_events(user_info: dict, model: "Llama" = None) -> Iterator[CVEvent]:
+    """
+    Generate a CV on one model instance, one section after the other.
+
+    Args:
+        user_info (dict): Structured user input (see generate_cv_text).
+        model (Llama, optional): Model instance to run on; defaults to the
+            registry's shared instance. Inference workers pass their own.
+    Yields:
+        CVStarted, then per section SectionStarted and its section events,
+        then CVDone.
+    """
+    model = model or registry.get()
+    assembler = CVAssembler()
+    yield CVStarted(user_info)
+    for section in plan_sections(user_info):
+        key = section["key"]
+        cached = cached_section(section)
+        if cached is not None:
+            events = [SectionStarted(key, cached=True), *cached_section_events(key, cached)]
+        else:
+            events = chain([SectionStarted(key)], section_events(model, section, check_cache=False))
+        for event in events:
+            assembler.add(event)
+            yield event
+    yield assembler.finish(user_info)
+
+
+async def open_cv_events(user_info: dict, pool: "InferencePool", parallel: bool) -> AsyncIterator[CVEvent]:
+    """
+    Start generating a CV on the inference pool and return its event stream.
+
+    Pool capacity is reserved before this returns, so PoolSaturatedError or
+    PoolUnavailableError surface to the caller before any event is sent.
+
+    With `parallel`, sections missing from the cache run on separate
+    workers at once and are relayed in document order: the first streams
+    live while the others generate in the background, their buffered events
+    flushed as soon as their turn comes. Otherwise the whole CV runs on one
+    worker through cv_events().
+    """
+    if not parallel:
+        return pool.open_stream(lambda model, info: cv_events(info, model), user_info)
+
+    sections = plan_sections(user_info)
+    # Answer cached sections directly; only the rest take up pool workers.
+    # A lookup may read the disk tier, so it runs off the event loop
+    cached = await asyncio.to_thread(lambda: {s["key"]: cached_section(s) for s in sections})
+    missing = [s for s in sections if cached[s["key"]] is None]
+    relays = dict(zip(
+        (s["key"] for s in missing),
+        pool.open_streams(section_events, [(s, False) for s in missing]) if missing else []
+    ))
+    return _relay_parallel(user_info, sections, cached, relays)
+
+
+async def _relay_parallel(user_info: dict, sections: list, cached: dict, relays: dict):
+    """
+    Yield the events of a CV whose sections were started on separate workers.
+    """
+    assembler = CVAssembler()
+    try:
+        yield CVStarted(user_info, parallel=True)
+        for section in sections:
+            key = section["key"]
+            started = SectionStarted(key, key not in relays)
+            assembler.add(started)
+            yield started
+            if key in relays:
+                source = relays[key]
+            else:
+                source = _aiter(cached_section_events(key, cached[key]))
+            async for event in source:
+                assembler.add(event)
+                yield event
+        yield assembler.finish(user_info)
+    finally:
+        # Stop sections still generating if the consumer went away
+        for relay in relays.values():
+            relay.cancel()
+
+
+async def _aiter(events: Iterable[CVEvent]):
+    for event in events:
+        yield event
+
+
+# === Consumers ===
+
+async def _close(events: AsyncIterator[CVEvent]) -> None:
+    """
+    Stop an event stream early, cancelling generation still in flight.
+    """
+    if hasattr(events, "aclose"):
+        await events.aclose()
+    elif hasattr(events, "cancel"):
+        events.cancel()
+
+
+async def observe_latency(events: AsyncIterator[CVEvent], endpoint: str, received: float):
+    """
+    Pass an event stream through, recording the request's time to first
+    token and total latency (from `received`, a time.perf_counter() value).
+    """
+    first_token = True
+    try:
+        async for event in events:
+            if first_token and isinstance(event, SectionToken):
+                first_token = False
+                TIME_TO_FIRST_TOKEN.labels(endpoint).observe(time.perf_counter() - received)
+            elif isinstance(event, CVDone):
+                REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - received)
+            yield event
+    finally:
+        await _close(events)
+
+
+def collect_cv(events: Iterable[CVEvent]) -> dict:
+    """
+    Consume an event stream and return the assembled CV.
+    """
+    for event in events:
+        if isinstance(event, CVDone):
+            return event.cv
+    raise RuntimeError("CV event stream ended before the CV was assembled")
+
+
+async def collect_cv_async(events: AsyncIterator[CVEvent]) -> dict:
+    """
+    Consume an asynchronous event stream and return the assembled CV.
+    """
+    try:
+        async for event in events:
+            if isinstance(event, CVDone):
+                return event.cv
+    finally:
+        # Cancels generation still in flight if we stop early
+        await _close(events)
+    raise RuntimeError("CV event stream ended before the CV was assembled")
+
+
+def section_heading(key: str) -> str:
+    """
+    Return the heading shown above a section's generated paragraph.
+    """
+    if key == "profile":
+        return PROFILE_HEADING
+    if key == "education":
+        return education_heading(True)
+    return EXPERIENCE_HEADING
+
+
+def render_sse(event: CVEvent) -> str:
+    """
+    Render one event as Server-Sent Events frames.
+
+    Tokens are sent as plain "data:" events to be appended to the section
+    text; a retraction is a named "retract" event whose data is the number
+    of trailing characters to remove. The stream ends with "[DONE]".
+    """
+    if isinstance(event, SectionToken):
+        return sse_frame(event.text)
+    if isinstance(event, SectionRetract):
+        return f"event: retract\ndata: {event.chars}\n\n"
+    if isinstance(event, SectionStarted):
+        heading = sse_frame(section_heading(event.key))
+        return heading if event.cached else f"data: {SECTION_LABELS[event.key][1]}\n\n" + heading
+    if isinstance(event, SectionDone):
+        label = SECTION_LABELS[event.key][2]
+        if event.cached:
+            return f"data: ♻️ {label} served from cache\n\n"
+        return (
+            f"data: ✅ {label} done in {event.duration:.2f}s "
+            f"(first token after {event.first_token:.2f}s, {event.tokens} tokens)\n\n"
+        )
+    if isinstance(event, CVStarted):
+        frames = f"data: Name: {event.user_info.get('name', '[Unknown]')}\n\n"
+        frames += "".join(f"data: {line}\n\n" for line in CV_CONTACT_LINES)
+        if event.parallel:
+            frames += "data: Generating all sections in parallel...\n\n"
+        return frames
+    return (
+        f"data: ✅ CV generated in {event.duration:.2f}s ({event.tokens} tokens decoded)\n\n"
+        "data: [DONE]\n\n"
+    )
+
+
+async def sse_stream(events: AsyncIterator[CVEvent]):
+    """
+    Render an asynchronous event stream as SSE frames.
+    """
+    async for event in events:
+        yield render_sse(event)
+
+
+# === CV Generation (Full Output / Streaming) ===
+
+def generate_cv_text(user_info: dict, model: "Llama" = None) -> dict:
+    """
+    Generate a complete CV based on structured user input.
+
+    Args:
+        user_info (dict): A dictionary containing user details:
+            - 'name': Candidate's full name.
+            - 'education': List of education record dicts.
+            - 'work_experience': List of work experience dicts.
+            - 'job' (optional): Dict with 'title' and 'company_name'.
+        model (Llama, optional): Model instance to run on; defaults to the
+            registry's shared instance.
+
+    Returns:
+        dict: Contains generated CV headings, content per section, lists,
+        request ID, tokens decoded and logs.
+    """
+    return collect_cv(cv_events(user_info, model))
+
+
+def generate_cv_stream(user_info: dict, model: "Llama" = None) -> Iterator[str]:
+    """
+    Stream CV content in real-time using Server-Sent Events (SSE).
+
+    Args:
+        user_info (dict): Same structure as for generate_cv_text.
+        model (Llama, optional): Model instance to run on; defaults to the
+            registry's shared instance.
+
+    Yields:
+        str: Formatted SSE frames, ending with "data: [DONE]".
+    """
+    for event in cv_events(user_info, model):
+        yield render_sse(event)
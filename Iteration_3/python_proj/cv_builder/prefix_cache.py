@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict
+
+# Create a module-specific logger for diagnostic messages.
+logger = logging.getLogger(__name__)
+
+
+class PrefixStateCache:
+    """
+    Bounded cache of llama.cpp states for fixed prompt preambles.
+
+    For each preamble the model evaluates it once and the resulting KV state
+    is snapshotted with `Llama.save_state()`. Before a prompt starting with
+    that preamble is run, the snapshot is restored with `Llama.load_state()`;
+    llama-cpp-python then matches the longest common token prefix with the
+    restored context and only evaluates the user-specific suffix.
+
+    States are kept in LRU order and evicted once more than `max_states`
+    are held or their combined size exceeds `max_bytes` (0 = no byte limit).
+    A cache belongs to one Llama instance and is only used from the worker
+    thread owning that instance.
+    """
+
+    def __init__(self, model, max_states: int, max_bytes: int = 0):
+        self._model = model
+        self._max_states = max_states
+        self._max_bytes = max_bytes
+        self._states: "OrderedDict[str, Any]" = OrderedDict()
+        self._prefix_tokens: Dict[str, list] = {}
+        self._bytes = 0
+        self._counters = {"restores": 0, "reuses": 0, "primes": 0, "evictions": 0}
+
+    def _tokens(self, preamble: str) -> list:
+        """
+        Tokenize a preamble, dropping its last token: the tokenizer may merge
+        the final characters with the start of the user-specific suffix, so
+        only the tokens before it are guaranteed to prefix the full prompt.
+        """
+        tokens = self._prefix_tokens.get(preamble)
+        if tokens is None:
+            tokens = self._model.tokenize(preamble.encode("utf-8"))[:-1]
+            self._prefix_tokens[preamble] = tokens
+        return tokens
+
+    def _prime(self, preamble: str, tokens: list):
+        """
+        Evaluate a preamble from an empty context and snapshot the state.
+        """
+        start = time.time()
+        self._model.reset()
+        self._model.eval(tokens)
+        state = self._model.save_state()
+        self._counters["primes"] += 1
+        logger.info(f"Primed prefix state ({len(tokens)} tokens) in {time.time() - start:.2f}s")
+
+        self._states[preamble] = state
+        self._bytes += state.llama_state_size
+        self._evict()
+        return state
+
+    def _evict(self) -> None:
+        """
+        Drop least recently used states until within the configured bounds.
+        """
+        while len(self._states) > self._max_states or (
+            self._max_bytes and self._bytes > self._max_bytes and len(self._states) > 1
+        ):
+            preamble, state = self._states.popitem(last=False)
+            self._bytes -= state.llama_state_size
+            self._prefix_tokens.pop(preamble, None)
+            self._counters["evictions"] += 1
+
+    def prepare(self, preamble: str) -> None:
+        """
+        Make sure the model context starts with the evaluated `preamble`
+        before a prompt beginning with it is run.
+        """
+        if not preamble or self._max_states <= 0:
+            return
+        tokens = self._tokens(preamble)
+        if not tokens:
+            return
+
+        # The context may still hold this preamble from the previous prompt
+        n_tokens = self._model.n_tokens
+        if n_tokens >= len(tokens) and list(self._model.input_ids[:len(tokens)]) == tokens:
+            self._counters["reuses"] += 1
+            return
+
+        state = self._states.get(preamble)
+        if state is None:
+            self._prime(preamble, tokens)
+            return
+        self._states.move_to_end(preamble)
+        self._model.load_state(state)
+        self._counters["restores"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the number and size of held states plus usage counters.
+        """
+        return {"states": len(self._states), "bytes": self._bytes, **self._counters}
+
+
+# One cache per model instance, dropped together with the instance.
+_caches: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def prefix_cache_for(model, max_states: int, max_bytes: int = 0) -> PrefixStateCache:
+    """
+    Return the prefix state cache attached to a model instance, creating it
+    on first use.
+    """
+    with _caches_lock:
+        cache = _caches.get(model)
+        if cache is None:
+            cache = PrefixStateCache(model, max_states, max_bytes)
+            _caches[model] = cache
+        return cache
+
+
+def prefix_cache_stats() -> Dict[str, Any]:
+    """
+    Return the stats of every live prefix cache, summed over instances.
+    """
+    totals: Dict[str, Any] = {"instances": 0}
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        totals["instances"] += 1
+        for name, value in cache.stats().items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
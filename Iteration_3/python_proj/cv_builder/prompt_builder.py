@@ -1,5 +1,80 @@
 from typing import Dict, List
 
+# -----------------------------------------------------------------------------
+# Fixed Prompt Preambles
+# -----------------------------------------------------------------------------
+# Every prompt opens with an instruction block that is the same for all users.
+# The generator evaluates each block once and reuses the resulting model state,
+# so only the user-specific remainder of a prompt has to be processed.
+_PROFILE_INTRO = (
+    "Please write a concise, professional paragraph in the first-person perspective "
+    "that highlights my key qualifications, skills and achievements"
+)
+PROFILE_JOB_PREAMBLE = _PROFILE_INTRO + ' relevant to the position "'
+PROFILE_PREAMBLE = (
+    _PROFILE_INTRO + ". Focus only on information appearing in the CV clip below; "
+    "do not invent new experiences or details. Use strong action verbs and precise "
+    "language. In English only.\n------\nName: "
+)
+
+_EDUCATION_INTRO = (
+    "Add one very short paragraph for the following CV clip in Education part, "
+    "use the first-person perspective.\n"
+)
+EDUCATION_JOB_PREAMBLE = _EDUCATION_INTRO + 'The cv is specific for job: "'
+EDUCATION_PREAMBLE = (
+    _EDUCATION_INTRO + "Don't describe anything other than education parts.\n"
+    "Don't make up any experiences.\nIn English only.\n------\n"
+)
+
+_WORK_INTRO = (
+    "Add one very short paragraph for the following CV clip in Work Experience part, "
+    "use the first-person perspective.\n"
+)
+WORK_JOB_PREAMBLE = _WORK_INTRO + 'The cv is specific for job: "'
+WORK_PREAMBLE = (
+    _WORK_INTRO + "Don't describe anything other than work experience parts.\n"
+    "Don't make up any experiences.\nIn English only.\n------\n"
+)
+
+# All fixed preambles, used to look up the one a prompt starts with.
+PROMPT_PREAMBLES = (
+    PROFILE_JOB_PREAMBLE,
+    PROFILE_PREAMBLE,
+    EDUCATION_JOB_PREAMBLE,
+    EDUCATION_PREAMBLE,
+    WORK_JOB_PREAMBLE,
+    WORK_PREAMBLE,
+)
+
+# -----------------------------------------------------------------------------
+# Section Stop Sequences
+# -----------------------------------------------------------------------------
+# Each section is one paragraph. Generation ends at the "------" separator of
+# the CV clip, a paragraph break, or the model starting to echo the clip
+# format (a new "Description:" or the section's own entry label).
+_COMMON_STOPS = ("------", "\n\n", "Description:")
+SECTION_STOPS = {
+    "profile": _COMMON_STOPS + ("Name:",),
+    "education": _COMMON_STOPS + ("Education:",),
+    "work": _COMMON_STOPS + ("Experience:",),
+}
+
+# GBNF grammar optionally constraining a section to one paragraph of
+# sentences that each end with a period. A period followed by anything but a
+# space or line break stays inside the sentence ("e.g.", "3.5", "Node.js").
+SECTION_GRAMMAR = r"""
+root ::= " "? sentence (" " sentence)*
+sentence ::= [^ .\n] ([^.\n] | "." [^ \n])* "."
+"""
+
+
+def prompt_preamble(prompt: str) -> str:
+    """
+    Return the fixed preamble the given prompt starts with, or "" if none.
+    """
+    return max((p for p in PROMPT_PREAMBLES if prompt.startswith(p)), key=len, default="")
+
 def build_profile_prompt(user_info: Dict) -> str:
     """
     Create a prompt for generating the profile section of a CV.
@@ -31,7 +106,7 @@ def build_profile_prompt(user_info: Dict) -> str:
 
     # Select the appropriate prompt template
     if job_title:
-        prompt = f"""Please write a concise, professional paragraph in the first-person perspective that highlights my key qualifications, skills and achievements relevant to the position "{job_title}" at "{company_name}".
+        prompt = f"""{PROFILE_JOB_PREAMBLE}{job_title}" at "{company_name}".
 Focus only on information appearing in the CV clip below; do not invent new experiences or details. Use strong action verbs and precise language. In English only.  
 ------
 Name: {name}
@@ -41,9 +116,7 @@ Description: Please add Description on personal profile in maximum 1 paragraph.
 ------
 Output as Description:"""
     else:
-        prompt = f"""Please write a concise, professional paragraph in the first-person perspective that highlights my key qualifications, skills and achievements. Focus only on information appearing in the CV clip below; do not invent new experiences or details. Use strong action verbs and precise language. In English only.
-------
-Name: {name}
+        prompt = f"""{PROFILE_PREAMBLE}{name}
 {edu_text}
 {work_text}
 Description: Please add Description on personal profile in maximum 1 paragraph.
@@ -73,8 +146,7 @@ def build_education_prompt(user_info: Dict) -> str:
 
     # Select prompt template
     if job_title:
-        prompt = f"""Add one very short paragraph for the following CV clip in Education part, use the first-person perspective.
-The cv is specific for job: \"{job_title}\" at \"{company_name}\".
+        prompt = f"""{EDUCATION_JOB_PREAMBLE}{job_title}\" at \"{company_name}\".
 Don't describe anything other than education parts.
 Don't make up any experiences.
 In English only.
@@ -84,12 +156,7 @@ Description: Please add Description on education history in maximum 1 paragraph.
 ------
 Output as Description:"""
     else:
-        prompt = f"""Add one very short paragraph for the following CV clip in Education part, use the first-person perspective.
-Don't describe anything other than education parts.
-Don't make up any experiences.
-In English only.
-------
-{edu_text}
+        prompt = f"""{EDUCATION_PREAMBLE}{edu_text}
 Description: Please add Description on education history in maximum 1 paragraph.
 ------
 Output as Description:"""
@@ -117,8 +184,7 @@ def build_work_prompt(user_info: Dict) -> str:
 
     # Select prompt template
     if job_title:
-        prompt = f"""Add one very short paragraph for the following CV clip in Work Experience part, use the first-person perspective.
-The cv is specific for job: \"{job_title}\" at \"{company_name}\".
+        prompt = f"""{WORK_JOB_PREAMBLE}{job_title}\" at \"{company_name}\".
 Don't describe anything other than work experience parts.
 Don't make up any experiences.
 In English only.
@@ -128,12 +194,7 @@ Description: Please add Description on work experience in maximum 1 paragraph.
 ------
 Output as Description:"""
     else:
-        prompt = f"""Add one very short paragraph for the following CV clip in Work Experience part, use the first-person perspective.
-Don't describe anything other than work experience parts.
-Don't make up any experiences.
-In English only.
-------
-{work_text}
+        prompt = f"""{WORK_PREAMBLE}{work_text}
 Description: Please add Description on work experience in maximum 1 paragraph.
 ------
 Output as Description:"""
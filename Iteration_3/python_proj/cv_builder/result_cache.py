@@ -0,0 +1,230 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Create a module-specific logger for diagnostic messages.
+logger = logging.getLogger(__name__)
+
+# Bytes hashed from each end of the model file when computing its digest
+_DIGEST_EDGE_BYTES = 4 * 1024 * 1024
+
+
+def model_digest(path: str) -> str:
+    """
+    Compute a cheap content digest of a model file.
+
+    Hashing a multi-hundred-megabyte GGUF file on every start would be slow,
+    so the digest covers the file size plus its first and last 4 MiB, which
+    include the GGUF header/metadata and differ between quantizations.
+
+    Args:
+        path: Filesystem path to the model file.
+    Returns:
+        A hex SHA-256 digest, or "missing" if the file cannot be read.
+    """
+    try:
+        size = os.path.getsize(path)
+        h = hashlib.sha256(str(size).encode())
+        with open(path, "rb") as f:
+            h.update(f.read(_DIGEST_EDGE_BYTES))
+            if size > _DIGEST_EDGE_BYTES:
+                f.seek(max(_DIGEST_EDGE_BYTES, size - _DIGEST_EDGE_BYTES))
+                h.update(f.read())
+        return h.hexdigest()
+    except OSError:
+        return "missing"
+
+
+def cache_key(prompt: str, params: Dict[str, Any]) -> str:
+    """
+    Build a content-addressed key from a prompt and its generation parameters.
+
+    Parameters are serialized canonically (sorted keys, no whitespace) so the
+    same inputs always map to the same key.
+    """
+    canonical = json.dumps({"prompt": prompt, "params": params},
+                           sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SectionCache:
+    """
+    Two-tier cache of generated section texts.
+
+    - Memory tier: an LRU of at most `max_entries` texts.
+    - Disk tier (optional): one JSON file per key under `disk_dir`, which
+      survives restarts; trimmed to `disk_max_entries` oldest-first.
+
+    Entries older than `ttl` seconds (0 disables expiry) are treated as
+    misses and dropped in both tiers. A text stored with a `limit` (the
+    max_tokens it ran out at) only answers lookups whose budget is not
+    larger; a larger budget could complete it.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float = 0,
+        disk_dir: Optional[str] = None,
+        disk_max_entries: int = 0
+    ):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._disk_dir = disk_dir
+        self._disk_max_entries = disk_max_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts_since_trim = 0
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Disk tier helpers
+    # ------------------------------------------------------------------
+    def _disk_path(self, key: str) -> str:
+        """Return the file path of a key, sharded by its first two hex digits."""
+        return os.path.join(self._disk_dir, key[:2], f"{key}.json")
+
+    def _expired(self, created: float) -> bool:
+        return bool(self._ttl) and time.time() - created > self._ttl
+
+    def _disk_get(self, key: str) -> Optional[tuple]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            created, text, limit = entry["created"], entry["text"], entry.get("limit")
+        except (OSError, ValueError, KeyError):
+            return None
+        if self._expired(created):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return created, text, limit
+
+    def _disk_put(self, key: str, created: float, text: str, limit: Optional[int]) -> None:
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": created, "text": text, "limit": limit}, f, ensure_ascii=False)
+            # Atomic replace so readers never see a half-written entry
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {key}: {e}")
+
+    def _disk_trim(self) -> None:
+        """
+        Drop expired entries and the oldest entries beyond the size limit.
+        """
+        entries = []
+        for root, _, files in os.walk(self._disk_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        entries.append((os.path.getmtime(path), path))
+                    except OSError:
+                        continue
+        entries.sort()
+        excess = len(entries) - self._disk_max_entries if self._disk_max_entries else 0
+        removed = 0
+        for i, (mtime, path) in enumerate(entries):
+            if i < excess or self._expired(mtime):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    continue
+        with self._lock:
+            self._counters["evictions"] += removed
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _usable(entry: tuple, max_tokens: Optional[int]) -> bool:
+        """Whether a text cut short at its limit also answers a `max_tokens` budget."""
+        limit = entry[2]
+        return limit is None or max_tokens is None or max_tokens <= limit
+
+    def get(self, key: str, max_tokens: Optional[int] = None) -> Optional[str]:
+        """
+        Return the cached text for `key`, or None on a miss (including a
+        text cut short at a smaller budget than `max_tokens`).
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._expired(entry[0]):
+                    del self._memory[key]
+                elif self._usable(entry, max_tokens):
+                    self._memory.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return entry[1]
+                else:
+                    self._counters["misses"] += 1
+                    return None
+
+        entry = self._disk_get(key) if self._disk_dir else None
+        with self._lock:
+            if entry is None or not self._usable(entry, max_tokens):
+                self._counters["misses"] += 1
+                return None
+            # Promote the disk hit into the memory tier
+            self._counters["disk_hits"] += 1
+            self._store_memory(key, entry)
+            return entry[1]
+
+    def _store_memory(self, key: str, entry: tuple) -> None:
+        """Insert an entry into the LRU, evicting the least recently used. Lock held."""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_entries:
+            self._memory.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def put(self, key: str, text: str, limit: Optional[int] = None) -> None:
+        """
+        Store `text` under `key` in every enabled tier; `limit` is the
+        max_tokens the text was cut short at, if it ran out of budget.
+        """
+        entry = (time.time(), text, limit)
+        with self._lock:
+            self._store_memory(key, entry)
+            self._counters["stores"] += 1
+            self._puts_since_trim += 1
+            trim = self._disk_dir and self._puts_since_trim >= 64
+            if trim:
+                self._puts_since_trim = 0
+
+        if self._disk_dir:
+            self._disk_put(key, *entry)
+            # Trimming walks the whole directory, so only do it periodically
+            if trim:
+                self._disk_trim()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return hit/miss counters and the current memory-tier size.
+        """
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["disk_hits"] + self._counters["misses"]
+            hit_ratio = (lookups - self._counters["misses"]) / lookups if lookups else 0.0
+            return {
+                "memory_entries": len(self._memory),
+                "max_entries": self._max_entries,
+                "disk_enabled": bool(self._disk_dir),
+                **self._counters,
+                "hit_ratio": round(hit_ratio, 4),
+            }
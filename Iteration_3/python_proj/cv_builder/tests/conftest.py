@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The CV builder modules import each other by bare name (run from cv_builder/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,47 @@
+from result_cache import SectionCache, cache_key
+
+
+def test_cache_key_is_canonical():
+    assert cache_key("prompt", {"a": 1, "b": [2]}) == cache_key("prompt", {"b": [2], "a": 1})
+    assert cache_key("prompt", {"a": 1}) != cache_key("prompt", {"a": 2})
+
+
+def test_complete_text_answers_any_budget():
+    cache = SectionCache(max_entries=4)
+    cache.put("k", "Finished on its own.")
+    assert cache.get("k", 100) == "Finished on its own."
+    assert cache.get("k", 1000) == "Finished on its own."
+
+
+def test_truncated_text_needs_budget_not_larger():
+    cache = SectionCache(max_entries=4)
+    cache.put("k", "Cut short at", limit=200)
+    assert cache.get("k", 200) == "Cut short at"
+    assert cache.get("k", 150) == "Cut short at"
+    assert cache.get("k", 300) is None
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    # The regenerated text replaces it
+    cache.put("k", "Complete now.")
+    assert cache.get("k", 300) == "Complete now."
+
+
+def test_disk_tier_keeps_limit(tmp_path):
+    cache = SectionCache(max_entries=4, disk_dir=str(tmp_path))
+    cache.put("ab12", "Cut short at", limit=200)
+    restarted = SectionCache(max_entries=4, disk_dir=str(tmp_path))
+    assert restarted.get("ab12", 300) is None
+    assert restarted.get("ab12", 200) == "Cut short at"
+    assert restarted.stats()["disk_hits"] == 1
+
+
+def test_lru_evicts_least_recently_used():
+    cache = SectionCache(max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    cache.get("a")
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.stats()["evictions"] == 1
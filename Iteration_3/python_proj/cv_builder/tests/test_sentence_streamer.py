@@ -0,0 +1,46 @@
+from generator import SentenceStreamer
+
+
+def feed_all(streamer, chunks):
+    return [streamer.feed(chunk) for chunk in chunks]
+
+
+def test_streams_at_once_and_retracts_unfinished_sentence():
+    streamer = SentenceStreamer()
+    assert feed_all(streamer, ["Led a team", " of five. Built", " tools"]) == [
+        "Led a team", " of five. Built", " tools"
+    ]
+    assert streamer.finish() == ("", len(" Built tools"))
+    assert streamer.text == "Led a team of five."
+
+
+def test_hold_back_releases_complete_sentences_only():
+    streamer = SentenceStreamer(hold_back=True)
+    assert feed_all(streamer, ["Led a team", " of five. Built", " tools."]) == [
+        "", "Led a team of five.", " Built tools."
+    ]
+    assert streamer.finish() == ("", 0)
+    assert streamer.text == "Led a team of five. Built tools."
+
+
+def test_hold_back_never_retracts():
+    streamer = SentenceStreamer(hold_back=True)
+    feed_all(streamer, ["Led a team.", " Built"])
+    assert streamer.finish() == ("", 0)
+    assert streamer.text == "Led a team."
+
+
+def test_line_breaks_are_merged_as_text_arrives():
+    streamer = SentenceStreamer()
+    assert feed_all(streamer, [" Led\n", "a team."]) == ["Led", " a team."]
+    assert streamer.finish() == ("", 0)
+    assert streamer.text == "Led a team."
+
+
+def test_text_without_period_is_kept_whole():
+    for hold_back in (False, True):
+        streamer = SentenceStreamer(hold_back=hold_back)
+        released = "".join(feed_all(streamer, ["No period", " here"]))
+        delta, retract = streamer.finish()
+        assert retract == 0
+        assert released + delta == streamer.text == "No period here"
@@ -0,0 +1,93 @@
+from token_budget import BudgetEstimator, partial_stop_length, stop_index
+
+STOPS = ("------", "\n\n", "Description:")
+
+
+def test_stop_index_finds_earliest_stop():
+    assert stop_index("Led a team.\n\nDescription: x", STOPS) == 11
+    assert stop_index("Led a team. Description: x\n\n", STOPS) == 12
+    assert stop_index("Led a team.", STOPS) == -1
+
+
+def test_stop_index_skips_leading_whitespace():
+    assert stop_index("\n\nLed a team.", STOPS) == -1
+    assert stop_index("\n\nLed a team.\n\n", STOPS) == 13
+
+
+def test_partial_stop_length_holds_back_stop_prefix():
+    assert partial_stop_length("Led a team.\n", STOPS) == 1
+    assert partial_stop_length("Led a team. Descr", STOPS) == 5
+    assert partial_stop_length("Led a team. ---", STOPS) == 3
+    assert partial_stop_length("Led a team.", STOPS) == 0
+    assert partial_stop_length("Led a team. -", STOPS) == 1
+
+
+def estimator(**options):
+    settings = {"percentile": 90, "window": 4, "min_samples": 3, "headroom": 1.0, "step": 16}
+    settings.update(options)
+    return BudgetEstimator(**settings)
+
+
+def record(budgets, generated, budget=480, truncated=False, entries=2):
+    budgets.record("work", entries, budget, generated, generated, truncated)
+
+
+def test_heuristic_until_enough_samples():
+    budgets = estimator()
+    for _ in range(2):
+        record(budgets, 100)
+    assert budgets.budget("work", 2, 480) == 480
+    record(budgets, 100)
+    # 100 tokens rounded up to a multiple of the step
+    assert budgets.budget("work", 2, 480) == 112
+    # Never above the heuristic, and learned per entry count
+    assert budgets.budget("work", 2, 64) == 64
+    assert budgets.budget("work", 3, 480) == 480
+
+
+def test_budget_follows_percentile_with_headroom():
+    budgets = estimator(percentile=50, headroom=1.5)
+    for generated in (40, 60, 200):
+        record(budgets, generated)
+    # Median 60 * 1.5 = 90, rounded up to 96
+    assert budgets.budget("work", 2, 480) == 96
+
+
+def test_rolling_window_forgets_old_lengths():
+    budgets = estimator()
+    for generated in (300, 300, 300, 300):
+        record(budgets, generated)
+    assert budgets.budget("work", 2, 480) == 304
+    for generated in (100, 100, 100, 100):
+        record(budgets, generated)
+    assert budgets.budget("work", 2, 480) == 112
+
+
+def test_truncated_completions_raise_budget():
+    budgets = estimator(growth=1.25)
+    for _ in range(3):
+        record(budgets, 100)
+    assert budgets.budget("work", 2, 480) == 112
+    for _ in range(4):
+        record(budgets, 112, budget=112, truncated=True)
+    # Recorded as needing 112 * 1.25 = 140 tokens
+    assert budgets.budget("work", 2, 480) == 144
+
+
+def test_disabled_estimator_keeps_heuristic():
+    budgets = estimator(enabled=False)
+    for _ in range(4):
+        record(budgets, 100)
+    assert budgets.budget("work", 2, 480) == 480
+
+
+def test_stats_report_waste():
+    budgets = estimator()
+    budgets.record("work", 2, 480, 200, 150, False)
+    budgets.record("work", 2, 480, 480, 400, True)
+    work = budgets.stats()["sections"]["work"]
+    assert work["completions"] == 2
+    assert work["truncated"] == 1
+    assert work["wasted_tokens"] == 130
+    assert work["waste_ratio"] == round(130 / 680, 3)
+    assert work["budgets"] == {"2": {"samples": 2, "learned_budget": None}}
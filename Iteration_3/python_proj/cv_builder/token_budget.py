@@ -0,0 +1,155 @@
+import math
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+from metrics import percentile
+
+def stop_index(text: str, stops) -> int:
+    """
+    Return where the first of the `stops` sequences starts in `text`, or -1.
+
+    Leading whitespace is skipped, so a completion that opens with a blank
+    line is not cut off before it has produced any text.
+    """
+    start = len(text) - len(text.lstrip())
+    hits = [i for i in (text.find(stop, start) for stop in stops) if i != -1]
+    return min(hits) if hits else -1
+
+
+def partial_stop_length(text: str, stops) -> int:
+    """
+    Return the length of the longest suffix of `text` that could still grow
+    into one of the `stops` sequences; that part must be held back until it
+    is resolved.
+    """
+    longest = 0
+    for stop in stops:
+        for n in range(len(stop) - 1, longest, -1):
+            if text.endswith(stop[:n]):
+                longest = n
+                break
+    return longest
+
+
+class BudgetEstimator:
+    """
+    Learns `max_tokens` budgets per section from observed output lengths.
+
+    The fixed heuristic (`(entries + 0.5) * 60` tokens) is sized for the
+    worst case, and whatever runs past the last full sentence is trimmed
+    away, so most of the tail of each generation is wasted decoding. For
+    every (section, entry count) the estimator keeps a rolling window of
+    the tokens a completion actually needed and budgets the configured
+    percentile of it plus some headroom.
+
+    A completion that stopped by itself needed exactly what it generated.
+    One cut off by its budget needed more than that, so it is recorded as
+    `budget * growth`, letting the percentile climb back when budgets prove
+    too tight. Budgets are rounded up to a multiple of `step` tokens, which
+    keeps them stable, and never exceed the heuristic. Until `min_samples` completions were seen
+    for a key, the heuristic is used unchanged.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        percentile: float = 90,
+        window: int = 200,
+        min_samples: int = 20,
+        headroom: float = 1.15,
+        step: int = 16,
+        growth: float = 1.25
+    ):
+        self._enabled = enabled
+        self._percentile = percentile
+        self._window = window
+        self._min_samples = min_samples
+        self._headroom = headroom
+        self._step = max(1, step)
+        self._growth = growth
+        self._samples: Dict[Tuple[str, int], Deque[float]] = {}
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _learned(self, key: Tuple[str, int]):
+        """
+        Return the learned budget of a key, or None without enough samples.
+        Must be called with the lock held.
+        """
+        samples = self._samples.get(key)
+        if samples is None or len(samples) < self._min_samples:
+            return None
+        needed = percentile(samples, self._percentile) * self._headroom
+        return max(self._step, math.ceil(needed / self._step) * self._step)
+
+    def budget(self, section: str, entries: int, default: int) -> int:
+        """
+        Return the token budget for a section with `entries` entries.
+
+        Args:
+            section: Section key ("profile", "education" or "work").
+            entries: Number of entries the section describes.
+            default: Heuristic budget, used until enough samples exist and
+                as the upper bound of learned budgets.
+        """
+        if not self._enabled:
+            return default
+        with self._lock:
+            learned = self._learned((section, entries))
+        return default if learned is None else min(default, learned)
+
+    def record(
+        self,
+        section: str,
+        entries: int,
+        budget: int,
+        generated: int,
+        kept: int,
+        truncated: bool
+    ) -> None:
+        """
+        Record one completion.
+
+        Args:
+            section: Section key.
+            entries: Number of entries the section describes.
+            budget: The `max_tokens` the completion ran with.
+            generated: Tokens decoded.
+            kept: Tokens of the text left after post-processing.
+            truncated: True if the completion hit its budget.
+        """
+        needed = budget * self._growth if truncated else generated
+        with self._lock:
+            samples = self._samples.get((section, entries))
+            if samples is None:
+                samples = self._samples[(section, entries)] = deque(maxlen=self._window)
+            samples.append(needed)
+
+            totals = self._totals.setdefault(section, {
+                "completions": 0, "truncated": 0, "budget_tokens": 0,
+                "generated_tokens": 0, "wasted_tokens": 0,
+            })
+            totals["completions"] += 1
+            totals["truncated"] += int(truncated)
+            totals["budget_tokens"] += budget
+            totals["generated_tokens"] += generated
+            totals["wasted_tokens"] += max(0, generated - kept)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return per-section token totals and the currently learned budgets.
+        """
+        with self._lock:
+            sections = {name: dict(totals) for name, totals in self._totals.items()}
+            budgets: Dict[str, Dict[str, Any]] = {}
+            for key in sorted(self._samples):
+                budgets.setdefault(key[0], {})[str(key[1])] = {
+                    "samples": len(self._samples[key]),
+                    "learned_budget": self._learned(key),
+                }
+        for name, totals in sections.items():
+            generated = totals["generated_tokens"]
+            totals["waste_ratio"] = round(totals["wasted_tokens"] / generated, 3) if generated else 0.0
+            totals["budgets"] = budgets.get(name, {})
+        return {"enabled": self._enabled, "sections": sections}